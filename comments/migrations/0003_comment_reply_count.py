@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:37
+
+from django.conf import settings
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def backfill_reply_counts(apps, schema_editor):
+    from comments.models import decode_path
+
+    Comment = apps.get_model('comments', 'Comment')
+    counts = Counter()
+    for path in Comment.objects.values_list('path', flat=True).iterator(chunk_size=2000):
+        counts.update(decode_path(path)[:-1])
+
+    batch = []
+    for comment_id, count in counts.items():
+        batch.append(Comment(pk=comment_id, reply_count=count))
+        if len(batch) >= 1000:
+            Comment.objects.bulk_update(batch, ['reply_count'])
+            batch = []
+    if batch:
+        Comment.objects.bulk_update(batch, ['reply_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0002_comment_threads'),
+        ('posts', '0007_vote'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', 'created_at', 'id'], name='comment_root_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', '-reply_count', '-id'], name='comment_root_top_idx'),
+        ),
+        migrations.RunPython(backfill_reply_counts, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,34 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
 from posts.models import Post
 
+# Materialized path: one fixed-width base-36 segment per ancestor, so sorting
+# by path yields depth-first thread order and a subtree is a path range
+PATH_SEGMENT_LENGTH = 8
+PATH_MAX_LENGTH = 255
+MAX_THREAD_DEPTH = PATH_MAX_LENGTH // PATH_SEGMENT_LENGTH
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def encode_path_segment(comment_id):
+    """Fixed-width base-36 encoding of a comment id"""
+    digits = ''
+    while comment_id:
+        comment_id, remainder = divmod(comment_id, 36)
+        digits = PATH_DIGITS[remainder] + digits
+    return digits.rjust(PATH_SEGMENT_LENGTH, '0')
+
+
+def decode_path(path):
+    """Comment ids along a path, root first"""
+    return [
+        int(path[i:i + PATH_SEGMENT_LENGTH], 36)
+        for i in range(0, len(path), PATH_SEGMENT_LENGTH)
+    ]
+
+
 class Comment(models.Model):
     post = models.ForeignKey(
         Post, 
@@ -9,43 +36,90 @@ class Comment(models.Model):
         related_name='comments'
     )
     author = models.ForeignKey(User, on_delete=models.CASCADE)
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='replies'
+    )
+    path = models.CharField(max_length=PATH_MAX_LENGTH, blank=True, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+    # Number of descendants, kept up to date on reply and delete
+    reply_count = models.PositiveIntegerField(default=0)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_thread_idx'),
+            # All comments of a post in the default created_at ordering
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_date_idx'),
+            # Top-level comments of a post for each comment sort
+            models.Index(fields=['post', 'depth', 'created_at', 'id'], name='comment_root_date_idx'),
+            models.Index(fields=['post', 'depth', '-reply_count', '-id'], name='comment_root_top_idx'),
+            # Newest edit in a post's thread, for conditional GET of the post page
+            models.Index(fields=['post', 'updated_at'], name='comment_post_updated_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.author} on {self.post}'
 
+    def save(self, *args, **kwargs):
+        is_new = self.pk is None
+        if is_new and self.parent is not None:
+            # Replies past the maximum depth join the deepest allowed level
+            while self.parent.depth >= MAX_THREAD_DEPTH - 1:
+                self.parent = self.parent.parent
+            self.post_id = self.parent.post_id
+        super().save(*args, **kwargs)
+
+        if is_new and not self.path:
+            # The path ends with this comment's own id, known only after the insert
+            prefix = self.parent.path if self.parent else ''
+            self.path = prefix + encode_path_segment(self.pk)
+            self.depth = self.parent.depth + 1 if self.parent else 0
+            Comment.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+            if self.parent:
+                Comment.objects.filter(pk__in=self.ancestor_ids()).update(
+                    reply_count=F('reply_count') + 1
+                )
+
+    def delete(self, *args, **kwargs):
+        ancestors = self.ancestor_ids()
+        removed = self.reply_count + 1
+        result = super().delete(*args, **kwargs)
+        if ancestors:
+            Comment.objects.filter(pk__in=ancestors).update(
+                reply_count=Greatest(F('reply_count') - removed, 0)
+            )
+        return result
+
+    def ancestor_ids(self):
+        """Ids of every ancestor, decoded from the path without a query"""
+        return decode_path(self.path)[:-1]
+
+    def subtree_range(self):
+        """(low, high) path bounds of every descendant of this comment"""
+        return self.path, self.path + 'z' * (PATH_MAX_LENGTH - len(self.path))
+
+    def _permissions(self):
+        from .permissions import CommentPermissions
+        return CommentPermissions(getattr(self, '_current_user', None), self.post)
+
     @property
     def can_edit(self):
         """Checks if the current user can edit the comment"""
-        from django.contrib.auth.models import AnonymousUser
-        user = getattr(self, '_current_user', None)
-        
-        if not user or isinstance(user, AnonymousUser):
-            return False
-            
-        return user == self.author
+        # Flags precomputed by CommentPermissions.apply for a rendered thread
+        if hasattr(self, '_can_edit'):
+            return self._can_edit
+        return self._permissions().can_edit(self)
 
     @property
     def can_delete(self):
         """Checks if the current user can delete a comment"""
-        from django.contrib.auth.models import AnonymousUser
-        from communities.models import Community
-        
-        user = getattr(self, '_current_user', None)
-        
-        if not user or isinstance(user, AnonymousUser):
-            return False
-            
-        is_moderator = False
-        if self.post.community:
-            is_moderator = self.post.community.is_moderator(user)
-        
-        return (user == self.author or 
-                user.is_staff or 
-                user == self.post.author or
-                is_moderator)
\ No newline at end of file
+        if hasattr(self, '_can_delete'):
+            return self._can_delete
+        return self._permissions().can_delete(self)
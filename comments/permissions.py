@@ -0,0 +1,51 @@
+"""What a viewer may do with the comments of a post, resolved once per request."""
+
+
+class CommentPermissions:
+    """The viewer's standing on one post: staff, post author or community moderator.
+
+    Built once per (request, post), so permission checks while rendering a
+    thread are attribute lookups instead of one moderator query per comment.
+    """
+
+    def __init__(self, user, post):
+        self.post_id = post.pk
+        self.user_id = user.pk if user is not None and user.is_authenticated else None
+        self.can_moderate = False
+
+        if self.user_id is None:
+            return
+        # Cheapest checks first; the moderator lookup is a single indexed EXISTS
+        self.can_moderate = (
+            user.is_staff
+            or post.author_id == self.user_id
+            or self._is_moderator(post.community_id)
+        )
+
+    def _is_moderator(self, community_id):
+        from communities.models import Community
+
+        if community_id is None:
+            return False
+        return Community.has_user('moderators', community_id, self.user_id)
+
+    def can_edit(self, comment):
+        return self.user_id is not None and comment.author_id == self.user_id
+
+    def can_delete(self, comment):
+        return self.user_id is not None and (comment.author_id == self.user_id or self.can_moderate)
+
+    def apply(self, comments):
+        """Stores the edit/delete flags on every comment for the templates"""
+        for comment in comments:
+            comment._can_edit = self.can_edit(comment)
+            comment._can_delete = self.can_delete(comment)
+        return comments
+
+
+def get_comment_permissions(request, post):
+    """The request's CommentPermissions for ``post``, built on first use"""
+    cache = request.__dict__.setdefault('_comment_permissions', {})
+    if post.pk not in cache:
+        cache[post.pk] = CommentPermissions(request.user, post)
+    return cache[post.pk]
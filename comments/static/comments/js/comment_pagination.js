@@ -0,0 +1,72 @@
+// comments/static/comments/js/comment_pagination.js
+
+// Loads the rest of a cut-off branch in front of its "more replies" button.
+// Delegated, since buttons also arrive inside loaded pages.
+document.addEventListener('click', function(event) {
+    const button = event.target.closest('.load-more-replies');
+    if (!button) {
+        return;
+    }
+
+    button.disabled = true;
+    fetch(`${button.dataset.url}?${new URLSearchParams({ cursor: button.dataset.cursor })}`, {
+        headers: { 'X-Requested-With': 'XMLHttpRequest' },
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status !== 'success') {
+                throw new Error(data.message);
+            }
+            button.insertAdjacentHTML('beforebegin', data.html);
+            if (data.next_cursor) {
+                button.dataset.cursor = data.next_cursor;
+                button.textContent = `${data.count} more ${data.count === 1 ? 'reply' : 'replies'}`;
+                button.disabled = false;
+            } else {
+                button.remove();
+            }
+        })
+        .catch(error => {
+            console.error('Error loading replies:', error);
+            button.disabled = false;
+        });
+});
+
+document.addEventListener('DOMContentLoaded', function() {
+    const loadMoreBtn = document.getElementById('load-more-comments');
+    const commentsList = document.querySelector('.comments-list');
+
+    if (!loadMoreBtn || !commentsList) {
+        return;
+    }
+
+    // Appends the next page of threads after the cursor held by the button
+    loadMoreBtn.addEventListener('click', function() {
+        const params = new URLSearchParams({
+            sort: loadMoreBtn.dataset.sort,
+            cursor: loadMoreBtn.dataset.cursor,
+        });
+
+        loadMoreBtn.disabled = true;
+        fetch(`${loadMoreBtn.dataset.url}?${params}`, {
+            headers: { 'X-Requested-With': 'XMLHttpRequest' },
+        })
+            .then(response => response.json())
+            .then(data => {
+                if (data.status !== 'success') {
+                    throw new Error(data.message);
+                }
+                commentsList.insertAdjacentHTML('beforeend', data.html);
+                if (data.next_cursor) {
+                    loadMoreBtn.dataset.cursor = data.next_cursor;
+                    loadMoreBtn.disabled = false;
+                } else {
+                    loadMoreBtn.remove();
+                }
+            })
+            .catch(error => {
+                console.error('Error loading comments:', error);
+                loadMoreBtn.disabled = false;
+            });
+    });
+});
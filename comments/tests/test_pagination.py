@@ -0,0 +1,203 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from posts.models import Post
+from comments.models import Comment
+from comments.threads import iter_tree, replies_page, thread_page
+from reddit_clone.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+class CursorTest(TestCase):
+    def setUp(self):
+        self.fields = [Comment._meta.get_field('created_at'), Comment._meta.get_field('id')]
+
+    def test_round_trip(self):
+        now = timezone.now()
+        values = decode_cursor(encode_cursor([now, 42]), self.fields)
+        self.assertEqual(values, [now, 42])
+
+    def test_malformed_cursor(self):
+        for token in ['not base64 !', encode_cursor([1]), encode_cursor([[1], 2]), encode_cursor([True, 2])]:
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(token, self.fields)
+
+    def test_values_must_fit_their_fields(self):
+        now = timezone.now()
+        top = [Comment._meta.get_field('reply_count'), Comment._meta.get_field('id')]
+        cases = [
+            (self.fields, [5, 1]),
+            (self.fields, [now, 'zz']),
+            (self.fields, [now, 10 ** 30]),
+            (top, ['abc', 1]),
+            (top, [now, 1]),
+            (top, [-1, 1]),
+        ]
+        for fields, values in cases:
+            with self.subTest(values=values), self.assertRaises(InvalidCursor):
+                decode_cursor(encode_cursor(values), fields)
+
+
+class CommentPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.post = Post.objects.create(title='Test Post', content='c', author=self.user)
+
+    def comment(self, parent=None, content='c'):
+        return Comment.objects.create(post=self.post, author=self.user, parent=parent, content=content)
+
+    def make_roots(self, count):
+        start = timezone.now() - timedelta(days=1)
+        roots = []
+        for i in range(count):
+            root = self.comment(content=f'root {i}')
+            # Identical timestamps for pairs, so the id tie-breaker is exercised
+            Comment.objects.filter(pk=root.pk).update(created_at=start + timedelta(minutes=i // 2))
+            roots.append(root)
+        return roots
+
+    def collect(self, sort, limit):
+        seen, cursor = [], None
+        while True:
+            roots, cursor = thread_page(self.post, sort, cursor, limit)
+            seen.extend(c.content for c in roots)
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_thread_once(self):
+        self.make_roots(7)
+        self.assertEqual(self.collect('old', 3), [f'root {i}' for i in range(7)])
+        self.assertEqual(self.collect('new', 3), [f'root {i}' for i in reversed(range(7))])
+
+    def test_replies_come_with_their_root(self):
+        first, second = self.make_roots(2)
+        reply = self.comment(parent=second, content='reply')
+        self.comment(parent=reply, content='nested')
+
+        roots, cursor = thread_page(self.post, 'old', limit=1)
+        self.assertEqual([c.content for c in roots], ['root 0'])
+        self.assertEqual(roots[0].children, [])
+
+        roots, cursor = thread_page(self.post, 'old', cursor, limit=1)
+        self.assertIsNone(cursor)
+        self.assertEqual([c.content for c in roots[0].children], ['reply'])
+        self.assertEqual([c.content for c in roots[0].children[0].children], ['nested'])
+
+    def make_thread(self):
+        # root -> a -> (a1 -> a1x, a2), b -> b1, c
+        root = self.comment(content='root')
+        a = self.comment(parent=root, content='a')
+        a1 = self.comment(parent=a, content='a1')
+        self.comment(parent=a1, content='a1x')
+        self.comment(parent=a, content='a2')
+        b = self.comment(parent=root, content='b')
+        self.comment(parent=b, content='b1')
+        self.comment(parent=root, content='c')
+        return root
+
+    def expand(self, comments, limit):
+        """Every comment reachable from ``comments`` by following more_replies, in load order"""
+        seen = []
+        for comment in list(iter_tree(comments)):
+            seen.append(comment.content)
+            more = getattr(comment, 'more_replies', None)
+            while more:
+                replies, cursor = replies_page(comment, more['cursor'], limit)
+                seen.extend(self.expand(replies, limit))
+                more = comment.more_replies
+        return seen
+
+    def test_replies_per_thread_are_capped(self):
+        self.make_thread()
+        with CaptureQueriesContext(connection) as queries:
+            roots, _ = thread_page(self.post, 'old', replies=2)
+        self.assertEqual(len(queries), 2)
+        shown = [c.content for c in iter_tree(roots)]
+        self.assertEqual(shown, ['root', 'a', 'a1'])
+        root, a, a1 = iter_tree(roots)
+        # Each cut-off branch continues after its own position
+        self.assertEqual((root.more_replies['count'], a.more_replies['count'], a1.more_replies['count']), (3, 1, 1))
+        self.assertEqual(len({root.more_replies['cursor'], a.more_replies['cursor'], a1.more_replies['cursor']}), 3)
+
+    def test_more_replies_cover_every_comment_once(self):
+        self.make_thread()
+        everything = ['root', 'a', 'a1', 'a1x', 'a2', 'b', 'b1', 'c']
+        for limit in [1, 2, 3, 50]:
+            with self.subTest(limit=limit):
+                roots, _ = thread_page(self.post, 'old', replies=limit)
+                seen = self.expand(roots, limit)
+                self.assertEqual(sorted(seen), sorted(everything))
+
+    def test_replies_page_nests_under_the_comment(self):
+        root = self.make_thread()
+        replies, cursor = replies_page(root, limit=2)
+        self.assertEqual([c.content for c in replies], ['a'])
+        self.assertEqual([c.content for c in replies[0].children], ['a1'])
+        self.assertIsNotNone(cursor)
+        replies, cursor = replies_page(root, cursor, limit=10)
+        self.assertEqual([c.content for c in replies], ['b', 'c'])
+        self.assertIsNone(cursor)
+
+    def test_load_more_replies_endpoint(self):
+        root = self.make_thread()
+        roots, _ = thread_page(self.post, 'old', replies=2)
+        url = reverse('comments:load_more_replies', args=[self.post.pk, root.pk])
+        data = self.client.get(url, {'cursor': roots[0].more_replies['cursor']}).json()
+        self.assertIn('>b<', data['html'].replace('\n', '').replace(' ', ''))
+        self.assertNotIn('a1x', data['html'])
+
+        other = self.comment(content='other')
+        bad = self.client.get(url, {'cursor': encode_cursor([other.path])})
+        self.assertEqual(bad.status_code, 400)
+        bad = self.client.get(url, {'cursor': encode_cursor([5])})
+        self.assertEqual(bad.status_code, 400)
+
+    def test_top_sort_uses_reply_count(self):
+        quiet, busy = self.make_roots(2)
+        reply = self.comment(parent=busy)
+        self.comment(parent=reply)
+        self.assertEqual(self.collect('top', 1), ['root 1', 'root 0'])
+
+    def test_reply_count_is_maintained(self):
+        root = self.comment()
+        reply = self.comment(parent=root)
+        nested = self.comment(parent=reply)
+        root.refresh_from_db()
+        reply.refresh_from_db()
+        self.assertEqual((root.reply_count, reply.reply_count), (2, 1))
+
+        reply.delete()
+        root.refresh_from_db()
+        self.assertEqual(root.reply_count, 0)
+        self.assertFalse(Comment.objects.filter(pk=nested.pk).exists())
+
+    def test_load_more_endpoint(self):
+        self.make_roots(25)
+        url = reverse('comments:load_more_comments', args=[self.post.pk])
+
+        first = self.client.get(reverse('post_detail', args=[self.post.pk]))
+        cursor = first.context['comments_next_cursor']
+        self.assertIsNotNone(cursor)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'sort': 'old', 'cursor': cursor})
+        data = response.json()
+        self.assertEqual(data['count'], 5)
+        self.assertIsNone(data['next_cursor'])
+        self.assertIn('root 24', data['html'])
+        self.assertNotIn('root 19', data['html'])
+        self.assertLess(len([q for q in queries if 'comments_comment' in q['sql']]), 5)
+
+    def test_load_more_rejects_bad_cursor(self):
+        url = reverse('comments:load_more_comments', args=[self.post.pk])
+        for query in [
+            {'cursor': 'garbage'},
+            {'sort': 'top', 'cursor': encode_cursor(['abc', 1])},
+            {'sort': 'old', 'cursor': encode_cursor([5, 1])},
+        ]:
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(url, query).status_code, 400)
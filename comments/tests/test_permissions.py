@@ -0,0 +1,69 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from communities.models import Community
+from posts.models import Post
+from comments.models import Comment
+from comments.permissions import CommentPermissions, get_comment_permissions
+from comments.threads import COMMENTS_PAGE_SIZE
+
+
+class CommentPermissionsTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.author = User.objects.create_user(username='author', password='pass')
+        self.moderator = User.objects.create_user(username='moderator', password='pass')
+        self.stranger = User.objects.create_user(username='stranger', password='pass')
+        self.community = Community.objects.create(name='test', description='d', created_by=self.owner)
+        self.community.moderators.add(self.moderator)
+        self.post = Post.objects.create(title='Test', content='c', author=self.owner, community=self.community)
+        self.comment = Comment.objects.create(post=self.post, author=self.author, content='c')
+
+    def permissions(self, user):
+        return CommentPermissions(user, self.post)
+
+    def test_flags(self):
+        cases = [
+            (self.author, True, True),
+            (self.owner, False, True),
+            (self.moderator, False, True),
+            (self.stranger, False, False),
+            (AnonymousUser(), False, False),
+        ]
+        for user, can_edit, can_delete in cases:
+            permissions = self.permissions(user)
+            self.assertEqual(permissions.can_edit(self.comment), can_edit, user)
+            self.assertEqual(permissions.can_delete(self.comment), can_delete, user)
+
+    def test_staff_can_delete(self):
+        self.stranger.is_staff = True
+        self.assertTrue(self.permissions(self.stranger).can_delete(self.comment))
+
+    def test_resolved_once_per_request(self):
+        request = RequestFactory().get('/')
+        request.user = self.moderator
+        first = get_comment_permissions(request, self.post)
+        with self.assertNumQueries(0):
+            self.assertIs(get_comment_permissions(request, self.post), first)
+
+    def test_thread_renders_without_permission_queries(self):
+        # 500 comments: a page of roots with 24 replies each
+        for _ in range(COMMENTS_PAGE_SIZE):
+            root = Comment.objects.create(post=self.post, author=self.author, content='root')
+            for _ in range(24):
+                Comment.objects.create(post=self.post, author=self.author, parent=root, content='reply')
+        self.comment.delete()
+        self.client.force_login(self.moderator)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('post_detail', args=[self.post.pk]))
+        self.assertEqual(response.status_code, 200)
+        # Every comment gets a Delete button, from one up-front moderator lookup
+        self.assertContains(response, 'data-comment-id=', count=500)
+        moderator_queries = [q for q in queries if 'communities_community_moderators' in q['sql']]
+        self.assertEqual(len(moderator_queries), 1)
+        # The conditional-GET freshness check, then the view's own lookup
+        post_queries = [q for q in queries if 'FROM "posts_post"' in q['sql']]
+        self.assertEqual(len(post_queries), 2)
@@ -0,0 +1,120 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts.models import Post
+from comments.models import Comment, MAX_THREAD_DEPTH, encode_path_segment
+from comments.threads import COMMENTS_PAGE_SIZE, REPLIES_PAGE_SIZE, build_tree, thread_queryset
+
+
+class CommentThreadTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.post = Post.objects.create(title='Test Post', content='c', author=self.user)
+
+    def comment(self, parent=None, content='c'):
+        return Comment.objects.create(post=self.post, author=self.user, parent=parent, content=content)
+
+    def test_path_and_depth(self):
+        root = self.comment()
+        reply = self.comment(parent=root)
+        nested = self.comment(parent=reply)
+        self.assertEqual(root.path, encode_path_segment(root.pk))
+        self.assertEqual(nested.path, root.path + encode_path_segment(reply.pk) + encode_path_segment(nested.pk))
+        self.assertEqual((root.depth, reply.depth, nested.depth), (0, 1, 2))
+        nested.refresh_from_db()
+        self.assertEqual(nested.depth, 2)
+
+    def test_thread_order_is_depth_first(self):
+        first = self.comment(content='first')
+        self.comment(content='second')
+        self.comment(parent=first, content='reply')
+        self.assertEqual(
+            [c.content for c in thread_queryset(self.post)], ['first', 'reply', 'second']
+        )
+
+    def test_subtree_and_depth_limit(self):
+        root = self.comment(content='root')
+        reply = self.comment(parent=root, content='reply')
+        self.comment(parent=reply, content='nested')
+        self.comment(content='other')
+        self.assertEqual(
+            [c.content for c in thread_queryset(self.post, root=root)], ['root', 'reply', 'nested']
+        )
+        self.assertEqual(
+            [c.content for c in thread_queryset(self.post, root=root, max_depth=1)], ['root', 'reply']
+        )
+        self.assertEqual(
+            [c.content for c in thread_queryset(self.post, max_depth=0)], ['root', 'other']
+        )
+
+    def test_replies_past_max_depth_are_flattened(self):
+        parent = self.comment()
+        for _ in range(MAX_THREAD_DEPTH + 3):
+            parent = self.comment(parent=parent)
+        self.assertEqual(parent.depth, MAX_THREAD_DEPTH - 1)
+        self.assertLessEqual(len(parent.path), 255)
+
+    def test_build_tree(self):
+        root = self.comment(content='root')
+        reply = self.comment(parent=root, content='reply')
+        self.comment(parent=reply, content='nested')
+        self.comment(content='other')
+
+        roots = build_tree(thread_queryset(self.post))
+        self.assertEqual([c.content for c in roots], ['root', 'other'])
+        self.assertEqual([c.content for c in roots[0].children], ['reply'])
+        self.assertEqual([c.content for c in roots[0].children[0].children], ['nested'])
+
+        # A slice without its parents still assembles
+        slice_roots = build_tree(thread_queryset(self.post, root=reply))
+        self.assertEqual([c.content for c in slice_roots], ['reply'])
+
+    def test_reply_through_view(self):
+        root = self.comment()
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse('comments:add_comment', args=[self.post.pk]),
+            {'content': 'a reply', 'parent': root.pk}
+        )
+        reply = Comment.objects.get(content='a reply')
+        self.assertEqual(reply.parent, root)
+        self.assertEqual(reply.depth, 1)
+
+    def test_reply_to_comment_of_other_post_is_rejected(self):
+        other_post = Post.objects.create(title='Other', content='c', author=self.user)
+        foreign = Comment.objects.create(post=other_post, author=self.user, content='c')
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse('comments:add_comment', args=[self.post.pk]),
+            {'content': 'a reply', 'parent': foreign.pk}
+        )
+        self.assertFalse(Comment.objects.filter(content='a reply').exists())
+
+    def test_large_thread_renders_with_constant_queries(self):
+        roots = Comment.objects.bulk_create(
+            [Comment(post=self.post, author=self.user, content=f'root {i}') for i in range(100)]
+        )
+        for root in roots:
+            root.path = encode_path_segment(root.pk)
+        Comment.objects.bulk_update(roots, ['path'])
+        replies = Comment.objects.bulk_create([
+            Comment(post=self.post, author=self.user, parent=root, depth=1, content='reply')
+            for root in roots for _ in range(99)
+        ])
+        for reply in replies:
+            reply.path = reply.parent.path + encode_path_segment(reply.pk)
+        Comment.objects.bulk_update(replies, ['path'], batch_size=1000)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('post_detail', args=[self.post.pk]))
+        self.assertEqual(response.status_code, 200)
+        thread_queries = [q for q in queries if 'comments_comment' in q['sql']]
+        self.assertLess(len(thread_queries), 10)
+        self.assertEqual(len(response.context['comments']), COMMENTS_PAGE_SIZE)
+        # The rest of each thread waits behind its "more replies" cursor
+        first = response.context['comments'][0]
+        self.assertEqual(len(first.children), REPLIES_PAGE_SIZE)
+        self.assertTrue(first.more_replies['cursor'])
+        self.assertContains(response, 'load-more-replies')
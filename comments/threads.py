@@ -0,0 +1,193 @@
+"""Loading comment threads in one indexed query and assembling them into trees."""
+from django.db.models import Q, Window
+from django.db.models.functions import RowNumber, Substr
+
+from reddit_clone.pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_page
+from .models import PATH_SEGMENT_LENGTH, Comment, decode_path
+
+# Top-level threads per page on the post detail page and the JSON endpoint
+COMMENTS_PAGE_SIZE = 20
+
+# Replies shown under one comment per page; the rest of a branch is
+# loaded on demand from the "more replies" cursor left on the branch
+REPLIES_PAGE_SIZE = 50
+
+# Orderings of top-level comments; each matches an index on Comment.
+# Comments are not voted on, so 'top' ranks threads by their reply count.
+COMMENT_SORTS = {
+    'old': ['created_at', 'id'],
+    'new': ['-created_at', '-id'],
+    'top': ['-reply_count', '-id'],
+}
+DEFAULT_COMMENT_SORT = 'old'
+
+
+def thread_queryset(post, root=None, max_depth=None):
+    """Comments of ``post`` in depth-first thread order, served by the (post, path) index.
+
+    ``root`` limits the result to that comment's subtree (the root itself
+    included) and ``max_depth`` drops comments nested deeper than that. Slice
+    the result for a paginated piece of the thread.
+    """
+    comments = Comment.objects.filter(post=post).select_related('author')
+    if root is not None:
+        low, high = root.subtree_range()
+        comments = comments.filter(path__gte=low, path__lte=high)
+        if max_depth is not None:
+            max_depth += root.depth
+    if max_depth is not None:
+        comments = comments.filter(depth__lte=max_depth)
+    return comments.order_by('path')
+
+
+def build_tree(comments):
+    """Links comments into trees in O(n); returns the top-level comments.
+
+    Every comment gets a ``children`` list. Comments whose parent is not in
+    ``comments`` (e.g. in a slice of a thread) become top-level nodes.
+    """
+    roots = []
+    by_id = {}
+    for comment in comments:
+        comment.children = []
+        by_id[comment.pk] = comment
+        parent = by_id.get(comment.parent_id)
+        if parent is None:
+            roots.append(comment)
+        else:
+            parent.children.append(comment)
+    return roots
+
+
+def normalize_comment_sort(sort):
+    return sort if sort in COMMENT_SORTS else DEFAULT_COMMENT_SORT
+
+
+def _continue_branches(top, shown, next_reply, remaining=None):
+    """Leaves a ``more_replies`` cursor on every branch cut off after ``shown``.
+
+    ``top`` is the comment the replies in ``shown`` (path order) hang
+    under and ``next_reply`` the first reply left out. The comments from
+    ``top`` down to the last reply shown are the only ones with replies
+    still to come, each after a different path. Counts come from
+    ``reply_count``; pass ``remaining`` when ``top``'s own count is already
+    known, as it is not when earlier pages showed part of its subtree.
+    """
+    by_id = {comment.pk: comment for comment in shown}
+    by_id[top.pk] = top
+    last = shown[-1] if shown else top
+    chain = [by_id[pk] for pk in decode_path(last.path) if pk in by_id and by_id[pk].depth >= top.depth]
+
+    shown_below = dict.fromkeys(by_id, 0)
+    for comment in shown:
+        for pk in comment.ancestor_ids():
+            if pk in shown_below:
+                shown_below[pk] += 1
+
+    # Hidden replies of a comment minus those hidden under the next one down the chain
+    hidden_deeper = 0
+    for i in reversed(range(len(chain))):
+        comment = chain[i]
+        if comment is top and remaining is not None:
+            hidden = remaining
+        else:
+            hidden_total = max(comment.reply_count - shown_below[comment.pk], 0)
+            hidden, hidden_deeper = hidden_total - hidden_deeper, hidden_total
+        if hidden <= 0 and comment.pk != next_reply.parent_id:
+            continue
+        after = last.path if i == len(chain) - 1 else chain[i + 1].subtree_range()[1]
+        comment.more_replies = {'cursor': encode_cursor([after]), 'count': max(hidden, 1)}
+
+
+def thread_page(post, sort=DEFAULT_COMMENT_SORT, cursor=None, limit=COMMENTS_PAGE_SIZE,
+                replies=REPLIES_PAGE_SIZE):
+    """One page of top-level comments with their replies, in two queries.
+
+    Returns ``(roots, next_cursor)``; the roots carry their subtrees in
+    ``children``, at most ``replies`` comments each. A comment whose
+    replies were cut off carries ``more_replies`` (see ``replies_page``).
+    Raises ``reddit_clone.pagination.InvalidCursor`` for a tampered cursor.
+    """
+    roots_queryset = Comment.objects.filter(post=post, depth=0).select_related('author')
+    roots, next_cursor = keyset_page(
+        roots_queryset, COMMENT_SORTS[normalize_comment_sort(sort)], cursor, limit
+    )
+    if not roots:
+        return [], None
+
+    subtrees = Q()
+    for root in roots:
+        low, high = root.subtree_range()
+        subtrees |= Q(path__gt=low, path__lte=high)
+    # The first replies + 1 comments of every thread: the extra one tells
+    # whether the thread goes on
+    thread_rows = (
+        Comment.objects.filter(subtrees, post=post)
+        .annotate(position=Window(
+            RowNumber(),
+            partition_by=Substr('path', 1, PATH_SEGMENT_LENGTH),
+            order_by='path',
+        ))
+        .filter(position__lte=replies + 1)
+        .select_related('author')
+        .order_by('path')
+    )
+    by_root = {root.path: [] for root in roots}
+    for comment in thread_rows:
+        by_root[comment.path[:PATH_SEGMENT_LENGTH]].append(comment)
+
+    comments = list(roots)
+    for root in roots:
+        thread = by_root[root.path]
+        comments.extend(thread[:replies])
+        if len(thread) > replies:
+            _continue_branches(root, thread[:replies], thread[replies])
+    for comment in comments:
+        comment.post = post
+
+    # Roots first (in page order), then replies in path order: parents always precede children
+    return build_tree(comments), next_cursor
+
+
+def replies_page(comment, cursor=None, limit=REPLIES_PAGE_SIZE):
+    """The next replies under ``comment`` after a ``more_replies`` cursor.
+
+    Returns ``(replies, next_cursor)``: trees of the comment's replies in
+    thread order, the top ones children of ``comment``, and the cursor of
+    what is still left directly under it. Branches cut off further down
+    carry their own ``more_replies``. Raises
+    ``reddit_clone.pagination.InvalidCursor`` for a tampered cursor.
+    """
+    low, high = comment.subtree_range()
+    after = low
+    if cursor:
+        after, = decode_cursor(cursor, [Comment._meta.get_field('path')])
+        if not after.startswith(comment.path):
+            raise InvalidCursor('Cursor is for another thread')
+
+    branch = Comment.objects.filter(post_id=comment.post_id, path__gt=after, path__lte=high)
+    rows = list(branch.select_related('author').order_by('path')[:limit + 1])
+    shown = rows[:limit]
+    for reply in shown:
+        reply.post = comment.post
+
+    comment.more_replies = None
+    if len(rows) > limit:
+        # What is left directly under ``comment`` comes after the branch
+        # of its reply that leads to the last one shown
+        on_chain = decode_path(shown[-1].path)[comment.depth + 1]
+        child = next((reply for reply in shown if reply.pk == on_chain), shown[-1])
+        remaining = branch.filter(path__gt=child.subtree_range()[1]).count()
+        _continue_branches(comment, shown, rows[limit], remaining)
+
+    cursor = comment.more_replies['cursor'] if comment.more_replies else None
+    return build_tree(shown), cursor
+
+
+def iter_tree(roots):
+    """Every comment of the trees under ``roots``, depth first"""
+    stack = list(reversed(roots))
+    while stack:
+        comment = stack.pop()
+        yield comment
+        stack.extend(reversed(getattr(comment, 'children', [])))
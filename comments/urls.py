@@ -5,6 +5,8 @@ app_name = 'comments'
 
 urlpatterns = [
     path('post/<int:post_id>/comment/', views.add_comment, name='add_comment'),
+    path('post/<int:post_id>/more/', views.load_more_comments, name='load_more_comments'),
+    path('post/<int:post_id>/replies/<int:comment_id>/', views.load_more_replies, name='load_more_replies'),
     path('<int:comment_id>/edit/', views.edit_comment, name='edit_comment'),
     path('<int:comment_id>/delete/', views.delete_comment, name='delete_comment'),
 ]
\ No newline at end of file
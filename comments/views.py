@@ -2,8 +2,15 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.views.decorators.http import require_GET
 from .models import Comment
+from .permissions import get_comment_permissions
+from .threads import iter_tree, normalize_comment_sort, replies_page, thread_page
 from posts.models import Post
+from reddit_clone.middleware import query_budget
+from reddit_clone.pagination import InvalidCursor
 
 @login_required
 def add_comment(request, post_id):
@@ -12,11 +19,20 @@ def add_comment(request, post_id):
     
     if request.method == 'POST':
         content = request.POST.get('content', '').strip()
+        parent = None
+        parent_id = request.POST.get('parent')
+        if parent_id:
+            if parent_id.isdigit():
+                parent = Comment.objects.filter(id=parent_id, post=post).first()
+            if parent is None:
+                messages.error(request, 'The comment you replied to does not exist')
+                return redirect('post_detail', pk=post_id)
         
         if content:
             Comment.objects.create(
                 post=post,
                 author=request.user,
+                parent=parent,
                 content=content
             )
             messages.success(request, 'Comment added successfully.')
@@ -72,4 +88,47 @@ def delete_comment(request, comment_id):
         return redirect('post_detail', pk=post_id)
     
     # If a non-POST request was received
-    return redirect('post_list')
\ No newline at end of file
+    return redirect('post_list')
+
+@query_budget(8)
+@require_GET
+def load_more_comments(request, post_id):
+    """JSON continuation of the comment list: the next page of threads after a cursor"""
+    post = get_object_or_404(Post, id=post_id)
+    sort = normalize_comment_sort(request.GET.get('sort'))
+
+    try:
+        comments, next_cursor = thread_page(post, sort, request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    get_comment_permissions(request, post).apply(iter_tree(comments))
+
+    html = render_to_string('comments/comment_page.html', {'comments': comments}, request=request)
+    return JsonResponse({
+        'status': 'success',
+        'html': html,
+        'next_cursor': next_cursor,
+        'count': len(comments),
+    })
+
+@query_budget(8)
+@require_GET
+def load_more_replies(request, post_id, comment_id):
+    """JSON continuation of one branch: the next replies under a comment after a cursor"""
+    comment = get_object_or_404(Comment.objects.select_related('post'), id=comment_id, post_id=post_id)
+
+    try:
+        replies, next_cursor = replies_page(comment, request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    get_comment_permissions(request, comment.post).apply(iter_tree(replies))
+
+    html = render_to_string('comments/comment_page.html', {'comments': replies}, request=request)
+    return JsonResponse({
+        'status': 'success',
+        'html': html,
+        'next_cursor': next_cursor,
+        'count': comment.more_replies['count'] if comment.more_replies else 0,
+    })
@@ -34,6 +34,8 @@ class CommunityAdmin(admin.ModelAdmin):
     readonly_fields = [
         'created_at',
         'created_by',
+        'member_count',
+        'post_count',
         'community_stats',
         'recent_activity'
     ]
@@ -46,7 +48,7 @@ class CommunityAdmin(admin.ModelAdmin):
             'fields': ('members', 'moderators')
         }),
         ('Статистика', {
-            'fields': ('community_stats', 'recent_activity', 'created_at'),
+            'fields': ('member_count', 'post_count', 'community_stats', 'recent_activity', 'created_at'),
             'classes': ('collapse',)
         }),
     )
@@ -60,14 +62,14 @@ class CommunityAdmin(admin.ModelAdmin):
     # Query Optimization
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('created_by')\
-                                           .prefetch_related('members', 'moderators', 'posts')
+                                           .prefetch_related('moderators')
     
     # Actions in the admin panel
     actions = ['remove_inactive_communities', 'export_community_data']
     
     def remove_inactive_communities(self, request, queryset):
         """Delete communities without posts and with a small number of members"""
-        inactive_communities = queryset.filter(posts__isnull=True, members__count__lt=2)
+        inactive_communities = queryset.filter(post_count=0, member_count__lt=2)
         count = inactive_communities.count()
         inactive_communities.delete()
         self.message_user(request, f'Deleted {count} inactive communities')
@@ -79,16 +81,6 @@ class CommunityAdmin(admin.ModelAdmin):
     export_community_data.short_description = "Export of community data"
     
     # Custom methods for display
-    def member_count(self, obj):
-        return obj.member_count()
-    member_count.short_description = '👥 Members'
-    member_count.admin_order_field = 'members__count'
-    
-    def post_count(self, obj):
-        return obj.posts.count()
-    post_count.short_description = '📝 Posts'
-    post_count.admin_order_field = 'posts__count'
-    
     def moderator_count(self, obj):
         return obj.moderators.count()
     moderator_count.short_description = '🛡️ Moderators'
@@ -96,8 +88,8 @@ class CommunityAdmin(admin.ModelAdmin):
     def community_stats(self, obj):
         return format_html(
             "Members: <b>{}</b><br>Posts: <b>{}</b><br>Moderators: <b>{}</b>",
-            obj.member_count(),
-            obj.posts.count(),
+            obj.member_count,
+            obj.post_count,
             obj.moderators.count()
         )
     community_stats.short_description = "Community Statistics"
@@ -123,7 +115,7 @@ class CommunityAdmin(admin.ModelAdmin):
     
     # Protection against accidental deletion
     def has_delete_permission(self, request, obj=None):
-        if obj and obj.member_count() > 100:  # Large communities cannot be deleted
+        if obj and obj.member_count > 100:  # Large communities cannot be deleted
             return False
         return super().has_delete_permission(request, obj)
     
@@ -140,7 +132,7 @@ class CommunityAdmin(admin.ModelAdmin):
     
     def delete_selected_action(self, modeladmin, request, queryset):
         # We filter only the communities that can be deleted
-        deletable = queryset.filter(members__count__lte=100)
+        deletable = queryset.filter(member_count__lte=100)
         count = deletable.count()
         deletable.delete()
         self.message_user(request, f'Deleted {count} communities (large communities are protected)')
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""Stored member_count/post_count on Community and how they are kept in step."""
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Community
+
+
+def member_count_subquery():
+    """Correlated COUNT of membership rows for an outer Community queryset"""
+    through = Community.members.through
+    rows = (
+        through.objects.filter(community=OuterRef('pk'))
+        .order_by()
+        .values('community')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def post_count_subquery():
+    """Correlated COUNT of posts for an outer Community queryset"""
+    from posts.models import Post
+
+    rows = (
+        Post.objects.filter(community=OuterRef('pk'))
+        .order_by()
+        .values('community')
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def recount_communities(communities=None):
+    """Rebuilds both counters from the rows in one UPDATE"""
+    communities = Community.objects.all() if communities is None else communities
+    return communities.update(member_count=member_count_subquery(), post_count=post_count_subquery())
+
+
+def shift_counter(field, deltas):
+    """Adds ``{community_id: delta}`` to a counter, never dropping below zero"""
+    for community_id, delta in deltas.items():
+        if delta and community_id is not None:
+            Community.objects.filter(pk=community_id).update(
+                **{field: Greatest(F(field) + delta, 0)}
+            )
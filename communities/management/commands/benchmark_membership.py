@@ -0,0 +1,82 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from communities.models import Community
+
+BENCH_PREFIX = 'bench-members-'
+
+
+class Command(BaseCommand):
+    help = 'Seed a community with many members and compare membership check latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=1_000_000)
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Indexed membership checks to time')
+        parser.add_argument('--legacy-requests', type=int, default=3,
+                            help='Checks timed with the old "user in members.all()" scan')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep seeded users and the community afterwards')
+
+    def handle(self, *args, **options):
+        owner, _ = User.objects.get_or_create(username=f'{BENCH_PREFIX}owner')
+        community, _ = Community.objects.get_or_create(
+            name=f'{BENCH_PREFIX}community'[:50], defaults={'description': 'benchmark', 'created_by': owner}
+        )
+        existing = community.members.count()
+        if existing < options['members']:
+            self.seed(community, existing, options['members'] - existing)
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        member_ids = list(
+            User.objects.filter(username__startswith=BENCH_PREFIX).values_list('pk', flat=True)[:10_000]
+        )
+        users = list(User.objects.filter(pk__in=random.sample(member_ids, min(len(member_ids), 100))))
+        outsider = User(pk=User.objects.order_by('-pk').values_list('pk', flat=True).first() + 1)
+        users.append(outsider)
+
+        self.stdout.write(f"{community.members.count()} members")
+        self.report('is_member', options['requests'], lambda user: Community.objects.get(pk=community.pk).is_member(user), users)
+        self.report('in members.all()', options['legacy_requests'], lambda user: user in community.members.all(), users)
+
+        if not options['keep']:
+            community.delete()
+            User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+    def report(self, label, requests, check, users):
+        if not requests:
+            return
+        timings = []
+        for _ in range(requests):
+            user = random.choice(users)
+            started = time.perf_counter()
+            check(user)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+        self.stdout.write(f"{label:<18} p50={statistics.median(timings):9.2f}ms  p95={p95:9.2f}ms")
+
+    def seed(self, community, start, count, batch_size=10_000):
+        self.stdout.write(f"Seeding {count} members...")
+        through = Community.members.through
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            users = [
+                User(username=f'{BENCH_PREFIX}{start + created + i}', password='!')
+                for i in range(size)
+            ]
+            with transaction.atomic():
+                users = User.objects.bulk_create(users)
+                through.objects.bulk_create(
+                    [through(community_id=community.pk, user_id=user.pk) for user in users]
+                )
+            created += size
+        self.stdout.write("Seeded")
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from communities.counters import member_count_subquery, post_count_subquery, recount_communities
+from communities.models import Community
+
+
+class Command(BaseCommand):
+    help = 'Rebuild stored member/post counters on Community from the membership and post rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--community', action='append', dest='names',
+            help='Only reconcile the named community (can be repeated)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drifted communities without writing anything'
+        )
+
+    def handle(self, *args, **options):
+        communities = Community.objects.all()
+        if options['names']:
+            communities = communities.filter(name__in=options['names'])
+
+        drifted_count = communities.annotate(
+            actual_members=member_count_subquery(),
+            actual_posts=post_count_subquery(),
+        ).filter(
+            ~Q(member_count=F('actual_members')) | ~Q(post_count=F('actual_posts'))
+        ).count()
+
+        if options['dry_run']:
+            self.stdout.write(f"{drifted_count} communities have drifted counters")
+            return
+
+        recount_communities(communities)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Reconciled community counters ({drifted_count} communities had drifted)")
+        )
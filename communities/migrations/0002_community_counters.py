@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count_subquery(model, community_id):
+    counts = (
+        model.objects.filter(community_id=community_id)
+        .order_by()
+        .values('community_id')
+        .annotate(c=Count('pk'))
+        .values('c')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def backfill_counters(apps, schema_editor):
+    Community = apps.get_model('communities', 'Community')
+    Post = apps.get_model('posts', 'Post')
+    Community.objects.update(
+        member_count=_count_subquery(Community.members.through, OuterRef('pk')),
+        post_count=_count_subquery(Post, OuterRef('pk')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communities', '0001_initial'),
+        ('posts', '0007_vote'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='community',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='community',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='community',
+            index=models.Index(fields=['-member_count', '-id'], name='community_top_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -9,15 +9,58 @@ class Community(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     members = models.ManyToManyField(User, related_name='communities', blank=True)
     moderators = models.ManyToManyField(User, related_name='moderated_communities', blank=True)
+    # Maintained by the signals in communities.signals; reconcile_community_counts repairs drift
+    member_count = models.PositiveIntegerField(default=0, editable=False)
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-member_count', '-id'], name='community_top_idx'),
+        ]
     
     def __str__(self):
         return f"r/{self.name}"
-    
-    def member_count(self):
-        return self.members.count()
-    
+
+    @classmethod
+    def has_user(cls, relation, community_id, user_id):
+        """Indexed EXISTS on the through table of ``members`` or ``moderators``.
+
+        The (community_id, user_id) unique constraint of the through table
+        makes this a single index probe however large the community is.
+        """
+        through = getattr(cls, relation).through
+        return through.objects.filter(community_id=community_id, user_id=user_id).exists()
+
+    def _check_user(self, relation, user):
+        if user is None or not user.is_authenticated:
+            return False
+        # Memo on the instance, so repeated checks while rendering one request are free
+        memo = self.__dict__.setdefault('_membership_memo', {})
+        key = (relation, user.pk)
+        if key not in memo:
+            memo[key] = self.has_user(relation, self.pk, user.pk)
+        return memo[key]
+
+    def _remember(self, relation, user, value):
+        self.__dict__.setdefault('_membership_memo', {})[(relation, user.pk)] = value
+
+    def is_member(self, user):
+        return self._check_user('members', user)
+
     def is_moderator(self, user):
-        return user in self.moderators.all()
+        return self._check_user('moderators', user)
+
+    def add_member(self, user):
+        self.members.add(user)
+        self._remember('members', user, True)
+
+    def remove_member(self, user):
+        self.members.remove(user)
+        self._remember('members', user, False)
+
+    def add_moderator(self, user):
+        self.moderators.add(user)
+        self._remember('moderators', user, True)
     
     def get_absolute_url(self):
         return reverse('community_detail', kwargs={'community_name': self.name})
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""Incremental maintenance of Community.member_count and Community.post_count."""
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from posts.models import Post
+from .counters import shift_counter
+from .models import Community
+
+
+@receiver(m2m_changed, sender=Community.members.through)
+def update_member_count(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keeps member_count in step with joins and leaves from either side of the relation"""
+    # ``instance`` is the Community, or the User when the reverse side changed
+    if action == 'post_add':
+        # Django only passes the ids that were actually missing on add
+        deltas = Counter(pk_set) if reverse else Counter({instance.pk: len(pk_set)})
+    elif action in ('pre_remove', 'pre_clear'):
+        # remove()/clear() may name rows that do not exist, so count the real ones first
+        rows = sender.objects.filter(**{'user' if reverse else 'community': instance.pk})
+        if action == 'pre_remove':
+            rows = rows.filter(**{'community__in' if reverse else 'user__in': pk_set})
+        instance._removed_memberships = Counter(rows.values_list('community_id', flat=True))
+        return
+    elif action in ('post_remove', 'post_clear'):
+        removed = instance.__dict__.pop('_removed_memberships', Counter())
+        deltas = Counter({community_id: -count for community_id, count in removed.items()})
+    else:
+        return
+
+    shift_counter('member_count', deltas)
+    if not reverse:
+        instance.member_count = max(instance.member_count + deltas[instance.pk], 0)
+
+
+@receiver(pre_delete, sender=User)
+def update_member_count_on_user_delete(sender, instance, **kwargs):
+    # Cascading deletes of membership rows bypass m2m_changed
+    memberships = Community.members.through.objects.filter(user=instance)
+    removed = Counter(memberships.values_list('community_id', flat=True))
+    shift_counter('member_count', {community_id: -count for community_id, count in removed.items()})
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_community(sender, instance, update_fields=None, **kwargs):
+    # Only edits that may move a post between communities need the stored value
+    if instance._state.adding or (update_fields is not None and 'community' not in update_fields):
+        return
+    instance._previous_community_id = (
+        Post.objects.filter(pk=instance.pk).values_list('community_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Post)
+def update_post_count_on_save(sender, instance, created, **kwargs):
+    if created:
+        shift_counter('post_count', {instance.community_id: 1})
+        return
+    previous = instance.__dict__.pop('_previous_community_id', instance.community_id)
+    if previous != instance.community_id:
+        shift_counter('post_count', {previous: -1, instance.community_id: 1})
+
+
+@receiver(post_delete, sender=Post)
+def update_post_count_on_delete(sender, instance, **kwargs):
+    shift_counter('post_count', {instance.community_id: -1})
@@ -0,0 +1,91 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from communities.models import Community
+from posts.models import Post
+
+
+class CommunityCountersTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(3)]
+        self.community = Community.objects.create(name='test', description='d', created_by=self.owner)
+        self.other = Community.objects.create(name='other', description='d', created_by=self.owner)
+
+    def counts(self, community=None):
+        community = community or self.community
+        community.refresh_from_db()
+        return community.member_count, community.post_count
+
+    def test_members_from_community_side(self):
+        self.community.members.add(*self.users)
+        self.assertEqual(self.community.member_count, 3)
+        self.community.members.add(self.users[0])
+        self.assertEqual(self.counts(), (3, 0))
+
+        # Removing a non-member changes nothing
+        self.community.members.remove(self.users[0], self.owner)
+        self.assertEqual(self.counts(), (2, 0))
+        self.community.members.clear()
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_members_from_user_side(self):
+        user = self.users[0]
+        user.communities.add(self.community, self.other)
+        self.assertEqual(self.counts()[0], 1)
+        self.assertEqual(self.counts(self.other)[0], 1)
+        user.communities.remove(self.other)
+        self.assertEqual(self.counts(self.other)[0], 0)
+        user.communities.clear()
+        self.assertEqual(self.counts()[0], 0)
+
+    def test_user_delete(self):
+        self.community.members.add(*self.users)
+        self.users[0].delete()
+        self.assertEqual(self.counts()[0], 2)
+
+    def test_join_and_leave_views(self):
+        self.client.force_login(self.users[0])
+        self.client.post(reverse('communities:join_community', args=['test']))
+        self.assertEqual(self.counts()[0], 1)
+        self.client.post(reverse('communities:leave_community', args=['test']))
+        self.assertEqual(self.counts()[0], 0)
+
+    def test_posts(self):
+        post = Post.objects.create(title='t', content='c', author=self.owner, community=self.community)
+        Post.objects.create(title='t', content='c', author=self.owner)
+        self.assertEqual(self.counts()[1], 1)
+
+        post.community = self.other
+        post.save()
+        self.assertEqual(self.counts()[1], 0)
+        self.assertEqual(self.counts(self.other)[1], 1)
+
+        post.title = 'edited'
+        post.save()
+        self.assertEqual(self.counts(self.other)[1], 1)
+
+        post.delete()
+        self.assertEqual(self.counts(self.other)[1], 0)
+
+    def test_list_ordered_by_members(self):
+        self.other.members.add(*self.users)
+        self.community.members.add(self.owner)
+        response = self.client.get(reverse('communities:community_list'))
+        self.assertEqual(list(response.context['communities']), [self.other, self.community])
+
+    def test_reconcile_command(self):
+        self.community.members.add(*self.users)
+        Post.objects.create(title='t', content='c', author=self.owner, community=self.community)
+        Community.objects.filter(pk=self.community.pk).update(member_count=42, post_count=0)
+
+        out = StringIO()
+        call_command('reconcile_community_counts', '--dry-run', stdout=out)
+        self.assertIn('1 communities', out.getvalue())
+        self.assertEqual(self.counts(), (42, 0))
+
+        call_command('reconcile_community_counts', stdout=StringIO())
+        self.assertEqual(self.counts(), (3, 1))
@@ -0,0 +1,62 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from communities.models import Community
+
+
+class MembershipTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.user = User.objects.create_user(username='user', password='pass')
+        self.community = Community.objects.create(name='test', description='d', created_by=self.owner)
+        self.community.members.add(self.owner)
+        self.community.moderators.add(self.owner)
+
+    def fresh(self):
+        return Community.objects.get(pk=self.community.pk)
+
+    def test_checks(self):
+        community = self.fresh()
+        self.assertTrue(community.is_member(self.owner))
+        self.assertTrue(community.is_moderator(self.owner))
+        self.assertFalse(community.is_member(self.user))
+        self.assertFalse(community.is_moderator(self.user))
+        self.assertFalse(community.is_member(AnonymousUser()))
+
+    def test_check_is_a_single_exists_and_memoized(self):
+        community = self.fresh()
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(5):
+                community.is_member(self.owner)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('LIMIT 1', queries[0]['sql'])
+        self.assertNotIn('auth_user', queries[0]['sql'])
+
+    def test_add_and_remove_update_memo(self):
+        community = self.fresh()
+        self.assertFalse(community.is_member(self.user))
+        community.add_member(self.user)
+        with self.assertNumQueries(0):
+            self.assertTrue(community.is_member(self.user))
+        community.remove_member(self.user)
+        self.assertFalse(community.is_member(self.user))
+        self.assertFalse(self.fresh().is_member(self.user))
+
+    def test_join_and_leave_views(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('communities:join_community', args=['test']))
+        self.assertTrue(self.fresh().is_member(self.user))
+        self.client.post(reverse('communities:leave_community', args=['test']))
+        self.assertFalse(self.fresh().is_member(self.user))
+
+    def test_detail_does_not_load_member_list(self):
+        self.client.force_login(self.owner)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('communities:community_detail', args=['test']))
+        self.assertTrue(response.context['is_member'])
+        self.assertTrue(response.context['is_moderator'])
+        member_queries = [q['sql'] for q in queries if 'communities_community_members' in q['sql']]
+        # Only the EXISTS probe and the member COUNT touch the through table
+        self.assertTrue(all('LIMIT 1' in sql or 'COUNT(*)' in sql for sql in member_queries))
@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 from django.contrib.messages import get_messages
 from communities.models import Community
 from communities.forms import CommunityForm
+from posts.models import Post
 
 class CommunityViewsTest(TestCase):
     def setUp(self):
@@ -126,4 +127,36 @@ class CommunityViewsTest(TestCase):
     def test_community_list_exception_handling(self):
         """Exception handling test in the community list"""
         # You can test error handling here if needed
-        pass
\ No newline at end of file
+        pass
+
+class CommunityConditionalGetTest(TestCase):
+    """Logged-in revalidation; anonymous visitors are covered by the page cache"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.community = Community.objects.create(name='cond', description='d', created_by=self.user)
+        Post.objects.create(title='Post', content='body', author=self.user, community=self.community)
+        self.url = reverse('communities:community_detail', args=[self.community.name])
+        self.client.force_login(self.user)
+
+    def revalidate(self, response):
+        return self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_page_is_not_rendered_again(self):
+        response = self.client.get(self.url)
+        self.assertIn('private', response['Cache-Control'])
+        revalidated = self.revalidate(response)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertFalse(revalidated.templates)
+
+    def test_changes_invalidate(self):
+        changes = [
+            lambda: Post.objects.create(title='New', content='body', author=self.other, community=self.community),
+            lambda: self.community.add_member(self.other),
+            lambda: Post.objects.filter(community=self.community).first().delete(),
+        ]
+        for change in changes:
+            response = self.client.get(self.url)
+            change()
+            self.assertEqual(self.revalidate(response).status_code, 200)
@@ -1,7 +1,6 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Count
 from django.views.decorators.http import require_http_methods
 from django.core.exceptions import PermissionDenied
 from django.db import transaction
@@ -9,16 +8,22 @@ import logging
 from .models import Community
 from .forms import CommunityForm
 from posts.models import Post
+from posts.feeds import attach_user_votes, feed_page
+from posts.ranking import SORT_NEW, SORT_ORDERING
+from posts.freshness import community_page_state
+from reddit_clone.conditional import conditional_page
+from reddit_clone.middleware import query_budget
+from reddit_clone.page_cache import cache_anonymous_page, community_scope
+from reddit_clone.pagination import InvalidCursor, canonical_cursor
 from django.http import Http404
 
 logger = logging.getLogger(__name__)
 
+@query_budget(5)
 def community_list(request):
     try:
-        communities = Community.objects.annotate(
-            post_count=Count('posts'),
-            member_count=Count('members')
-        ).order_by('-member_count')[:20]
+        # Stored counters: the top communities are a community_top_idx scan
+        communities = Community.objects.order_by('-member_count', '-id')[:20]
         
         return render(request, 'communities/community_list.html', {
             'communities': communities
@@ -30,23 +35,38 @@ def community_list(request):
             'communities': []
         })
 
+def community_page_query(request):
+    # The only parameter community_detail reads; its feed is always sorted by new
+    return {'cursor': canonical_cursor(request.GET.get('cursor'), Post, SORT_ORDERING[SORT_NEW])}
+
+
+@query_budget(12)
+@cache_anonymous_page(
+    lambda request, community_name: community_scope(community_name), query=community_page_query
+)
+@conditional_page(community_page_state)
 def community_detail(request, community_name):
     try:
         community = get_object_or_404(Community, name=community_name)
-        posts = community.posts.select_related('author').prefetch_related('upvotes', 'downvotes')
+        try:
+            posts, next_cursor = feed_page(community.posts.all(), cursor=request.GET.get('cursor'))
+        except InvalidCursor:
+            posts, next_cursor = feed_page(community.posts.all())
+        posts = attach_user_votes(posts, request.user)
         
         is_member = False
         is_moderator = False
         
         if request.user.is_authenticated:
-            is_member = request.user in community.members.all()
+            is_member = community.is_member(request.user)
             is_moderator = community.is_moderator(request.user)
         
         return render(request, 'communities/community_detail.html', {
             'community': community,
             'posts': posts,
             'is_member': is_member,
-            'is_moderator': is_moderator
+            'is_moderator': is_moderator,
+            'next_cursor': next_cursor,
         })
     except Http404:
         # We pass the 404 further, we don't intercept it
@@ -68,8 +88,8 @@ def create_community(request):
                 community.save()
                 
                 # The creator automatically becomes a moderator and a participant
-                community.moderators.add(request.user)
-                community.members.add(request.user)
+                community.add_moderator(request.user)
+                community.add_member(request.user)
                 
                 messages.success(request, f'Community r/{community.name} created!')
                 return redirect('communities:community_detail', community_name=community.name)  
@@ -87,8 +107,8 @@ def join_community(request, community_name):
     try:
         community = get_object_or_404(Community, name=community_name)
         
-        if request.user not in community.members.all():
-            community.members.add(request.user)
+        if not community.is_member(request.user):
+            community.add_member(request.user)
             messages.success(request, f'You have joined {community.name}')
         else:
             messages.info(request, f'You are already a member {community.name}')
@@ -104,12 +124,12 @@ def join_community(request, community_name):
 def leave_community(request, community_name):
     try:
         community = get_object_or_404(Community, name=community_name)
-        if request.user in community.members.all():
+        if community.is_member(request.user):
             # We do not allow the creator to leave the community
             if community.created_by == request.user:
                 messages.error(request, 'Creator cannot leave their own community.')
             else:
-                community.members.remove(request.user)
+                community.remove_member(request.user)
                 messages.success(request, f'You left r/{community.name}')
         
         return redirect('communities:community_detail', community_name=community.name) 
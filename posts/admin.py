@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Post
+from .models import Post, Vote
 
 
 @admin.register(Post)
@@ -14,19 +14,17 @@ class PostAdmin(admin.ModelAdmin):
         
     ]
     date_hierarchy = 'created_at'
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['created_at', 'updated_at', 'upvote_count', 'downvote_count', 'score']
 
     def upvotes_count(self, obj):
-        return obj.upvotes.count()
+        return obj.upvote_count
     upvotes_count.short_description = 'Upvotes'
+    upvotes_count.admin_order_field = 'upvote_count'
     
     def downvotes_count(self, obj):
-        return obj.downvotes.count()
+        return obj.downvote_count
     downvotes_count.short_description = 'Downvotes'
-
-    def score(self, obj):
-        return obj.total_votes()
-    score.short_description = 'Score'
+    downvotes_count.admin_order_field = 'downvote_count'
 
     def get_community(self, obj):
         return obj.community.name if obj.community else "—"
@@ -36,7 +34,7 @@ class PostAdmin(admin.ModelAdmin):
     def get_votes(self, obj):
         return obj.total_votes()
     get_votes.short_description = 'Votes'
-    get_votes.admin_order_field = 'upvotes'
+    get_votes.admin_order_field = 'score'
     
     fieldsets = (
         ('Basic Information', {
@@ -47,7 +45,7 @@ class PostAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Voting', {
-            'fields': ('upvotes', 'downvotes'),
+            'fields': ('upvote_count', 'downvote_count', 'score'),
             'classes': ('collapse',)
         }),
         ('Dates', {
@@ -56,3 +54,11 @@ class PostAdmin(admin.ModelAdmin):
         }),
     )
 
+
+
+@admin.register(Vote)
+class VoteAdmin(admin.ModelAdmin):
+    list_display = ['post', 'user', 'value', 'created_at']
+    list_filter = ['value', 'created_at']
+    search_fields = ['post__title', 'user__username']
+    raw_id_fields = ['post', 'user']
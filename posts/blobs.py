@@ -0,0 +1,189 @@
+"""Content-addressed storage for post media: identical files are stored once.
+
+Every file the media pipeline uploads is hashed (SHA-256) while its bytes
+stream in: form uploads by the upload handlers below, resumable uploads
+chunk by chunk in posts.uploads. The digest travels with the staged file
+(``PostMedia.staged_sha256``), and only a file that arrived some other way,
+or whose running hash was lost, is read once more to hash it.
+A hash that already has a ``MediaBlob`` skips the upload: the new PostMedia
+points at the blob's file and the blob's ``ref_count`` goes up. Otherwise
+the file is stored under its hash and a blob with one reference is
+recorded. Deleting a PostMedia drops its reference (posts.signals), and the
+last reference deletes the stored file.
+
+Only hashes computed here from the actual bytes are trusted. A client that
+claimed a hash could attach any file whose hash it knew, so direct uploads
+(posts.direct_uploads), whose bytes the app never sees, are not deduplicated.
+
+Images also get a 64-bit difference hash (dHash), which ``near_duplicates``
+compares to find resized or re-encoded copies of the same picture.
+"""
+import hashlib
+import os
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from PIL import Image
+
+from .models import MediaBlob, PostMedia
+
+HASH_CHUNK_SIZE = 1024 * 1024
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif'}
+
+
+def _storage():
+    return PostMedia._meta.get_field('media_file').storage
+
+
+class HashingUploadMixin:
+    """Hashes an uploaded file as the request body streams through the handler.
+
+    The finished file gets ``content_digest = (sha256 hex, size)``.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # Before super(): the memory handler stops the chain from there
+        self._sha256 = hashlib.sha256()
+        self._size = 0
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self._sha256.update(raw_data)
+        self._size += len(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_digest = (self._sha256.hexdigest(), self._size)
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def digest(file):
+    """SHA-256 hex digest and size of ``file``: the one taken on upload, else read in chunks"""
+    known = getattr(file, 'content_digest', None)
+    if known:
+        return known
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in file.chunks(HASH_CHUNK_SIZE):
+        sha256.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return sha256.hexdigest(), size
+
+
+def perceptual_hash(file, filename):
+    """dHash of an image as 16 hex digits; '' for anything that is not a readable image"""
+    if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+        return ''
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            # Lets JPEGs decode at a fraction of their size
+            image.draft('L', (64, 64))
+            pixels = image.convert('L').resize((9, 8), Image.LANCZOS).tobytes()
+    except Exception:
+        return ''
+    finally:
+        file.seek(0)
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = bits << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f'{bits:016x}'
+
+
+def blob_name(sha256, filename):
+    return f'post_media/blobs/{sha256[:2]}/{sha256}{os.path.splitext(filename)[1].lower()}'
+
+
+def claim(sha256):
+    """Takes one more reference to the blob with this hash; None when there is none"""
+    with transaction.atomic():
+        blob = MediaBlob.objects.select_for_update().filter(sha256=sha256).first()
+        if blob is None:
+            return None
+        MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    blob.ref_count += 1
+    return blob
+
+
+def register(sha256, name, size, phash=''):
+    """Records a freshly stored file as a blob with one reference.
+
+    When a concurrent upload of the same bytes registered first, that blob
+    is claimed instead and this copy is deleted.
+    """
+    try:
+        with transaction.atomic():
+            return MediaBlob.objects.create(
+                sha256=sha256, name=name, size=size, perceptual_hash=phash, ref_count=1
+            )
+    except IntegrityError:
+        blob = claim(sha256)
+        if blob is None:
+            raise
+        if blob.name != name:
+            _storage().delete(name)
+        return blob
+
+
+def store(file, filename, content_digest=None):
+    """Returns a claimed blob holding ``file``'s bytes, uploading them only if they are new.
+
+    ``content_digest`` is ``(sha256, size)`` when the bytes were already
+    hashed on the way in; without it the file is read once to hash it.
+    """
+    sha256, size = content_digest or digest(file)
+    blob = claim(sha256)
+    if blob is not None:
+        return blob
+    phash = perceptual_hash(file, filename)
+    name = _storage().save(blob_name(sha256, filename), file)
+    return register(sha256, name, size, phash)
+
+
+def release(blob_id):
+    """Drops one reference; the last one deletes the blob and its file. Returns True when deleted."""
+    with transaction.atomic():
+        blob = MediaBlob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return False
+        if blob.ref_count > 1:
+            MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+            return False
+        remaining = blob.media.count()
+        if remaining:
+            # The count drifted (rows written around this module); trust the rows
+            MediaBlob.objects.filter(pk=blob.pk).update(ref_count=remaining)
+            return False
+        blob.delete()
+        name = blob.name
+        transaction.on_commit(lambda: _storage().delete(name))
+    return True
+
+
+def hamming_distance(first, second):
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+
+def near_duplicates(phash, max_distance=6):
+    """Blobs whose images look like ``phash``, closest first (a scan: for tools, not requests)"""
+    if not phash:
+        return []
+    candidates = MediaBlob.objects.exclude(perceptual_hash='').only('pk', 'name', 'perceptual_hash')
+    matches = [
+        (hamming_distance(phash, blob.perceptual_hash), blob)
+        for blob in candidates.iterator()
+    ]
+    return [blob for distance, blob in sorted(matches, key=lambda match: match[0]) if distance <= max_distance]
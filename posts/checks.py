@@ -0,0 +1,29 @@
+"""System checks for the posts app's settings."""
+import os
+
+from django.conf import settings
+from django.core import checks
+
+
+@checks.register(checks.Tags.compatibility)
+def check_vote_buffer(app_configs, **kwargs):
+    """A local vote buffer is per process: workers would toggle against different pending votes"""
+    if not getattr(settings, 'VOTE_WRITE_BEHIND', False):
+        return []
+    if not getattr(settings, 'VOTE_BUFFER_URL', 'local://').startswith('local://'):
+        return []
+    # gunicorn and most platforms size the worker pool from WEB_CONCURRENCY
+    workers = os.environ.get('WEB_CONCURRENCY', '1')
+    if workers.isdigit() and int(workers) > 1:
+        return [checks.Error(
+            f'VOTE_WRITE_BEHIND with a local:// buffer cannot run on {workers} workers.',
+            hint='Each worker would buffer its own clicks; point VOTE_BUFFER_URL at Redis.',
+            id='posts.E001',
+        )]
+    if not settings.DEBUG:
+        return [checks.Warning(
+            'VOTE_WRITE_BEHIND uses a local:// buffer, which is only correct with a single worker process.',
+            hint='Point VOTE_BUFFER_URL at Redis when running more than one worker.',
+            id='posts.W001',
+        )]
+    return []
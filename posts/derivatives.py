@@ -0,0 +1,138 @@
+"""Resized, re-encoded copies of uploaded images for responsive delivery.
+
+A feed card is a few hundred pixels wide, so sending it a 12MP original
+wastes most of the bytes. ``generate`` writes each ready image at the
+widths in ``MEDIA_DERIVATIVE_WIDTHS`` (never upscaled) in every format of
+``MEDIA_DERIVATIVE_FORMATS`` this Pillow build can encode, with EXIF and
+other metadata dropped once the orientation has been applied. The result
+is recorded in ``PostMedia.derivatives``:
+
+    {"source": <media_file name>, "width": w, "height": h,
+     "variants": {"avif": [[320, name, url], ...], "webp": [...], "jpeg": [...]}}
+
+and templates turn it into ``srcset``/``sizes`` (see
+``posts/includes/media_image.html``). It runs on the media pipeline's
+worker threads, never in a request, and a row whose derivatives already
+match its file is left alone, so running it twice is harmless. Rows
+sharing one stored file (posts.blobs) share one set of copies.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+from .models import PostMedia, media_url
+
+logger = logging.getLogger(__name__)
+
+ENCODER_OPTIONS = {
+    'avif': {'quality': 55},
+    'webp': {'quality': 78, 'method': 4},
+    'jpeg': {'quality': 80, 'optimize': True, 'progressive': True},
+}
+
+
+def available_formats():
+    """Configured formats this Pillow build can write, best compression first"""
+    return [fmt for fmt in settings.MEDIA_DERIVATIVE_FORMATS if fmt == 'jpeg' or features.check(fmt)]
+
+
+def is_current(media):
+    return bool(media.media_file) and media.derivatives.get('source') == media.media_file.name
+
+
+def _target_widths(width):
+    widths = sorted({min(target, width) for target in settings.MEDIA_DERIVATIVE_WIDTHS})
+    return widths or [width]
+
+
+def _encode(image, fmt):
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    # No exif= / icc_profile= arguments: the copies carry pixels only
+    image.save(buffer, format=fmt.upper(), **ENCODER_OPTIONS[fmt])
+    return buffer.getvalue()
+
+
+def generate(media_id, force=False):
+    """Writes the derivatives of one ready image; returns True when new ones were made"""
+    media = PostMedia.objects.filter(pk=media_id, status=PostMedia.STATUS_READY).first()
+    if media is None or media.media_type != 'image' or not media.media_file:
+        return False
+    if is_current(media) and not force:
+        return False
+    if not force:
+        # Another row with the same file (posts.blobs) already has copies
+        shared = (
+            PostMedia.objects.filter(derivatives__source=media.media_file.name)
+            .exclude(pk=media.pk)
+            .values_list('derivatives', flat=True)
+            .first()
+        )
+        if shared:
+            media.derivatives = shared
+            media.save(update_fields=['derivatives'])
+            return True
+
+    storage = media.media_file.storage
+    with media.media_file.open('rb') as original:
+        with Image.open(original) as source:
+            if getattr(source, 'is_animated', False):
+                # Resizing one frame would drop the animation; GIFs are served as uploaded
+                return False
+            # Rotate per the EXIF orientation before the metadata goes away
+            image = ImageOps.exif_transpose(source)
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    base = os.path.splitext(os.path.basename(media.media_file.name))[0]
+    width, height = image.size
+    variants = {}
+    written = []
+    try:
+        for target in _target_widths(width):
+            resized = image if target == width else image.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS
+            )
+            for fmt in available_formats():
+                data = _encode(resized, fmt)
+                name = storage.save(f'post_media/derivatives/{base}_w{target}.{fmt}', ContentFile(data))
+                written.append(name)
+                variants.setdefault(fmt, []).append([target, name, media_url(storage, name)])
+    except Exception:
+        for name in written:
+            storage.delete(name)
+        raise
+
+    previous_names = media.derivative_names()
+    previous_source = media.derivatives.get('source')
+    media.derivatives = {'source': media.media_file.name, 'width': width, 'height': height, 'variants': variants}
+    # Saving refreshes the post's cached card and feed pages (posts.signals)
+    media.save(update_fields=['derivatives'])
+    # The copies these replace, unless rows sharing the file still show them
+    sharing = PostMedia.objects.filter(derivatives__source=previous_source).exclude(pk=media.pk)
+    if previous_names and not sharing.exists():
+        for name in previous_names:
+            storage.delete(name)
+    return True
+
+
+def generate_missing(force=False):
+    """Writes derivatives for every ready image lacking current ones; returns how many were made"""
+    images = (
+        PostMedia.objects.filter(status=PostMedia.STATUS_READY, media_type='image')
+        .exclude(media_file__isnull=True)
+        .exclude(media_file='')
+    )
+    made = 0
+    for media in images.iterator():
+        if is_current(media) and not force:
+            continue
+        try:
+            made += generate(media.pk, force=force)
+        except Exception as e:
+            logger.error(f"Derivatives for media {media.pk} failed: {e}")
+    return made
@@ -0,0 +1,229 @@
+"""Upload tickets: media goes from the browser straight to the storage provider.
+
+A ticket is an expiring, signed (``django.core.signing``) description of
+one upload: the storage name the file will get, who may attach it to which
+post, and how many bytes it has. ``issue`` turns it into a descriptor the
+browser follows (URL, method, form fields, headers) without the bytes ever
+passing through a Django worker. Afterwards the browser confirms the
+upload with the ticket and the provider's reply; ``confirm`` checks both
+signatures before anything is written to the database.
+
+With Cloudinary credentials the descriptor is a signed Cloudinary upload.
+Without them ``LocalBackend`` stands in for the provider: its endpoint
+(``posts.uploads.local_direct_upload``) writes into the media storage and
+signs a receipt the way Cloudinary signs its responses. It exists for
+development and tests, not for production traffic.
+
+A ticket only admits the format its file name announces. Cloudinary gets
+that as a signed ``allowed_formats``; its upload API has no size limit to
+sign, so ``confirm`` also looks the stored object up and rejects (and
+deletes) one whose byte length, format or resource type differ from the
+ticket before any PostMedia row is written.
+"""
+import os
+import time
+import uuid
+
+import cloudinary
+import cloudinary.api
+import cloudinary.exceptions
+import cloudinary.uploader
+import cloudinary.utils
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+
+from .models import PostMedia
+
+TICKET_SALT = 'posts.direct_uploads.ticket'
+RECEIPT_SALT = 'posts.direct_uploads.receipt'
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi'}
+# Formats a ticket accepts for each extension, named as Cloudinary reports them
+ALLOWED_FORMATS = {
+    '.jpg': ['jpg'],
+    '.jpeg': ['jpg'],
+    '.png': ['png'],
+    '.gif': ['gif'],
+    '.mp4': ['mp4'],
+    '.mov': ['mov'],
+    '.avi': ['avi'],
+}
+
+
+class UploadRejected(Exception):
+    """A ticket or provider reply that does not check out"""
+
+
+def _media_field():
+    return PostMedia._meta.get_field('media_file')
+
+
+def _extension(claims):
+    return os.path.splitext(claims['name'])[1].lower()
+
+
+def resource_type(claims):
+    return 'video' if _extension(claims) in VIDEO_EXTENSIONS else 'image'
+
+
+def sniff_format(head):
+    """A file's format from its first bytes, named like ALLOWED_FORMATS; None when unknown"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'avi'
+    if head[4:8] == b'ftyp':
+        return 'mov' if head[8:12] == b'qt  ' else 'mp4'
+    return None
+
+
+def check_object(claims, size, fmt, kind=None):
+    """Raises UploadRejected unless a stored object is what the ticket allowed"""
+    if size != claims['length']:
+        raise UploadRejected('Upload size does not match its ticket')
+    if fmt not in ALLOWED_FORMATS.get(_extension(claims), []):
+        raise UploadRejected('Upload format does not match its ticket')
+    if kind is not None and kind != resource_type(claims):
+        raise UploadRejected('Upload type does not match its ticket')
+
+
+def make_ticket(user, post, filename, length):
+    """Signs the claims of one upload; returns ``(token, claims)``"""
+    extension = os.path.splitext(filename)[1].lower()
+    name = _media_field().generate_filename(PostMedia(post=post), f'{uuid.uuid4().hex}{extension}')
+    claims = {'user': user.pk, 'post': post.pk, 'name': name, 'filename': filename, 'length': length}
+    return signing.dumps(claims, salt=TICKET_SALT, compress=True), claims
+
+
+def read_ticket(token, user=None):
+    """Returns the claims of a valid, unexpired ticket (issued to ``user`` when given)"""
+    try:
+        claims = signing.loads(token, salt=TICKET_SALT, max_age=settings.MEDIA_DIRECT_UPLOAD_TTL)
+    except signing.SignatureExpired:
+        raise UploadRejected('Upload ticket expired')
+    except signing.BadSignature:
+        raise UploadRejected('Invalid upload ticket')
+    if user is not None and claims['user'] != user.pk:
+        raise UploadRejected('Upload ticket was issued to someone else')
+    return claims
+
+
+class LocalBackend:
+    """Our own endpoint plays the provider; the media storage holds the file"""
+
+    def descriptor(self, token, claims):
+        return {
+            'url': reverse('direct_upload_local', args=[token]),
+            'method': 'PUT',
+            'headers': {'Content-Type': 'application/octet-stream'},
+            'fields': {},
+        }
+
+    def store(self, claims, stream):
+        """Saves the uploaded body; returns the signed receipt the browser confirms with"""
+        storage = _media_field().storage
+        name = storage.save(claims['name'], stream)
+        with storage.open(name, 'rb') as saved:
+            fmt = sniff_format(saved.read(16))
+        try:
+            if name != claims['name']:
+                raise UploadRejected('Upload does not match its ticket')
+            check_object(claims, storage.size(name), fmt)
+        except UploadRejected:
+            storage.delete(name)
+            raise
+        # Like Cloudinary's reply: what was stored, signed by the provider
+        stored = {'name': name, 'bytes': claims['length'], 'format': fmt}
+        return {'name': name, 'signature': signing.dumps(stored, salt=RECEIPT_SALT)}
+
+    def verify(self, claims, reply):
+        try:
+            stored = signing.loads(str(reply.get('signature', '')), salt=RECEIPT_SALT)
+        except signing.BadSignature:
+            raise UploadRejected('Invalid upload receipt')
+        if stored['name'] != claims['name']:
+            raise UploadRejected('Receipt is for another upload')
+        check_object(claims, stored['bytes'], stored['format'])
+        return stored['name']
+
+
+def storage_prefix():
+    """The folder django-cloudinary-storage keeps media in: its ``PREFIX`` setting, else ``MEDIA_URL``"""
+    prefix = getattr(settings, 'CLOUDINARY_STORAGE', {}).get('PREFIX', settings.MEDIA_URL).lstrip('/')
+    return prefix if not prefix or prefix.endswith('/') else prefix + '/'
+
+
+class CloudinaryBackend:
+    """Signed upload straight to Cloudinary; the reply is checked with the API secret"""
+
+    def _public_id(self, claims):
+        # The public id the media storage gives this name, so the row's file resolves
+        name = os.path.splitext(claims['name'])[0]
+        prefix = storage_prefix()
+        return name if name.startswith(prefix) else prefix + name
+
+    def descriptor(self, token, claims):
+        config = cloudinary.config()
+        params = {
+            'public_id': self._public_id(claims),
+            'allowed_formats': ','.join(ALLOWED_FORMATS[_extension(claims)]),
+            'timestamp': int(time.time()),
+        }
+        params['signature'] = cloudinary.utils.api_sign_request(params, config.api_secret)
+        params['api_key'] = config.api_key
+        return {
+            'url': cloudinary.utils.cloudinary_api_url('upload', resource_type=resource_type(claims)),
+            'method': 'POST',
+            'headers': {},
+            'fields': params,
+            'file_field': 'file',
+        }
+
+    def verify(self, claims, reply):
+        public_id = reply.get('public_id')
+        if public_id != self._public_id(claims):
+            raise UploadRejected('Reply is for another upload')
+        if not cloudinary.utils.verify_api_response_signature(
+            public_id, reply.get('version'), reply.get('signature')
+        ):
+            raise UploadRejected('Invalid provider signature')
+        # The reply's own bytes/format are not signed; ask the Admin API
+        kind = resource_type(claims)
+        try:
+            stored = cloudinary.api.resource(public_id, resource_type=kind)
+        except cloudinary.exceptions.NotFound:
+            raise UploadRejected('Upload not found at the provider')
+        try:
+            check_object(claims, stored.get('bytes'), stored.get('format'), stored.get('resource_type'))
+        except UploadRejected:
+            cloudinary.uploader.destroy(public_id, resource_type=kind, invalidate=True)
+            raise
+        return public_id
+
+
+def get_backend():
+    if cloudinary.config().api_secret:
+        return CloudinaryBackend()
+    return LocalBackend()
+
+
+def issue(user, post, filename, length):
+    """The descriptor the browser uploads with, ticket included"""
+    token, claims = make_ticket(user, post, filename, length)
+    descriptor = get_backend().descriptor(token, claims)
+    descriptor.update(
+        ticket=token,
+        name=claims['name'],
+        expires_in=settings.MEDIA_DIRECT_UPLOAD_TTL,
+    )
+    return descriptor
+
+
+def confirm(user, token, reply):
+    """Checks a finished upload; returns ``(claims, stored name)`` or raises UploadRejected"""
+    claims = read_ticket(token, user)
+    return claims, get_backend().verify(claims, reply)
@@ -0,0 +1,96 @@
+"""Querysets for rendering feeds of posts in a constant number of queries."""
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from comments.models import Comment
+from reddit_clone.pagination import canonical_cursor, keyset_page
+from . import ranking, vote_buffer
+from .models import Post, PostMedia, Vote
+
+
+def _related_count(model, field='post'):
+    """Correlated COUNT subquery, cheaper than joining several reverse relations"""
+    counts = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(c=Count('pk'))
+        .values('c')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def feed_queryset(queryset=None):
+    """Post queryset with everything a post card renders.
+
+    Author and community are joined, comment and media counts are annotated
+    (``comment_count``, ``media_count``), media rows are prefetched into
+    ``post.media_files.all`` and vote totals come from the stored counters,
+    so a page costs the same number of queries whatever its size.
+    """
+    if queryset is None:
+        queryset = Post.objects.all()
+    return (
+        queryset
+        .select_related('author', 'community')
+        .annotate(
+            comment_count=_related_count(Comment),
+            media_count=_related_count(PostMedia),
+        )
+        .prefetch_related(
+            Prefetch('media_files', queryset=PostMedia.objects.order_by('created_at', 'pk'))
+        )
+    )
+
+
+# Posts per feed page, for the HTML lists and the JSON feed
+FEED_PAGE_SIZE = 10
+
+
+def feed_page(queryset=None, sort=ranking.SORT_NEW, period=None, cursor=None, limit=FEED_PAGE_SIZE):
+    """One feed page after ``cursor``: ``(posts, next_cursor)``.
+
+    Pages continue from the last ``(sort key, id)`` seen, so any page is an
+    index range scan like the first one and nothing is counted. Raises
+    ``reddit_clone.pagination.InvalidCursor`` for a tampered cursor.
+    """
+    sort, period = ranking.normalize_sort(sort, period)
+    queryset = ranking.apply_sort(feed_queryset(queryset), sort, period)
+    return keyset_page(queryset, ranking.SORT_ORDERING[sort], cursor, limit, ordered=True)
+
+
+def feed_query(request):
+    """The feed parameters of a request (``sort``, ``t``, ``cursor``), as ``feed_page`` reads them"""
+    sort, period = ranking.normalize_sort(request.GET.get('sort'), request.GET.get('t'))
+    cursor = canonical_cursor(request.GET.get('cursor'), Post, ranking.SORT_ORDERING[sort])
+    return {'sort': sort, 't': period, 'cursor': cursor}
+
+
+def get_user_votes(post_ids, user):
+    """Returns ``{post_id: 1 or -1}`` for the posts ``user`` voted on, in one query"""
+    post_ids = list(post_ids)
+    if not post_ids or not getattr(user, 'is_authenticated', False):
+        return {}
+    return dict(
+        Vote.objects.filter(user_id=user.pk, post_id__in=post_ids).values_list('post_id', 'value')
+    )
+
+
+def attach_user_votes(posts, user):
+    """Sets ``post.viewer_vote`` (1, -1 or 0) on every post; returns the posts as a list"""
+    posts = list(posts)
+    post_ids = [post.pk for post in posts]
+    votes = get_user_votes(post_ids, user)
+
+    deltas = {}
+    if vote_buffer.is_enabled() and post_ids:
+        # Overlaying clicks that have not been flushed to the database yet
+        buffer = vote_buffer.get_vote_buffer()
+        deltas = buffer.pending_deltas(post_ids)
+        if user.is_authenticated:
+            votes.update(buffer.pending_votes(post_ids, user.pk))
+
+    for post in posts:
+        post.viewer_vote = votes.get(post.pk, 0)
+        post.pending_score_delta = deltas.get(post.pk, 0)
+    return posts
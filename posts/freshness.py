@@ -0,0 +1,78 @@
+"""Cheap summaries of what post pages show, for conditional GET.
+
+Each function returns the ETag parts for
+``reddit_clone.conditional.conditional_page``, or None when the page does
+not exist or the request cannot be summarized (a bad cursor): the post and
+comment timestamps plus the counters that change without touching a
+timestamp (vote flips and removals, deleted comments, joins).
+"""
+from django.db.models import DateTimeField, Max, OuterRef, Subquery
+
+from comments.models import Comment
+from reddit_clone.pagination import InvalidCursor, keyset_page
+from . import ranking, vote_buffer
+from .feeds import FEED_PAGE_SIZE, _related_count
+from .models import Post
+
+
+def _pending_deltas(post_ids):
+    # Rendered scores include votes still sitting in the write-behind buffer
+    if not vote_buffer.is_enabled() or not post_ids:
+        return {}
+    return vote_buffer.get_vote_buffer().pending_deltas(post_ids)
+
+
+def _last_comment_at():
+    latest = (
+        Comment.objects.filter(post=OuterRef('pk'))
+        .order_by()
+        .values('post')
+        .annotate(latest=Max('updated_at'))
+        .values('latest')
+    )
+    return Subquery(latest, output_field=DateTimeField())
+
+
+def post_detail_state(request, pk):
+    """One indexed query: the post's timestamps and counters plus its comments'"""
+    row = (
+        Post.objects.filter(pk=pk)
+        .annotate(last_comment_at=_last_comment_at(), comment_count=_related_count(Comment))
+        .values_list('updated_at', 'upvote_count', 'downvote_count', 'last_comment_at', 'comment_count')
+        .first()
+    )
+    if row is None:
+        return None
+    return row, _pending_deltas([pk])
+
+
+def community_page_state(request, community_name):
+    """The community's counters and the rows of the requested feed page, without joins"""
+    from communities.models import Community
+
+    community = (
+        Community.objects.filter(name=community_name)
+        .values_list('pk', 'description', 'member_count', 'post_count')
+        .first()
+    )
+    if community is None:
+        return None
+
+    # Same page as the view's feed_page(), minus the joins and the media prefetch
+    posts = ranking.apply_sort(
+        Post.objects.filter(community_id=community[0])
+        .annotate(comment_count=_related_count(Comment))
+        .only('pk', 'created_at', 'updated_at', 'upvote_count', 'downvote_count'),
+        ranking.SORT_NEW,
+    )
+    ordering = ranking.SORT_ORDERING[ranking.SORT_NEW]
+    try:
+        page, _ = keyset_page(posts, ordering, request.GET.get('cursor'), FEED_PAGE_SIZE, ordered=True)
+    except InvalidCursor:
+        return None
+
+    rows = [
+        (post.pk, post.updated_at, post.upvote_count, post.downvote_count, post.comment_count)
+        for post in page
+    ]
+    return community, rows, _pending_deltas([post.pk for post in page])
@@ -0,0 +1,93 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from posts import ranking
+from posts.models import Post
+
+BENCH_PREFIX = 'bench-feed-'
+
+
+class Command(BaseCommand):
+    help = 'Seed a large post table and report p50/p95 feed latency for every sort'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Feed pages fetched per sort')
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep seeded posts instead of deleting them afterwards')
+
+    def handle(self, *args, **options):
+        author, _ = User.objects.get_or_create(username=f'{BENCH_PREFIX}author')
+        existing = Post.objects.filter(author=author).count()
+        if existing < options['posts']:
+            self.seed(author, options['posts'] - existing)
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        sorts = [(sort, None) for sort in ranking.SORT_ORDERING if sort != ranking.SORT_TOP]
+        sorts += [(ranking.SORT_TOP, period) for period in ranking.TOP_PERIODS]
+        page_size = options['page_size']
+
+        self.stdout.write(f"{Post.objects.count()} posts, {options['requests']} pages per sort")
+        for sort, period in sorts:
+            timings = []
+            for _ in range(options['requests']):
+                # Spread requests over the first pages the way real traffic does
+                offset = random.randrange(0, 5) * page_size
+                started = time.perf_counter()
+                list(ranking.apply_sort(Post.objects.all(), sort, period)
+                     .values_list('pk', flat=True)[offset:offset + page_size])
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            label = f"{sort}/{period}" if period else sort
+            self.stdout.write(
+                f"{label:<16} p50={statistics.median(timings):7.2f}ms  p95={p95:7.2f}ms"
+            )
+
+        if not options['keep']:
+            Post.objects.filter(author=author).delete()
+            author.delete()
+
+    def seed(self, author, count, batch_size=10_000):
+        self.stdout.write(f"Seeding {count} posts...")
+        now = timezone.now()
+        # Seeded posts need a spread of ages, which auto_now_add would overwrite
+        created_at_field = Post._meta.get_field('created_at')
+        created_at_field.auto_now_add = False
+        try:
+            self._seed_batches(author, count, now, batch_size)
+        finally:
+            created_at_field.auto_now_add = True
+        self.stdout.write("Seeded")
+
+    def _seed_batches(self, author, count, now, batch_size):
+        created = 0
+        while created < count:
+            batch = []
+            for i in range(min(batch_size, count - created)):
+                post = Post(
+                    title=f'{BENCH_PREFIX}{created + i}',
+                    content='benchmark',
+                    author=author,
+                    upvote_count=random.randint(0, 500),
+                    downvote_count=random.randint(0, 200),
+                    created_at=now - timedelta(seconds=random.randint(0, 365 * 24 * 3600)),
+                )
+                post.score = post.upvote_count - post.downvote_count
+                for field, value in ranking.compute_ranks(post, now).items():
+                    setattr(post, field, value)
+                batch.append(post)
+            with transaction.atomic():
+                Post.objects.bulk_create(batch)
+            created += len(batch)
@@ -8,7 +8,8 @@ class Command(BaseCommand):
         # Удаляем записи без файлов
         empty_count = 0
         
-        for media in PostMedia.objects.all():
+        # Staged uploads have no file until the media pipeline finishes them
+        for media in PostMedia.objects.filter(status=PostMedia.STATUS_READY):
             has_file = False
             
             # Проверяем все возможные поля файлов
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from posts.media_pipeline import staging_storage
+from posts.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable uploads that were never finalized, with their staged files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Idle time after which an upload expires')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        expired = UploadSession.objects.filter(media__isnull=True, updated_at__lt=cutoff)
+        storage = staging_storage()
+        count = 0
+        for session in expired.iterator():
+            storage.delete(session.staged_name)
+            session.delete()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} expired uploads"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from posts.vote_buffer import flush_vote_buffer
+
+
+class Command(BaseCommand):
+    help = 'Write buffered (write-behind) votes to the database'
+
+    def handle(self, *args, **options):
+        flushed = flush_vote_buffer()
+        self.stdout.write(self.style.SUCCESS(f"Flushed {flushed} buffered votes"))
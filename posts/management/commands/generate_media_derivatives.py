@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from posts.derivatives import generate_missing
+
+
+class Command(BaseCommand):
+    help = 'Write the resized srcset copies of ready images that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate images that already have copies')
+
+    def handle(self, *args, **options):
+        made = generate_missing(force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f"Generated derivatives for {made} images"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from posts.media_pipeline import process_pending
+from posts.models import PostMedia
+
+
+class Command(BaseCommand):
+    help = 'Upload staged post media that no background worker finished'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stuck', action='store_true',
+            help='Also retry uploads left "processing" by a worker that died (only when no workers run)',
+        )
+        parser.add_argument('--failed', action='store_true', help='Also retry failed uploads')
+
+    def handle(self, *args, **options):
+        statuses = [PostMedia.STATUS_PENDING]
+        if options['stuck']:
+            statuses.append(PostMedia.STATUS_PROCESSING)
+        if options['failed']:
+            statuses.append(PostMedia.STATUS_FAILED)
+
+        results = process_pending(statuses)
+        summary = ', '.join(f'{count} {status}' for status, count in sorted(results.items())) or 'nothing to do'
+        self.stdout.write(self.style.SUCCESS(f"Processed staged media: {summary}"))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from posts.models import Post, Vote
+from posts.voting import recount_votes, vote_count_subquery
+
+
+class Command(BaseCommand):
+    help = 'Rebuild stored upvote/downvote/score counters on Post from Vote rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--post', type=int, action='append', dest='post_ids',
+            help='Only rebuild the given post id (can be repeated)'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drifted posts without writing anything'
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        if options['post_ids']:
+            posts = posts.filter(pk__in=options['post_ids'])
+
+        actual = posts.annotate(
+            actual_up=vote_count_subquery(Vote.UPVOTE),
+            actual_down=vote_count_subquery(Vote.DOWNVOTE),
+        )
+        drifted_count = actual.filter(
+            ~Q(upvote_count=F('actual_up'))
+            | ~Q(downvote_count=F('actual_down'))
+            | ~Q(score=F('actual_up') - F('actual_down'))
+        ).count()
+
+        if options['dry_run']:
+            self.stdout.write(f"{drifted_count} posts have drifted vote counters")
+            return
+
+        recount_votes(posts)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt vote counters ({drifted_count} posts had drifted)")
+        )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from posts.models import Post, PostMedia, _storage_url, media_url
+from reddit_clone.page_cache import invalidate_post_pages
+
+# Rows rewritten per bulk_update; only one batch is held in memory
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored delivery URLs of post media (after a CDN or storage change)'
+
+    def handle(self, *args, **options):
+        _storage_url.cache_clear()
+        self.total = 0
+        self.community_ids = set()
+        batch = []
+        media_files = PostMedia.objects.exclude(media_file__isnull=True).exclude(media_file='')
+        for media in media_files.iterator(chunk_size=BATCH_SIZE):
+            media.refresh_delivery_url()
+            storage = media.media_file.storage
+            for entries in media.derivatives.get('variants', {}).values():
+                for entry in entries:
+                    entry[2:] = [media_url(storage, entry[1])]
+            batch.append(media)
+            if len(batch) >= BATCH_SIZE:
+                self.save_batch(batch)
+                batch = []
+        if batch:
+            self.save_batch(batch)
+        invalidate_post_pages(*self.community_ids)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed URLs of {self.total} media files"))
+
+    def save_batch(self, batch):
+        PostMedia.objects.bulk_update(batch, ['delivery_url', 'derivatives'])
+        # bulk_update sends no signals: move the cached cards and pages along like posts.signals does
+        posts = Post.objects.filter(pk__in={media.post_id for media in batch})
+        posts.update(updated_at=timezone.now())
+        self.community_ids.update(posts.values_list('community_id', flat=True))
+        self.total += len(batch)
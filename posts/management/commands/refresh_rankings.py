@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from posts import ranking
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Refresh precomputed feed rank keys (schedule every few minutes for the rising sort)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Recompute hot/controversial/rising ranks for every post, not just recent ones'
+        )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            updated = ranking.refresh_ranks(Post.objects.all())
+            self.stdout.write(self.style.SUCCESS(f"Recomputed ranks for {updated} posts"))
+            return
+
+        refreshed, expired = ranking.refresh_rising()
+        self.stdout.write(
+            self.style.SUCCESS(f"Refreshed {refreshed} rising posts, retired {expired}")
+        )
@@ -0,0 +1,246 @@
+"""Uploading post media without holding a request for one file after another.
+
+Creating or editing a post only writes its files to a local staging
+directory (``MEDIA_STAGING_ROOT``) and records one ``PostMedia`` row per
+file in ``pending`` status, so the request returns as soon as the bytes are
+on disk. A per-process thread pool (``MEDIA_UPLOAD_WORKERS`` threads, no
+broker) then pushes each file to the media storage and marks the row
+``ready``, or ``failed`` with the error and the staged file kept for a
+retry. With ``MEDIA_PIPELINE_SYNC`` on, ``upload_now`` uploads the files
+inside the request instead, concurrently, so a post with several files
+waits about as long as its slowest file.
+
+Files are stored content-addressed (posts.blobs): bytes that are already
+stored are not uploaded again.
+
+Once a row is ready, images also get resized copies for srcset
+(posts.derivatives). That always happens on the pool, in both modes.
+
+Rows a dead worker left behind are picked up by
+``manage.py process_pending_media``.
+"""
+import atexit
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections, transaction
+
+from . import blobs, derivatives
+from .models import MediaBlob, PostMedia
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def staging_storage():
+    return FileSystemStorage(location=settings.MEDIA_STAGING_ROOT)
+
+
+def stage_upload(post, uploaded_file):
+    """Writes ``uploaded_file`` to the staging directory; returns its pending PostMedia"""
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    staged_name = staging_storage().save(f'{uuid.uuid4().hex}{extension}', uploaded_file)
+    sha256, _ = getattr(uploaded_file, 'content_digest', None) or ('', 0)
+    return PostMedia.objects.create(
+        post=post,
+        status=PostMedia.STATUS_PENDING,
+        staged_name=staged_name,
+        staged_sha256=sha256,
+        original_name=os.path.basename(uploaded_file.name),
+    )
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.MEDIA_UPLOAD_WORKERS, thread_name_prefix='media-upload'
+            )
+        return _executor
+
+
+def upload_now(post, uploaded_files):
+    """Uploads ``uploaded_files`` to the media storage in parallel; returns ``(media, errors)``.
+
+    Files whose bytes are already stored are not uploaded again, and
+    neither is a second copy within the same request. At most
+    MEDIA_UPLOAD_WORKERS files upload at once. A file that fails is
+    reported as ``(file name, message)`` and the others still go through;
+    the PostMedia rows of the successful ones are created in a single
+    transaction, and if that fails the newly stored files are removed.
+    """
+    uploaded_files = [uploaded for uploaded in uploaded_files if uploaded]
+    if not uploaded_files:
+        return [], []
+    field = PostMedia._meta.get_field('media_file')
+    hashes = [blobs.digest(uploaded) for uploaded in uploaded_files]
+    known = set(MediaBlob.objects.filter(sha256__in=[sha256 for sha256, _ in hashes]).values_list('sha256', flat=True))
+    new = {}
+    for uploaded, (sha256, _) in zip(uploaded_files, hashes):
+        if sha256 not in known:
+            new.setdefault(sha256, uploaded)
+
+    def store(sha256, uploaded):
+        # Storage and decoding only: no database access from the pool threads
+        name = field.storage.save(blobs.blob_name(sha256, uploaded.name), uploaded, max_length=field.max_length)
+        return name, blobs.perceptual_hash(uploaded, uploaded.name)
+
+    futures = {}
+    if new:
+        workers = min(settings.MEDIA_UPLOAD_WORKERS, len(new))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media-upload') as executor:
+            futures = {sha256: executor.submit(store, sha256, uploaded) for sha256, uploaded in new.items()}
+
+    stored, errors = {}, []
+    for sha256, future in futures.items():
+        try:
+            stored[sha256] = future.result()
+        except Exception as e:
+            logger.error(f"Media upload {new[sha256].name} failed: {e}")
+            errors.append((new[sha256].name, str(e)))
+    failed = set(futures) - set(stored)
+
+    try:
+        with transaction.atomic():
+            media = []
+            for uploaded, (sha256, size) in zip(uploaded_files, hashes):
+                if sha256 in failed:
+                    continue
+                blob = blobs.claim(sha256)
+                if blob is None:
+                    # Known when checked but since deleted: store it after all
+                    name, phash = stored[sha256] if sha256 in stored else store(sha256, uploaded)
+                    stored[sha256] = (name, phash)
+                    blob = blobs.register(sha256, name, size, phash)
+                media.append(PostMedia.objects.create(
+                    post=post, blob=blob, media_file=blob.name, original_name=os.path.basename(uploaded.name)
+                ))
+    except Exception:
+        for name, _ in stored.values():
+            field.storage.delete(name)
+        raise
+    queue_derivatives(media)
+    return media, errors
+
+
+def submit(media):
+    """Queues the upload of every pending PostMedia in ``media``"""
+    media_ids = [item.pk for item in media]
+    if not media_ids:
+        return
+    if settings.MEDIA_PIPELINE_SYNC:
+        # Files staged another way (resumable uploads) are finished inline too
+        for media_id in media_ids:
+            process_media(media_id)
+        return
+
+    _enqueue(process_media, media_ids)
+
+
+def queue_derivatives(media):
+    """Queues the srcset copies of the images in ``media``; never runs them inline"""
+    _enqueue(derivatives.generate, [item.pk for item in media if item.media_type == 'image'])
+
+
+def _enqueue(task, media_ids):
+    if not media_ids:
+        return
+
+    def enqueue():
+        executor = _get_executor()
+        try:
+            for media_id in media_ids:
+                executor.submit(_run_in_worker, task, media_id)
+        except RuntimeError:
+            # The pool is shutting down with the process; the management commands catch up
+            logger.warning(f"{task.__name__} not queued for media {media_ids}: worker pool is shut down")
+
+    # Workers must not look for rows the request has not committed yet
+    transaction.on_commit(enqueue)
+
+
+def _run_in_worker(task, media_id):
+    try:
+        task(media_id)
+    except Exception:
+        logger.exception(f"{task.__name__} of media {media_id} crashed")
+    finally:
+        close_old_connections()
+
+
+def process_media(media_id):
+    """Uploads one staged file to the media storage; returns the final status.
+
+    The pending -> processing update claims the row, so a file is never
+    uploaded twice when the command and a worker race for it.
+    """
+    claimed = PostMedia.objects.filter(pk=media_id, status=PostMedia.STATUS_PENDING).update(
+        status=PostMedia.STATUS_PROCESSING
+    )
+    if not claimed:
+        return None
+    media = PostMedia.objects.get(pk=media_id)
+    staging = staging_storage()
+
+    try:
+        with staging.open(media.staged_name) as staged:
+            staged = File(staged)
+            content_digest = (media.staged_sha256, staged.size) if media.staged_sha256 else None
+            blob = blobs.store(staged, media.original_name or media.staged_name, content_digest)
+    except Exception as e:
+        logger.error(f"Media upload {media_id} failed: {e}")
+        media.status = PostMedia.STATUS_FAILED
+        media.error = str(e)[:1000]
+        media.save(update_fields=['status', 'error'])
+        return media.status
+
+    staged_name = media.staged_name
+    media.blob = blob
+    media.media_file.name = blob.name
+    media.status = PostMedia.STATUS_READY
+    media.staged_name = ''
+    media.staged_sha256 = ''
+    media.error = ''
+    try:
+        # Saving the row also refreshes the post's cached card and feed pages (posts.signals)
+        media.save(update_fields=[
+            'blob', 'media_file', 'media_type', 'status', 'staged_name', 'staged_sha256', 'error'
+        ])
+    except Exception:
+        blobs.release(blob.pk)
+        raise
+    staging.delete(staged_name)
+    queue_derivatives([media])
+    return media.status
+
+
+def process_pending(statuses=(PostMedia.STATUS_PENDING,)):
+    """Uploads every staged file in ``statuses`` inline; returns ``{status: count}``"""
+    unfinished = PostMedia.objects.filter(status__in=statuses).order_by('created_at')
+    media_ids = list(unfinished.values_list('pk', flat=True))
+    # Rows stuck mid-upload or failed go back to pending to be claimed again
+    PostMedia.objects.filter(pk__in=media_ids).exclude(status=PostMedia.STATUS_PENDING).update(
+        status=PostMedia.STATUS_PENDING
+    )
+    results = {}
+    for media_id in media_ids:
+        status = process_media(media_id)
+        if status:
+            results[status] = results.get(status, 0) + 1
+    return results
+
+
+@atexit.register
+def _finish_on_exit():
+    # Let queued uploads finish before the worker process goes away
+    if _executor is not None:
+        _executor.shutdown(wait=True)
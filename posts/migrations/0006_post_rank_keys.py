@@ -0,0 +1,99 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:06
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+from math import log10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# A frozen copy of posts.ranking as of this migration, so later edits to
+# the live formulas do not change what the backfill did
+HOT_EPOCH = datetime(2005, 12, 8, 7, 46, 43, tzinfo=dt_timezone.utc)
+HOT_DECAY_SECONDS = 45000
+RISING_WINDOW = timedelta(hours=24)
+RISING_GRAVITY = 1.5
+
+
+def compute_ranks(post, now):
+    created_at = post.created_at or now
+    score = post.score
+
+    order = log10(max(abs(score), 1))
+    sign = 1 if score > 0 else -1 if score < 0 else 0
+    hot = round(sign * order + (created_at - HOT_EPOCH).total_seconds() / HOT_DECAY_SECONDS, 7)
+
+    up, down = post.upvote_count, post.downvote_count
+    controversy = 0.0
+    if up > 0 and down > 0:
+        controversy = (up + down) ** (down / up if up > down else up / down)
+
+    age = now - created_at
+    rising = 0.0
+    if score > 0 and age <= RISING_WINDOW:
+        rising = score / (max(age.total_seconds(), 0) / 3600 + 2) ** RISING_GRAVITY
+
+    return {'hot_rank': hot, 'controversy_rank': controversy, 'rising_rank': rising}
+
+
+def backfill_rank_keys(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    now = timezone.now()
+    batch = []
+    for post in Post.objects.iterator(chunk_size=1000):
+        for field, value in compute_ranks(post, now).items():
+            setattr(post, field, value)
+        batch.append(post)
+        if len(batch) >= 1000:
+            Post.objects.bulk_update(batch, ['hot_rank', 'controversy_rank', 'rising_rank'])
+            batch = []
+    if batch:
+        Post.objects.bulk_update(batch, ['hot_rank', 'controversy_rank', 'rising_rank'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communities', '0001_initial'),
+        ('posts', '0005_post_vote_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='controversy_rank',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='hot_rank',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rising_rank',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_rank', '-id'], name='post_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-score', '-id'], name='post_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-rising_rank', '-id'], name='post_rising_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-controversy_rank', '-id'], name='post_controversial_idx'),
+        ),
+        migrations.RunPython(backfill_rank_keys, migrations.RunPython.noop),
+    ]
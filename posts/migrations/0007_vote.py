@@ -0,0 +1,71 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _vote_count(Vote, value):
+    counts = (
+        Vote.objects.filter(post_id=OuterRef('pk'), value=value)
+        .values('post_id')
+        .annotate(c=Count('pk'))
+        .values('c')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def copy_m2m_votes(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Vote = apps.get_model('posts', 'Vote')
+
+    # Upvotes go first, so a user found in both tables keeps the upvote
+    for through, value in ((Post.upvotes.through, 1), (Post.downvotes.through, -1)):
+        batch = []
+        for post_id, user_id in through.objects.values_list('post_id', 'user_id').iterator(chunk_size=2000):
+            batch.append(Vote(post_id=post_id, user_id=user_id, value=value))
+            if len(batch) >= 2000:
+                Vote.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        Vote.objects.bulk_create(batch, ignore_conflicts=True)
+
+    Post.objects.update(
+        upvote_count=_vote_count(Vote, 1),
+        downvote_count=_vote_count(Vote, -1),
+    )
+    Post.objects.update(score=F('upvote_count') - F('downvote_count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_post_rank_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.SmallIntegerField(choices=[(1, 'Upvote'), (-1, 'Downvote')])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='posts.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_votes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('post', 'user'), name='unique_post_vote')],
+            },
+        ),
+        migrations.RunPython(copy_m2m_votes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='post',
+            name='downvotes',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='upvotes',
+        ),
+    ]
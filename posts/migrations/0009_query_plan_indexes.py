@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_post_community_new_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='postmedia',
+            index=models.Index(fields=['post', 'created_at', 'id'], name='postmedia_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['user', 'post'], name='vote_user_post_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
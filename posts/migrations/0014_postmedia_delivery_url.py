@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_media_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='delivery_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
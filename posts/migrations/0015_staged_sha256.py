@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_postmedia_delivery_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='staged_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -4,11 +4,16 @@ from django.urls import reverse
 from django.core.validators import FileExtensionValidator
 from django.conf import settings
 from cloudinary_storage.storage import MediaCloudinaryStorage
+from functools import lru_cache
+import logging
 import os
+import uuid
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
 
+logger = logging.getLogger(__name__)
+
 class SmartCloudinaryStorage(MediaCloudinaryStorage):
     """Smart storage that auto-detects file type"""
     def get_resource_type(self, name):
@@ -40,8 +45,15 @@ class Post(models.Model):
         related_name='posts'
     )
     
-    upvotes = models.ManyToManyField(User, related_name='upvoted_posts', blank=True)
-    downvotes = models.ManyToManyField(User, related_name='downvoted_posts', blank=True)
+    # Denormalized vote counters over Vote rows, maintained by vote_post
+    upvote_count = models.PositiveIntegerField(default=0)
+    downvote_count = models.PositiveIntegerField(default=0)
+    score = models.IntegerField(default=0)
+
+    # Precomputed feed rank keys, see posts.ranking
+    hot_rank = models.FloatField(default=0)
+    controversy_rank = models.FloatField(default=0)
+    rising_rank = models.FloatField(default=0)
     
     media_file = models.FileField(
         upload_to='post_media/%Y/%m/%d/',
@@ -63,21 +75,88 @@ class Post(models.Model):
         default='none'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_new_idx'),
+            models.Index(fields=['-hot_rank', '-id'], name='post_hot_idx'),
+            models.Index(fields=['-score', '-id'], name='post_top_idx'),
+            models.Index(fields=['-rising_rank', '-id'], name='post_rising_idx'),
+            models.Index(fields=['-controversy_rank', '-id'], name='post_controversial_idx'),
+            # Community feeds page by (created_at, id) within one community
+            models.Index(fields=['community', '-created_at', '-id'], name='post_community_new_idx'),
+        ]
+
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        # Ranks only change with votes, so a plain save keeps them in sync
+        from .ranking import compute_ranks
+        for field, value in compute_ranks(self).items():
+            setattr(self, field, value)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'hot_rank', 'controversy_rank', 'rising_rank'}
+        super().save(*args, **kwargs)
     
     def get_absolute_url(self):
         return reverse('post_detail', kwargs={'pk': self.pk})
     
+    @property
+    def card_version(self):
+        """Changes whenever the viewer-independent part of the post card does.
+
+        Edits move ``updated_at`` through auto_now and media changes touch it
+        (see posts.signals); votes and comment counts render outside the
+        cached fragment.
+        """
+        return int(self.updated_at.timestamp() * 1_000_000) if self.updated_at else 0
+
     def total_votes(self):
-        return self.upvotes.count() - self.downvotes.count()
-    
+        # Votes still sitting in the write-behind buffer are merged in by the views
+        return self.score + getattr(self, 'pending_score_delta', 0)
+
+    @property
+    def upvotes(self):
+        """Users who upvoted the post (read-only, votes live in Vote)"""
+        return User.objects.filter(post_votes__post=self, post_votes__value=Vote.UPVOTE)
+
+    @property
+    def downvotes(self):
+        """Users who downvoted the post (read-only, votes live in Vote)"""
+        return User.objects.filter(post_votes__post=self, post_votes__value=Vote.DOWNVOTE)
+
     def user_vote(self, user):
-        if self.upvotes.filter(id=user.id).exists():
-            return 1
-        elif self.downvotes.filter(id=user.id).exists():
-            return -1
-        return 0
+        if not user.is_authenticated:
+            return 0
+        value = self.votes.filter(user=user).values_list('value', flat=True).first()
+        return value or 0
+
+
+class Vote(models.Model):
+    UPVOTE = 1
+    DOWNVOTE = -1
+    VALUE_CHOICES = [
+        (UPVOTE, 'Upvote'),
+        (DOWNVOTE, 'Downvote'),
+    ]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='votes')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='post_votes')
+    value = models.SmallIntegerField(choices=VALUE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'user'], name='unique_post_vote'),
+        ]
+        indexes = [
+            # A viewer's votes on a feed page: user_id = ? AND post_id IN (...)
+            models.Index(fields=['user', 'post'], name='vote_user_post_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_value_display()} on {self.post_id} by {self.user_id}"
 
 class Share(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='shares')
@@ -92,15 +171,70 @@ class Share(models.Model):
         return f"Share of {self.post.title} by {self.user.username}"
 
 
+MEDIA_FILE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'mp4', 'mov', 'avi']
+DERIVATIVE_MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+@lru_cache(maxsize=4096)
+def _storage_url(storage, name):
+    url = storage.url(name) or ''
+    # Ensure HTTPS for Cloudinary URLs
+    if 'res.cloudinary.com' in url and url.startswith('http://'):
+        url = 'https://' + url[len('http://'):]
+    return url
+
+
+def media_url(storage, name):
+    """Delivery URL of a stored file, asked of the storage once per name (bounded LRU).
+
+    Stored names do not change content in place (posts.blobs names them
+    by hash, uploads get fresh names), so the name is the whole cache key.
+    """
+    if not name:
+        return ''
+    try:
+        return _storage_url(storage, name)
+    except Exception as e:
+        logger.error(f"No delivery URL for media {name}: {e}")
+        return ''
+
+
+class MediaBlob(models.Model):
+    """One stored file, shared by every PostMedia with the same bytes (see posts.blobs).
+
+    ``ref_count`` counts those rows; the file is deleted with the last one.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    # dHash of images for near-duplicate lookups, '' for other files
+    perceptual_hash = models.CharField(max_length=16, blank=True, db_index=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+
 class PostMedia(models.Model):
+    # Uploads are staged locally and pushed to storage in the background (see posts.media_pipeline)
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='media_files')
     
     # ЕДИНОЕ поле для всех медиа файлов
     media_file = models.FileField(
         upload_to='post_media/%Y/%m/%d/',
-        validators=[FileExtensionValidator(
-            allowed_extensions=['jpg', 'jpeg', 'png', 'gif', 'mp4', 'mov', 'avi']
-        )],
+        validators=[FileExtensionValidator(allowed_extensions=MEDIA_FILE_EXTENSIONS)],
         storage=SmartCloudinaryStorage(),
         null=True,  
         blank=True
@@ -111,44 +245,132 @@ class PostMedia(models.Model):
         choices=Post.MEDIA_TYPE_CHOICES,
         default='none'
     )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_READY)
+    # Name in the staging storage while the upload waits for a worker
+    staged_name = models.CharField(max_length=255, blank=True)
+    # SHA-256 of the staged bytes, taken while they arrived (posts.blobs); '' if unknown
+    staged_sha256 = models.CharField(max_length=64, blank=True)
+    original_name = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    # Set for files stored through the media pipeline; media_file then holds blob.name
+    blob = models.ForeignKey(MediaBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='media')
+    # media_file's URL, computed on save so pages never ask the storage SDK
+    delivery_url = models.CharField(max_length=500, blank=True)
+    # Resized copies for srcset, written by posts.derivatives
+    derivatives = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Media of a page of posts, prefetched in upload order
+            models.Index(fields=['post', 'created_at', 'id'], name='postmedia_post_idx'),
+            # Uploads still waiting for a worker; ready rows stay out of the index
+            models.Index(
+                fields=['status', 'created_at'],
+                name='postmedia_unfinished_idx',
+                condition=~models.Q(status='ready'),
+            ),
+        ]
     
     def save(self, *args, **kwargs):
         # Автоматически определяем тип медиа при сохранении
-        if self.media_file:
-            file_extension = self.media_file.name.lower().split('.')[-1]
+        name = self.media_file.name if self.media_file else ''
+        if '.' not in os.path.basename(name):
+            # Provider names (Cloudinary public ids) carry no extension
+            name = self.original_name or name
+        if name:
+            file_extension = name.lower().split('.')[-1]
             if file_extension in ['jpg', 'jpeg', 'png', 'gif']:
                 self.media_type = 'image'
             elif file_extension in ['mp4', 'mov', 'avi']:
                 self.media_type = 'video'
             else:
                 self.media_type = 'none'
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'media_file' in update_fields:
+            self.refresh_delivery_url()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'delivery_url'}
         
         super().save(*args, **kwargs)
+
+    def refresh_delivery_url(self):
+        self.delivery_url = media_url(self.media_file.storage, self.media_file.name) if self.media_file else ''
     
     def __str__(self):
         return f"Media for {self.post.title}"
+
+    @property
+    def is_processing(self):
+        return self.status in (self.STATUS_PENDING, self.STATUS_PROCESSING)
+
+    def derivative_names(self):
+        return [entry[1] for entries in self.derivatives.get('variants', {}).values() for entry in entries]
+
+    def _variant_url(self, entry):
+        # Entries are [width, name, url]; older ones have no url yet
+        return entry[2] if len(entry) > 2 else media_url(self.media_file.storage, entry[1])
+
+    def _srcset(self, fmt):
+        entries = self.derivatives.get('variants', {}).get(fmt, [])
+        return ', '.join(f'{self._variant_url(entry)} {entry[0]}w' for entry in entries)
+
+    @property
+    def picture_sources(self):
+        """``<source>`` entries of the modern formats, as ``{'type', 'srcset'}`` dicts"""
+        return [
+            {'type': DERIVATIVE_MIME_TYPES[fmt], 'srcset': self._srcset(fmt)}
+            for fmt in self.derivatives.get('variants', {})
+            if fmt != 'jpeg'
+        ]
+
+    @property
+    def fallback_srcset(self):
+        return self._srcset('jpeg')
+
+    @property
+    def fallback_src(self):
+        """A JPEG copy about card-sized for browsers without srcset; '' before there are copies"""
+        entries = self.derivatives.get('variants', {}).get('jpeg')
+        if not entries:
+            return ''
+        return self._variant_url(min(entries, key=lambda entry: abs(entry[0] - 640)))
     
     def get_cloudinary_url(self):
-        """Returns correct URL for media file"""
-        try:
-            if not self.media_file:
-                return ""
-                
-            if not hasattr(self.media_file, 'url'):
-                return ""
-                
-            url = self.media_file.url
-            
-            if url is None:
-                return ""
-            
-            # Ensure HTTPS for Cloudinary URLs
-            if 'res.cloudinary.com' in url and url.startswith('http://'):
-                url = url.replace('http://', 'https://')
-                
-            return url
-            
-        except Exception as e:
-            print(f"❌ Error in get_cloudinary_url: {e}")
-            return ""
\ No newline at end of file
+        """Returns the delivery URL of the media file, '' when there is none"""
+        if self.delivery_url:
+            return self.delivery_url
+        # Rows saved before URLs were stored
+        if not self.media_file:
+            return ''
+        return media_url(self.media_file.storage, self.media_file.name)
+
+
+class UploadSession(models.Model):
+    """A resumable upload of one large media file, assembled in staging chunk by chunk.
+
+    ``offset`` counts the bytes already on disk, so a client whose
+    connection dropped asks for it and resumes from there (see posts.uploads).
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    length = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    staged_name = models.CharField(max_length=255)
+    # SHA-256 of the whole file, when one process hashed every chunk as it arrived
+    sha256 = models.CharField(max_length=64, blank=True)
+    media = models.OneToOneField(
+        PostMedia, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_session'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.offset}/{self.length})"
+
+    @property
+    def is_complete(self):
+        return self.offset == self.length
@@ -0,0 +1,170 @@
+"""Feed ranking: precomputed, indexed rank keys for the post list sorts.
+
+Every sort is served from a stored column with its own index, so a feed
+page is an index range scan instead of a computation over the whole table.
+
+* ``hot`` and ``controversial`` depend only on votes (``hot`` folds the post
+  age into the key the way Reddit does), so they are refreshed on vote.
+* ``rising`` decays with age and is refreshed on a schedule by the
+  ``refresh_rankings`` management command.
+* ``top`` reads the stored ``score`` over a ``created_at`` window.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from math import log10
+
+from django.db.models import F
+from django.utils import timezone
+
+# Reddit's epoch; only differences between posts matter for ordering
+HOT_EPOCH = datetime(2005, 12, 8, 7, 46, 43, tzinfo=dt_timezone.utc)
+# Seconds of age worth one order of magnitude of score (12.5 hours)
+HOT_DECAY_SECONDS = 45000
+
+# Posts older than this drop out of the rising sort
+RISING_WINDOW = timedelta(hours=24)
+RISING_GRAVITY = 1.5
+
+SORT_NEW = 'new'
+SORT_HOT = 'hot'
+SORT_TOP = 'top'
+SORT_RISING = 'rising'
+SORT_CONTROVERSIAL = 'controversial'
+
+SORT_CHOICES = [
+    (SORT_HOT, 'Hot'),
+    (SORT_NEW, 'New'),
+    (SORT_TOP, 'Top'),
+    (SORT_RISING, 'Rising'),
+    (SORT_CONTROVERSIAL, 'Controversial'),
+]
+
+TOP_PERIODS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'all': None,
+}
+# Windows small enough to sort in memory after a created_at range scan
+SHORT_TOP_PERIODS = {'hour', 'day'}
+
+# Column order for every sort; the trailing id keeps pages stable on ties
+SORT_ORDERING = {
+    SORT_NEW: ['-created_at', '-id'],
+    SORT_HOT: ['-hot_rank', '-id'],
+    SORT_TOP: ['-score', '-id'],
+    SORT_RISING: ['-rising_rank', '-id'],
+    SORT_CONTROVERSIAL: ['-controversy_rank', '-id'],
+}
+
+
+def hot_rank(score, created_at):
+    """Reddit's hot formula: log10 of the score plus a linear age bonus"""
+    order = log10(max(abs(score), 1))
+    sign = 1 if score > 0 else -1 if score < 0 else 0
+    seconds = (created_at - HOT_EPOCH).total_seconds()
+    return round(sign * order + seconds / HOT_DECAY_SECONDS, 7)
+
+
+def controversy_rank(upvotes, downvotes):
+    """High when a post has many votes split close to evenly"""
+    if upvotes <= 0 or downvotes <= 0:
+        return 0.0
+    magnitude = upvotes + downvotes
+    balance = downvotes / upvotes if upvotes > downvotes else upvotes / downvotes
+    return magnitude ** balance
+
+
+def rising_rank(score, created_at, now=None):
+    """Score velocity for young posts; zero once outside the rising window"""
+    now = now or timezone.now()
+    age = now - created_at
+    if score <= 0 or age > RISING_WINDOW:
+        return 0.0
+    age_hours = max(age.total_seconds(), 0) / 3600
+    return score / (age_hours + 2) ** RISING_GRAVITY
+
+
+def compute_ranks(post, now=None):
+    """Returns the rank columns for a post from its stored vote counters"""
+    created_at = post.created_at or timezone.now()
+    return {
+        'hot_rank': hot_rank(post.score, created_at),
+        'controversy_rank': controversy_rank(post.upvote_count, post.downvote_count),
+        'rising_rank': rising_rank(post.score, created_at, now),
+    }
+
+
+def refresh_post_rank(post):
+    """Recomputes and stores the rank columns of a single post"""
+    from .models import Post
+
+    ranks = compute_ranks(post)
+    for field, value in ranks.items():
+        setattr(post, field, value)
+    Post.objects.filter(pk=post.pk).update(**ranks)
+
+
+def refresh_ranks(queryset, now=None, batch_size=1000):
+    """Recomputes the rank columns for every post in ``queryset``; returns the count"""
+    from .models import Post
+
+    now = now or timezone.now()
+    updated = 0
+    batch = []
+    fields = ['upvote_count', 'downvote_count', 'score', 'created_at']
+    for post in queryset.only('pk', *fields).iterator(chunk_size=batch_size):
+        for field, value in compute_ranks(post, now).items():
+            setattr(post, field, value)
+        batch.append(post)
+        if len(batch) >= batch_size:
+            Post.objects.bulk_update(batch, ['hot_rank', 'controversy_rank', 'rising_rank'])
+            updated += len(batch)
+            batch = []
+    if batch:
+        Post.objects.bulk_update(batch, ['hot_rank', 'controversy_rank', 'rising_rank'])
+        updated += len(batch)
+    return updated
+
+
+def refresh_rising(now=None):
+    """Periodic job: re-decays young posts and retires those that aged out"""
+    from .models import Post
+
+    now = now or timezone.now()
+    cutoff = now - RISING_WINDOW
+    expired = Post.objects.filter(rising_rank__gt=0, created_at__lt=cutoff).update(rising_rank=0)
+    refreshed = refresh_ranks(Post.objects.filter(created_at__gte=cutoff), now)
+    return refreshed, expired
+
+
+def normalize_sort(sort, period=None):
+    """Maps raw query string values onto a supported (sort, period) pair"""
+    if sort not in SORT_ORDERING:
+        sort = SORT_NEW
+    if sort == SORT_TOP:
+        period = period if period in TOP_PERIODS else 'day'
+    else:
+        period = None
+    return sort, period
+
+
+def apply_sort(queryset, sort, period=None, now=None):
+    """Filters and orders a post queryset so each sort is an index range scan"""
+    sort, period = normalize_sort(sort, period)
+    now = now or timezone.now()
+
+    if sort == SORT_TOP and period in SHORT_TOP_PERIODS:
+        # A short window is a small created_at range scan plus an in-memory
+        # sort; ordering on an expression stops the planner from walking the
+        # score index over the whole table looking for recent rows instead.
+        return queryset.filter(created_at__gte=now - TOP_PERIODS[period]).order_by(
+            (F('score') + 0).desc(), '-id'
+        )
+    elif sort == SORT_TOP and TOP_PERIODS[period] is not None:
+        queryset = queryset.filter(created_at__gte=now - TOP_PERIODS[period])
+    elif sort == SORT_RISING:
+        queryset = queryset.filter(rising_rank__gt=0, created_at__gte=now - RISING_WINDOW)
+    elif sort == SORT_CONTROVERSIAL:
+        queryset = queryset.filter(controversy_rank__gt=0)
+
+    return queryset.order_by(*SORT_ORDERING[sort])
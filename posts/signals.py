@@ -0,0 +1,47 @@
+"""Keeping cached post cards and feed pages in step with the rows they render,
+and stored media files in step with the rows that reference them."""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.db import transaction
+from django.utils import timezone
+
+from reddit_clone.page_cache import invalidate_post_pages
+from . import blobs
+from .models import Post, PostMedia
+
+
+@receiver(post_save, sender=PostMedia)
+@receiver(post_delete, sender=PostMedia)
+def touch_post_on_media_change(sender, instance, **kwargs):
+    # The media carousel is part of the cached card, so moving updated_at
+    # moves Post.card_version and the next render misses the cache
+    Post.objects.filter(pk=instance.post_id).update(updated_at=timezone.now())
+    community_id = Post.objects.filter(pk=instance.post_id).values_list('community_id', flat=True).first()
+    invalidate_post_pages(community_id)
+
+
+@receiver(post_save, sender=Post)
+def invalidate_pages_on_post_save(sender, instance, **kwargs):
+    # communities.signals stores the community a moved post came from; this
+    # app is ready() first, so the value is still there when this runs
+    invalidate_post_pages(instance.community_id, instance.__dict__.get('_previous_community_id'))
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_pages_on_post_delete(sender, instance, **kwargs):
+    invalidate_post_pages(instance.community_id)
+
+
+@receiver(post_delete, sender=PostMedia)
+def release_blob_on_media_delete(sender, instance, **kwargs):
+    if not instance.blob_id or not blobs.release(instance.blob_id):
+        return
+    # The file is gone, and with it the srcset copies made from it
+    storage = instance.media_file.storage
+    names = instance.derivative_names()
+
+    def delete_copies():
+        for name in names:
+            storage.delete(name)
+
+    transaction.on_commit(delete_copies)
@@ -0,0 +1,38 @@
+// Polls the upload state of media still processing in the background
+// and reloads the page once every upload of the post has finished.
+document.addEventListener('DOMContentLoaded', function() {
+    const POLL_INTERVAL = 3000;
+    const MAX_POLLS = 100;
+
+    const urls = new Set(
+        Array.from(document.querySelectorAll('[data-media-status-url]'))
+            .map(element => element.dataset.mediaStatusUrl)
+    );
+    if (!urls.size) {
+        return;
+    }
+
+    let polls = 0;
+
+    function poll() {
+        polls += 1;
+        Promise.all(Array.from(urls).map(url =>
+            fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+                .then(response => response.ok ? response.json() : { processing: true })
+                .then(data => {
+                    if (!data.processing) {
+                        urls.delete(url);
+                    }
+                })
+                .catch(() => {})
+        )).then(() => {
+            if (!urls.size) {
+                window.location.reload();
+            } else if (polls < MAX_POLLS) {
+                setTimeout(poll, POLL_INTERVAL);
+            }
+        });
+    }
+
+    setTimeout(poll, POLL_INTERVAL);
+});
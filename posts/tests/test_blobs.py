@@ -0,0 +1,117 @@
+import hashlib
+import os
+from io import BytesIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
+
+from posts import blobs, media_pipeline
+from posts.models import MediaBlob, Post, PostMedia
+from posts.tests.test_media_pipeline import MediaPipelineMixin
+
+
+def image_bytes(size=(400, 300), fmt='JPEG', quality=90, flip=False):
+    """A picture with structure (a gradient plus a block), so its dHash is meaningful"""
+    image = Image.linear_gradient('L').rotate(90).resize((400, 300)).convert('RGB')
+    image.paste((250, 250, 250), (20, 30, 120, 200))
+    if flip:
+        image = image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    image = image.resize(size)
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_PIPELINE_SYNC=True)
+class MediaBlobTest(MediaPipelineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(title='Meme', content='body', author=self.user)
+
+    def stored_files(self):
+        return sorted(files for _, _, names in os.walk(self.storage_root) for files in names)
+
+    def test_repeat_upload_skips_storage(self):
+        media, _ = media_pipeline.upload_now(self.post, [self.upload('meme.jpg', b'same meme')])
+        other = Post.objects.create(title='Repost', content='body', author=self.user)
+        with mock.patch.object(self.storage, 'save') as save:
+            repost, _ = media_pipeline.upload_now(other, [self.upload('copy.jpg', b'same meme')])
+        save.assert_not_called()
+
+        blob = MediaBlob.objects.get()
+        self.assertEqual((repost[0].blob, media[0].blob), (blob, blob))
+        self.assertEqual(repost[0].media_file.name, blob.name)
+        self.assertEqual((blob.ref_count, blob.size), (2, len(b'same meme')))
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_copies_within_one_request_are_stored_once(self):
+        media, _ = media_pipeline.upload_now(
+            self.post, [self.upload('a.jpg', b'twice'), self.upload('b.jpg', b'twice'), self.upload('c.jpg', b'once')]
+        )
+        self.assertEqual(len(media), 3)
+        self.assertEqual(MediaBlob.objects.get(size=len(b'twice')).ref_count, 2)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_staged_upload_reuses_blob(self):
+        media_pipeline.upload_now(self.post, [self.upload('meme.jpg', b'same meme')])
+        staged = media_pipeline.stage_upload(self.post, self.upload('again.jpg', b'same meme'))
+        with mock.patch.object(self.storage, 'save') as save:
+            self.assertEqual(media_pipeline.process_media(staged.pk), PostMedia.STATUS_READY)
+        save.assert_not_called()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+
+    def test_form_uploads_are_hashed_while_received(self):
+        # Below and above FILE_UPLOAD_MAX_MEMORY_SIZE: both upload handlers hash
+        for content in [b'small meme', os.urandom(3 * 1024 * 1024)]:
+            request = RequestFactory().post('/', {'file': SimpleUploadedFile('clip.mp4', content)})
+            uploaded = request.FILES['file']
+            self.addCleanup(uploaded.close)
+            self.assertEqual(uploaded.content_digest, (hashlib.sha256(content).hexdigest(), len(content)))
+
+            staged = media_pipeline.stage_upload(self.post, uploaded)
+            self.assertEqual(staged.staged_sha256, uploaded.content_digest[0])
+            with mock.patch('posts.blobs.digest', side_effect=AssertionError('hashed twice')):
+                self.assertEqual(media_pipeline.process_media(staged.pk), PostMedia.STATUS_READY)
+            staged.refresh_from_db()
+            self.assertEqual((staged.blob.sha256, staged.blob.size), uploaded.content_digest)
+
+    def test_last_reference_deletes_the_file(self):
+        first, _ = media_pipeline.upload_now(self.post, [self.upload('meme.jpg', b'same meme')])
+        second, _ = media_pipeline.upload_now(self.post, [self.upload('meme.jpg', b'same meme')])
+        first[0].delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        self.assertEqual(len(self.stored_files()), 1)
+
+        # Deleting the post drops its media's references too
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.delete()
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_concurrent_registration_keeps_one_copy(self):
+        sha256, size = blobs.digest(ContentFile(b'raced'))
+        winner = blobs.register(sha256, self.storage.save('winner.jpg', ContentFile(b'raced')), size)
+        loser_name = self.storage.save('loser.jpg', ContentFile(b'raced'))
+
+        blob = blobs.register(sha256, loser_name, size)
+        self.assertEqual((blob.pk, blob.ref_count), (winner.pk, 2))
+        self.assertFalse(self.storage.exists(loser_name))
+
+    def test_perceptual_hash_finds_re_encoded_copies(self):
+        original = blobs.perceptual_hash(ContentFile(image_bytes()), 'a.jpg')
+        smaller = blobs.perceptual_hash(ContentFile(image_bytes(size=(200, 150), quality=40)), 'b.jpg')
+        as_png = blobs.perceptual_hash(ContentFile(image_bytes(fmt='PNG')), 'c.png')
+        different = blobs.perceptual_hash(ContentFile(image_bytes(flip=True)), 'd.jpg')
+        self.assertEqual(len(original), 16)
+        self.assertLessEqual(blobs.hamming_distance(original, smaller), 4)
+        self.assertLessEqual(blobs.hamming_distance(original, as_png), 4)
+        self.assertGreater(blobs.hamming_distance(original, different), 10)
+        self.assertEqual(blobs.perceptual_hash(ContentFile(b'not an image'), 'clip.mp4'), '')
+
+        media, _ = media_pipeline.upload_now(self.post, [self.upload('a.jpg', image_bytes())])
+        self.assertEqual(media[0].blob.perceptual_hash, original)
+        self.assertEqual(blobs.near_duplicates(smaller), [media[0].blob])
+        self.assertEqual(blobs.near_duplicates(different), [])
@@ -0,0 +1,112 @@
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from posts import derivatives, media_pipeline
+from posts.models import Post, PostMedia
+from posts.tests.test_media_pipeline import MediaPipelineMixin
+
+
+def photo(size=(2400, 1600), orientation=None, fmt='JPEG'):
+    """A noisy camera-sized photo (hard to compress), optionally with EXIF"""
+    image = Image.merge('RGB', [Image.effect_noise(size, 60) for _ in range(3)])
+    exif = Image.Exif()
+    exif[0x010F] = 'ExampleCam'  # Make
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, quality=95, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_DERIVATIVE_WIDTHS=[320, 640, 1080], MEDIA_DERIVATIVE_FORMATS=['avif', 'webp', 'jpeg'])
+class DerivativeTest(MediaPipelineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(title='Photo', content='body', author=self.user)
+
+    def ready_image(self, data, name='photo.jpg'):
+        stored = self.storage.save(f'post_media/{name}', ContentFile(data))
+        return PostMedia.objects.create(post=self.post, media_file=stored, original_name=name)
+
+    def open_variant(self, name):
+        with self.storage.open(name) as variant:
+            image = Image.open(BytesIO(variant.read()))
+            image.load()
+            return image
+
+    def test_widths_formats_and_size(self):
+        original = photo()
+        media = self.ready_image(original)
+        self.assertTrue(derivatives.generate(media.pk))
+
+        media.refresh_from_db()
+        self.assertEqual((media.derivatives['width'], media.derivatives['height']), (2400, 1600))
+        variants = media.derivatives['variants']
+        self.assertEqual(list(variants), derivatives.available_formats())
+        for fmt, entries in variants.items():
+            self.assertEqual([width for width, _, _ in entries], [320, 640, 1080])
+            for width, name, url in entries:
+                self.assertEqual(url, self.storage.url(name))
+                image = self.open_variant(name)
+                self.assertEqual(image.size, (width, round(1600 * width / 2400)))
+                self.assertFalse(image.getexif(), f'{name} kept its EXIF')
+
+        # A feed card's copy is a small fraction of the upload
+        card_copy = {width: name for width, name, _ in variants['webp']}[640]
+        self.assertLess(self.storage.size(card_copy) * 10, len(original))
+
+    def test_orientation_applied_and_never_upscaled(self):
+        # Orientation 6: stored landscape, shown portrait
+        media = self.ready_image(photo(size=(1200, 800), orientation=6))
+        derivatives.generate(media.pk)
+        media.refresh_from_db()
+        self.assertEqual((media.derivatives['width'], media.derivatives['height']), (800, 1200))
+        self.assertEqual([entry[0] for entry in media.derivatives['variants']['jpeg']], [320, 640, 800])
+
+    def test_idempotent(self):
+        media = self.ready_image(photo(size=(800, 600)))
+        self.assertTrue(derivatives.generate(media.pk))
+        with mock.patch.object(self.storage, 'save') as save:
+            self.assertFalse(derivatives.generate(media.pk))
+            call_command('generate_media_derivatives', stdout=StringIO())
+        save.assert_not_called()
+
+        # --force replaces the copies and removes the old ones
+        media.refresh_from_db()
+        old_names = media.derivative_names()
+        call_command('generate_media_derivatives', '--force', stdout=StringIO())
+        self.assertFalse(any(self.storage.exists(name) for name in old_names))
+
+    def test_animated_gif_is_left_alone(self):
+        frames = [Image.new('RGB', (400, 300), color) for color in ('red', 'blue')]
+        buffer = BytesIO()
+        frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:])
+        media = self.ready_image(buffer.getvalue(), 'anim.gif')
+        self.assertFalse(derivatives.generate(media.pk))
+        media.refresh_from_db()
+        self.assertEqual(media.derivatives, {})
+
+    def test_feed_renders_srcset(self):
+        media = self.ready_image(photo(size=(800, 600)))
+        derivatives.generate(media.pk)
+        response = self.client.get(reverse('post_list'))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, 'sizes="(max-width: 768px) 100vw, 600px"')
+        self.assertContains(response, '_w320.jpeg 320w')
+        self.assertContains(response, 'width="800" height="600"')
+
+    def test_generated_off_the_request_path(self):
+        post = self.post
+        media = media_pipeline.stage_upload(post, self.upload('photo.jpg', photo(size=(640, 480))))
+        with mock.patch.object(media_pipeline, '_get_executor') as executor, \
+                mock.patch.object(derivatives, 'generate') as generate:
+            with self.captureOnCommitCallbacks(execute=True):
+                media_pipeline.process_media(media.pk)
+        generate.assert_not_called()
+        executor.return_value.submit.assert_called_once_with(media_pipeline._run_in_worker, generate, media.pk)
@@ -0,0 +1,188 @@
+import os
+from unittest import mock
+
+import cloudinary
+import cloudinary.utils
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from posts import direct_uploads
+from posts.models import Post, PostMedia
+from posts.tests.test_media_pipeline import MediaPipelineMixin
+
+MP4 = b'\x00\x00\x00\x18ftypmp42video-bytes'
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 15
+
+
+class DirectUploadTest(MediaPipelineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(title='Direct', content='body', author=self.user)
+
+    def ticket(self, filename='clip.mp4', length=len(MP4)):
+        response = self.client.post(
+            reverse('direct_upload_create'),
+            {'post': self.post.pk, 'filename': filename, 'length': length},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()['upload']
+
+    def send(self, upload, content=MP4):
+        return self.client.generic(
+            upload['method'], upload['url'], content, content_type=upload['headers']['Content-Type']
+        )
+
+    def confirm(self, ticket, reply):
+        return self.client.post(
+            reverse('direct_upload_confirm'), {'ticket': ticket, **reply}, content_type='application/json'
+        )
+
+    def test_upload_and_confirm(self):
+        upload = self.ticket()
+        self.assertEqual(upload['method'], 'PUT')
+        receipt = self.send(upload)
+        self.assertEqual(receipt.status_code, 201)
+
+        response = self.confirm(upload['ticket'], receipt.json())
+        self.assertEqual(response.status_code, 201)
+        media = PostMedia.objects.get(post=self.post)
+        self.assertEqual((media.status, media.media_type, media.original_name), ('ready', 'video', 'clip.mp4'))
+        self.assertEqual(media.media_file.name, upload['name'])
+        with media.media_file.open('rb') as stored:
+            self.assertEqual(stored.read(), MP4)
+
+        again = self.confirm(upload['ticket'], receipt.json())
+        self.assertEqual((again.status_code, again.json()['media']['id']), (200, media.pk))
+
+    def test_ticket_and_confirm_never_touch_the_bytes(self):
+        upload = self.ticket()
+        receipt = self.send(upload).json()
+        with mock.patch.object(self.storage, 'save') as save, mock.patch.object(self.storage, 'open') as open_:
+            self.ticket()
+            self.assertEqual(self.confirm(upload['ticket'], receipt).status_code, 201)
+        save.assert_not_called()
+        open_.assert_not_called()
+
+    def test_length_must_match_the_ticket(self):
+        upload = self.ticket(length=5)
+        self.assertEqual(self.send(upload, b'too many bytes').status_code, 400)
+        self.assertEqual([files for _, _, files in os.walk(self.storage_root) if files], [])
+
+    def test_content_must_match_the_ticketed_format(self):
+        upload = self.ticket(length=len(PNG))
+        self.assertEqual(self.send(upload, PNG).status_code, 403)
+        self.assertEqual([files for _, _, files in os.walk(self.storage_root) if files], [])
+
+    def test_forged_tickets_and_receipts_are_rejected(self):
+        upload = self.ticket()
+        receipt = self.send(upload).json()
+
+        self.assertEqual(self.confirm(upload['ticket'] + 'x', receipt).status_code, 403)
+        self.assertEqual(self.confirm(upload['ticket'], {'signature': receipt['name'] + ':forged'}).status_code, 403)
+        # A genuine receipt only confirms the upload it was issued for
+        other = self.ticket()
+        self.assertEqual(self.confirm(other['ticket'], receipt).status_code, 403)
+
+        self.client.force_login(User.objects.create_user(username='thief', password='testpass123'))
+        self.assertEqual(self.confirm(upload['ticket'], receipt).status_code, 403)
+        self.assertFalse(PostMedia.objects.exists())
+
+    def test_expired_ticket(self):
+        upload = self.ticket()
+        with override_settings(MEDIA_DIRECT_UPLOAD_TTL=-1):
+            self.assertEqual(self.send(upload).status_code, 403)
+        self.assertFalse(PostMedia.objects.exists())
+
+    def test_tickets_only_for_own_posts(self):
+        other = User.objects.create_user(username='other', password='testpass123')
+        post = Post.objects.create(title='Not mine', content='body', author=other)
+        response = self.client.post(
+            reverse('direct_upload_create'),
+            {'post': post.pk, 'filename': 'a.jpg', 'length': 10},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class CloudinaryDirectUploadTest(MediaPipelineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(title='Cloud', content='body', author=self.user)
+        config = cloudinary.config()
+        for key, value in {'cloud_name': 'demo', 'api_key': 'key', 'api_secret': 'secret'}.items():
+            patcher = mock.patch.object(config, key, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upload(self, filename, length):
+        return self.client.post(
+            reverse('direct_upload_create'),
+            {'post': self.post.pk, 'filename': filename, 'length': length},
+            content_type='application/json',
+        ).json()['upload']
+
+    def reply(self, public_id, version=1700000000):
+        signed = {'public_id': public_id, 'version': version}
+        return {**signed, 'signature': cloudinary.utils.api_sign_request(signed, 'secret', signature_version=1)}
+
+    def confirm(self, ticket, reply):
+        return self.client.post(
+            reverse('direct_upload_confirm'), {'ticket': ticket, **reply}, content_type='application/json'
+        )
+
+    def test_public_ids_match_the_media_storage(self):
+        from cloudinary_storage.storage import MediaCloudinaryStorage
+
+        # Pins the naming of django-cloudinary-storage, whose helper for it is private
+        def check(prefix):
+            for name in ['post_media/abc.jpg', f'{prefix}post_media/abc.jpg']:
+                with self.subTest(prefix=prefix, name=name):
+                    self.assertEqual(
+                        direct_uploads.CloudinaryBackend()._public_id({'name': name}),
+                        MediaCloudinaryStorage()._prepend_prefix(os.path.splitext(name)[0]),
+                    )
+
+        check('media/')
+        # The storage reloads its settings on the change, so the credentials stay in
+        with override_settings(CLOUDINARY_STORAGE={**settings.CLOUDINARY_STORAGE, 'PREFIX': 'uploads'}):
+            check('uploads/')
+
+    def test_signed_upload_goes_to_the_provider(self):
+        upload = self.upload('photo.jpg', 100)
+        self.assertEqual(upload['url'], 'https://api.cloudinary.com/v1_1/demo/image/upload')
+        fields = upload['fields']
+        signed = {key: fields[key] for key in ('public_id', 'allowed_formats', 'timestamp')}
+        self.assertEqual(signed['allowed_formats'], 'jpg')
+        self.assertEqual(fields['signature'], cloudinary.utils.api_sign_request(signed, 'secret'))
+        # The stand-in endpoint is off while a provider is configured
+        self.assertEqual(self.client.put(reverse('direct_upload_local', args=[upload['ticket']]), b'x').status_code, 404)
+
+        reply = self.reply(fields['public_id'])
+        stored = {'bytes': 100, 'format': 'jpg', 'resource_type': 'image'}
+        with mock.patch('cloudinary.api.resource', return_value=stored) as resource:
+            response = self.confirm(upload['ticket'], reply)
+        self.assertEqual(response.status_code, 201)
+        resource.assert_called_once_with(fields['public_id'], resource_type='image')
+        media = PostMedia.objects.get(post=self.post)
+        self.assertEqual((media.media_file.name, media.media_type), (fields['public_id'], 'image'))
+
+        reply['signature'] = 'forged'
+        self.assertEqual(self.confirm(upload['ticket'], reply).status_code, 403)
+
+    def test_stored_object_must_match_the_ticket(self):
+        upload = self.upload('clip.mp4', 100)
+        public_id = upload['fields']['public_id']
+        for stored in (
+            {'bytes': 5000, 'format': 'mp4', 'resource_type': 'video'},
+            {'bytes': 100, 'format': 'webm', 'resource_type': 'video'},
+            {'bytes': 100, 'format': 'mp4', 'resource_type': 'image'},
+        ):
+            with mock.patch('cloudinary.api.resource', return_value=stored), \
+                    mock.patch('cloudinary.uploader.destroy') as destroy:
+                response = self.confirm(upload['ticket'], self.reply(public_id))
+            self.assertEqual(response.status_code, 403)
+            destroy.assert_called_once_with(public_id, resource_type='video', invalidate=True)
+        self.assertFalse(PostMedia.objects.exists())
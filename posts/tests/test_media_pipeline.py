@@ -0,0 +1,255 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from posts import media_pipeline
+from posts.models import Post, PostMedia
+
+
+class MediaPipelineMixin:
+    """Staging and media storage in temporary directories"""
+
+    def setUp(self):
+        super().setUp()
+        self.staging_root = tempfile.mkdtemp()
+        self.storage_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.staging_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.storage_root, ignore_errors=True)
+
+        settings_override = override_settings(MEDIA_STAGING_ROOT=self.staging_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.storage = FileSystemStorage(location=self.storage_root, base_url='/media/')
+        storage_patch = mock.patch.object(PostMedia._meta.get_field('media_file'), 'storage', self.storage)
+        storage_patch.start()
+        self.addCleanup(storage_patch.stop)
+
+        self.user = User.objects.create_user(username='uploader', password='testpass123')
+        self.client.force_login(self.user)
+
+    def upload(self, name='photo.jpg', content=b'image-bytes'):
+        return SimpleUploadedFile(name, content, content_type='application/octet-stream')
+
+    def staged_files(self):
+        return os.listdir(self.staging_root)
+
+
+@override_settings(MEDIA_PIPELINE_SYNC=False)
+class AsyncMediaPipelineTest(MediaPipelineMixin, TestCase):
+    def test_create_returns_before_upload(self):
+        with mock.patch.object(media_pipeline, '_get_executor') as executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('create_post'), {
+                    'title': 'With media',
+                    'content': 'body',
+                    'media_files': [self.upload('a.jpg'), self.upload('b.mp4')],
+                })
+        self.assertEqual(response.status_code, 302)
+
+        post = Post.objects.get(title='With media')
+        media = list(post.media_files.order_by('pk'))
+        self.assertEqual([item.status for item in media], ['pending', 'pending'])
+        self.assertEqual([item.media_type for item in media], ['image', 'video'])
+        self.assertEqual(len(self.staged_files()), 2)
+        self.assertEqual(executor.return_value.submit.call_count, 2)
+
+        for item in media:
+            self.assertEqual(media_pipeline.process_media(item.pk), PostMedia.STATUS_READY)
+        media = list(post.media_files.order_by('pk'))
+        self.assertEqual([item.status for item in media], ['ready', 'ready'])
+        self.assertTrue(all(item.media_file for item in media))
+        self.assertEqual(self.staged_files(), [])
+
+    def test_nothing_queued_before_commit(self):
+        with mock.patch.object(media_pipeline, '_get_executor') as executor:
+            self.client.post(reverse('create_post'), {
+                'title': 'Uncommitted', 'content': 'body', 'media_files': [self.upload()],
+            })
+        executor.assert_not_called()
+
+    def test_processing_placeholder_and_status_endpoint(self):
+        post = Post.objects.create(title='Pending', content='body', author=self.user)
+        media = media_pipeline.stage_upload(post, self.upload())
+
+        response = self.client.get(reverse('post_detail', args=[post.pk]))
+        self.assertContains(response, 'Processing media')
+        status_url = reverse('post_media_status', args=[post.pk])
+        self.assertContains(response, f'data-media-status-url="{status_url}"')
+
+        data = self.client.get(status_url).json()
+        self.assertTrue(data['processing'])
+        self.assertEqual(data['media'][0]['status'], 'pending')
+        self.assertIsNone(data['media'][0]['url'])
+
+        media_pipeline.process_media(media.pk)
+        data = self.client.get(status_url).json()
+        self.assertFalse(data['processing'])
+        self.assertTrue(data['media'][0]['url'])
+
+    def test_failed_upload_keeps_staged_file(self):
+        post = Post.objects.create(title='Failing', content='body', author=self.user)
+        media = media_pipeline.stage_upload(post, self.upload())
+
+        with mock.patch.object(self.storage, 'save', side_effect=OSError('storage down')), \
+                self.assertLogs('posts.media_pipeline', 'ERROR'):
+            self.assertEqual(media_pipeline.process_media(media.pk), PostMedia.STATUS_FAILED)
+        media.refresh_from_db()
+        self.assertEqual(media.error, 'storage down')
+        self.assertEqual(self.staged_files(), [media.staged_name])
+
+        call_command('process_pending_media', '--failed', stdout=StringIO())
+        media.refresh_from_db()
+        self.assertEqual(media.status, PostMedia.STATUS_READY)
+        self.assertEqual(self.staged_files(), [])
+
+    def test_row_is_processed_once(self):
+        post = Post.objects.create(title='Once', content='body', author=self.user)
+        media = media_pipeline.stage_upload(post, self.upload())
+        self.assertEqual(media_pipeline.process_media(media.pk), PostMedia.STATUS_READY)
+        self.assertIsNone(media_pipeline.process_media(media.pk))
+
+    def test_edit_page_lists_pending_media(self):
+        post = Post.objects.create(title='Editing', content='body', author=self.user)
+        media_pipeline.stage_upload(post, self.upload('clip.mp4'))
+        response = self.client.get(reverse('post_edit', args=[post.pk]))
+        self.assertContains(response, 'Pending')
+        self.assertContains(response, 'clip.mp4')
+
+
+@override_settings(MEDIA_PIPELINE_SYNC=True)
+class SyncMediaPipelineTest(MediaPipelineMixin, TestCase):
+    def test_uploads_inline(self):
+        self.client.post(reverse('create_post'), {
+            'title': 'Inline', 'content': 'body', 'media_files': [self.upload()],
+        })
+        media = PostMedia.objects.get(post__title='Inline')
+        self.assertEqual(media.status, PostMedia.STATUS_READY)
+        self.assertTrue(self.storage.exists(media.media_file.name))
+
+
+@override_settings(MEDIA_PIPELINE_SYNC=False, MEDIA_UPLOAD_WORKERS=2)
+class MediaWorkerPoolTest(MediaPipelineMixin, TransactionTestCase):
+    def test_worker_threads_finish_uploads(self):
+        post = Post.objects.create(title='Threads', content='body', author=self.user)
+        media = [media_pipeline.stage_upload(post, self.upload(f'{i}.jpg', f'image-{i}'.encode())) for i in range(4)]
+
+        process = media_pipeline.process_media
+        if not connection.features.test_db_allows_multiple_connections:
+            # In-memory SQLite locks whole tables between threads and never waits
+            lock = threading.Lock()
+
+            def process(media_id, process=process):
+                with lock:
+                    return process(media_id)
+
+        # Derivatives are not what this is about, and would be queued after shutdown
+        with mock.patch.object(media_pipeline, 'queue_derivatives'), \
+                mock.patch.object(media_pipeline, 'process_media', process):
+            media_pipeline.submit(media)
+            # Waiting for the pool the way worker shutdown does
+            media_pipeline._finish_on_exit()
+        media_pipeline._executor = None
+
+        statuses = set(PostMedia.objects.filter(post=post).values_list('status', flat=True))
+        self.assertEqual(statuses, {PostMedia.STATUS_READY})
+
+
+@override_settings(MEDIA_PIPELINE_SYNC=True, MEDIA_UPLOAD_WORKERS=4)
+class ParallelUploadTest(MediaPipelineMixin, TestCase):
+    DELAY = 0.2
+
+    def slow_storage(self, fail=()):
+        """Wraps storage.save with a delay, tracking how many uploads overlap"""
+        state = {'active': 0, 'peak': 0}
+        lock = threading.Lock()
+        save = self.storage.save
+
+        def slow_save(name, content, max_length=None):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            try:
+                time.sleep(self.DELAY)
+                if os.path.basename(content.name) in fail:
+                    raise OSError('upload rejected')
+                return save(name, content, max_length=max_length)
+            finally:
+                with lock:
+                    state['active'] -= 1
+
+        patcher = mock.patch.object(self.storage, 'save', side_effect=slow_save)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return state
+
+    def post_files(self, count):
+        post = Post.objects.create(title='Many files', content='body', author=self.user)
+        # Distinct bytes: identical files would be stored once (posts.blobs)
+        return post, [self.upload(f'{i}.jpg', f'image-{i}'.encode()) for i in range(count)]
+
+    def test_latency_tracks_the_slowest_file(self):
+        state = self.slow_storage()
+        post, files = self.post_files(4)
+
+        started = time.monotonic()
+        media, errors = media_pipeline.upload_now(post, files)
+        elapsed = time.monotonic() - started
+
+        self.assertEqual((len(media), errors), (4, []))
+        self.assertEqual(state['peak'], 4)
+        self.assertLess(elapsed, self.DELAY * 2.5)
+
+    @override_settings(MEDIA_UPLOAD_WORKERS=2)
+    def test_concurrency_is_bounded(self):
+        state = self.slow_storage()
+        post, files = self.post_files(5)
+        media, _ = media_pipeline.upload_now(post, files)
+        self.assertEqual(len(media), 5)
+        self.assertEqual(state['peak'], 2)
+
+    def test_failures_are_reported_per_file(self):
+        self.slow_storage(fail={'1.jpg'})
+        with self.assertLogs('posts.media_pipeline', 'ERROR'):
+            response = self.client.post(reverse('create_post'), {
+                'title': 'Partly failing',
+                'content': 'body',
+                'media_files': [self.upload(f'{i}.jpg', f'image-{i}'.encode()) for i in range(3)],
+            })
+        post = Post.objects.get(title='Partly failing')
+        self.assertEqual(
+            sorted(post.media_files.values_list('original_name', flat=True)), ['0.jpg', '2.jpg']
+        )
+        warnings = [str(m) for m in get_messages(response.wsgi_request) if m.level_tag == 'warning']
+        self.assertEqual(warnings, ['Could not upload 1.jpg: upload rejected'])
+
+    def test_rows_commit_together(self):
+        post, files = self.post_files(3)
+        create = PostMedia.objects.create
+        calls = []
+
+        def flaky_create(**kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('database went away')
+            return create(**kwargs)
+
+        with mock.patch.object(PostMedia.objects, 'create', side_effect=flaky_create):
+            with self.assertRaises(RuntimeError):
+                media_pipeline.upload_now(post, files)
+        self.assertFalse(PostMedia.objects.filter(post=post).exists())
+        # Nothing is left behind in the storage either
+        self.assertEqual([files for _, _, files in os.walk(self.storage_root) if files], [])
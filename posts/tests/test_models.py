@@ -1,7 +1,18 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
+from PIL import Image
+from posts import derivatives
 from posts.models import Post
-from posts.models import PostMedia
+from posts.models import PostMedia, Vote, _storage_url
+from posts.tests.test_media_pipeline import MediaPipelineMixin
+from posts.ranking import controversy_rank, hot_rank
 from comments.models import Comment
 
 class PostModelTest(TestCase):
@@ -55,4 +66,120 @@ class CommentModelTest(TestCase):
         
         comment._current_user = user2
         self.assertFalse(comment.can_edit)
-        self.assertFalse(comment.can_delete)
\ No newline at end of file
+        self.assertFalse(comment.can_delete)
+
+class RebuildVoteCountsCommandTest(TestCase):
+    def test_rebuild_repairs_drift(self):
+        user1 = User.objects.create_user(username='user1', password='pass')
+        user2 = User.objects.create_user(username='user2', password='pass')
+        post = Post.objects.create(title='Test', content='Test', author=user1)
+        Vote.objects.create(post=post, user=user1, value=Vote.UPVOTE)
+        Vote.objects.create(post=post, user=user2, value=Vote.UPVOTE)
+        user3 = User.objects.create_user(username='user3', password='pass')
+        Vote.objects.create(post=post, user=user3, value=Vote.DOWNVOTE)
+
+        # Counters were not maintained by the direct Vote writes above
+        post.refresh_from_db()
+        self.assertEqual(post.total_votes(), 0)
+
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.upvote_count, 2)
+        self.assertEqual(post.downvote_count, 1)
+        self.assertEqual(post.total_votes(), 1)
+        self.assertEqual(post.hot_rank, hot_rank(1, post.created_at))
+        self.assertEqual(post.controversy_rank, controversy_rank(2, 1))
+
+
+class RankingTest(TestCase):
+    def test_hot_rank_prefers_newer_posts_at_equal_score(self):
+        now = timezone.now()
+        self.assertGreater(hot_rank(10, now), hot_rank(10, now - timedelta(hours=1)))
+        self.assertGreater(hot_rank(100, now), hot_rank(10, now))
+
+    def test_controversy_rank(self):
+        self.assertEqual(controversy_rank(10, 0), 0)
+        self.assertGreater(controversy_rank(10, 10), controversy_rank(10, 2))
+
+    def test_refresh_rankings_command_retires_old_rising_posts(self):
+        user = User.objects.create_user(username='user1', password='pass')
+        post = Post.objects.create(title='Old', content='c', author=user)
+        Post.objects.filter(pk=post.pk).update(
+            rising_rank=5, created_at=timezone.now() - timedelta(days=2)
+        )
+        call_command('refresh_rankings', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.rising_rank, 0)
+
+
+class MediaDeliveryUrlTest(MediaPipelineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        _storage_url.cache_clear()
+        self.post = Post.objects.create(title='Gallery', content='body', author=self.user)
+
+    def image(self, name='photo.jpg'):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'teal').save(buffer, format='JPEG')
+        stored = self.storage.save(f'post_media/{name}', ContentFile(buffer.getvalue()))
+        return PostMedia.objects.create(post=self.post, media_file=stored, original_name=name)
+
+    def test_url_is_stored_on_save(self):
+        media = self.image()
+        self.assertEqual(media.delivery_url, self.storage.url(media.media_file.name))
+        media.refresh_from_db()
+        with mock.patch.object(self.storage, 'url') as url:
+            self.assertEqual(media.get_cloudinary_url(), media.delivery_url)
+        url.assert_not_called()
+
+    def test_gallery_renders_without_storage_calls(self):
+        media = self.image()
+        with override_settings(MEDIA_DERIVATIVE_FORMATS=['webp', 'jpeg']):
+            derivatives.generate(media.pk)
+        _storage_url.cache_clear()
+        with mock.patch.object(self.storage, 'url', side_effect=AssertionError('storage asked for a URL')):
+            response = self.client.get(reverse('post_list'))
+        self.assertContains(response, '<img src="/media/post_media/derivatives/photo_w640.jpeg"')
+        self.assertContains(response, '_w320.webp 320w')
+
+    def test_older_rows_use_the_lru(self):
+        media = self.image()
+        PostMedia.objects.filter(pk=media.pk).update(delivery_url='')
+        _storage_url.cache_clear()
+        with mock.patch.object(self.storage, 'url', wraps=self.storage.url) as url:
+            for _ in range(2):
+                row = PostMedia.objects.get(pk=media.pk)
+                self.assertEqual(row.get_cloudinary_url(), f'/media/{media.media_file.name}')
+        self.assertEqual(url.call_count, 1)
+
+    def test_storage_errors_give_an_empty_url(self):
+        media = self.image()
+        PostMedia.objects.filter(pk=media.pk).update(delivery_url='')
+        media.refresh_from_db()
+        _storage_url.cache_clear()
+        with mock.patch.object(self.storage, 'url', side_effect=ValueError('bad config')), \
+                self.assertLogs('posts.models', 'ERROR'):
+            self.assertEqual(media.get_cloudinary_url(), '')
+        self.assertEqual(PostMedia(post=self.post).get_cloudinary_url(), '')
+
+    def test_refresh_command_follows_a_new_base_url(self):
+        media = self.image()
+        with override_settings(MEDIA_DERIVATIVE_FORMATS=['jpeg']):
+            derivatives.generate(media.pk)
+        self.storage.base_url = 'https://cdn.example.com/'
+        call_command('refresh_media_urls', stdout=StringIO())
+
+        media.refresh_from_db()
+        self.assertTrue(media.delivery_url.startswith('https://cdn.example.com/post_media/'))
+        self.assertTrue(all(entry[2].startswith('https://cdn.example.com/') for entry in media.derivatives['variants']['jpeg']))
+
+    def test_refresh_command_writes_in_batches(self):
+        media = [self.image(f'photo{i}.jpg') for i in range(5)]
+        self.storage.base_url = 'https://cdn.example.com/'
+        bulk_update = PostMedia.objects.bulk_update
+        with mock.patch('posts.management.commands.refresh_media_urls.BATCH_SIZE', 2), \
+                mock.patch.object(PostMedia.objects, 'bulk_update', side_effect=bulk_update) as batches:
+            call_command('refresh_media_urls', stdout=StringIO())
+        self.assertEqual([len(call.args[0]) for call in batches.call_args_list], [2, 2, 1])
+        urls = PostMedia.objects.filter(pk__in=[item.pk for item in media]).values_list('delivery_url', flat=True)
+        self.assertTrue(all(url.startswith('https://cdn.example.com/') for url in urls))
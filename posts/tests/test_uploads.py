@@ -0,0 +1,211 @@
+import hashlib
+import os
+import tracemalloc
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from posts import uploads
+from posts.models import MediaBlob, Post, PostMedia, UploadSession
+from posts.tests.test_media_pipeline import MediaPipelineMixin
+
+
+class ZeroStream:
+    """wsgi.input that produces ``size`` zero bytes without ever holding them"""
+
+    def __init__(self, size, disconnect=False):
+        self.remaining = size
+        self.disconnect = disconnect
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.remaining
+        size = min(size, self.remaining)
+        if not size and self.disconnect:
+            raise ConnectionResetError('client went away')
+        self.remaining -= size
+        return bytes(size)
+
+    readline = read
+
+
+@override_settings(MEDIA_PIPELINE_SYNC=True, MEDIA_UPLOAD_MAX_SIZE=10 * 1024 ** 3)
+class ResumableUploadTest(MediaPipelineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(title='Big video', content='body', author=self.user)
+
+    def start(self, length, filename='clip.mp4'):
+        response = self.client.post(
+            reverse('upload_create'),
+            {'post': self.post.pk, 'filename': filename, 'length': length},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        return UploadSession.objects.get(pk=response.json()['id']), response['Location']
+
+    def patch(self, url, offset, data):
+        return self.client.generic(
+            'PATCH', url, data, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_chunks_resume_and_finalize(self):
+        content = os.urandom(3000)
+        session, url = self.start(len(content))
+
+        self.assertEqual(self.patch(url, 0, content[:1000]).status_code, 204)
+        # A reconnecting client asks where to carry on
+        response = self.client.head(url)
+        self.assertEqual(response['Upload-Offset'], '1000')
+        self.assertEqual(response['Upload-Length'], '3000')
+
+        response = self.patch(url, 1000, content[1000:])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '3000')
+
+        response = self.client.post(reverse('upload_finalize', args=[session.pk]))
+        self.assertEqual(response.json()['media']['status'], PostMedia.STATUS_READY)
+        media = PostMedia.objects.get(post=self.post)
+        self.assertEqual((media.original_name, media.media_type), ('clip.mp4', 'video'))
+        with media.media_file.open('rb') as stored:
+            self.assertEqual(stored.read(), content)
+        # The staged copy is gone once it is in the media storage
+        self.assertEqual([files for _, _, files in os.walk(self.staging_root) if files], [])
+
+        # Finalizing twice returns the same row
+        again = self.client.post(reverse('upload_finalize', args=[session.pk]))
+        self.assertEqual(again.json()['media']['id'], media.pk)
+
+    def test_chunks_are_hashed_as_they_arrive(self):
+        content = os.urandom(3000)
+        session, url = self.start(len(content))
+        self.patch(url, 0, content[:1000])
+        self.patch(url, 1000, content[1000:])
+        session.refresh_from_db()
+        self.assertEqual(session.sha256, hashlib.sha256(content).hexdigest())
+
+        # The stored file is not read again to hash it
+        with mock.patch('posts.blobs.digest', side_effect=AssertionError('hashed twice')):
+            response = self.client.post(reverse('upload_finalize', args=[session.pk]))
+        self.assertEqual(response.json()['media']['status'], PostMedia.STATUS_READY)
+        self.assertEqual(MediaBlob.objects.get().sha256, session.sha256)
+
+    def test_chunk_on_another_process_falls_back_to_hashing_on_store(self):
+        content = os.urandom(3000)
+        session, url = self.start(len(content))
+        self.patch(url, 0, content[:1000])
+        # As if the next chunk reached a worker that did not see the first one
+        uploads._running_hashes.clear()
+        self.patch(url, 1000, content[1000:])
+        session.refresh_from_db()
+        self.assertEqual(session.sha256, '')
+
+        response = self.client.post(reverse('upload_finalize', args=[session.pk]))
+        self.assertEqual(response.json()['media']['status'], PostMedia.STATUS_READY)
+        self.assertEqual(MediaBlob.objects.get().sha256, hashlib.sha256(content).hexdigest())
+
+    def test_offset_mismatch_is_rejected(self):
+        session, url = self.start(100)
+        self.patch(url, 0, b'x' * 40)
+        response = self.patch(url, 10, b'x' * 10)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '40')
+
+    def test_chunk_past_length_is_rejected(self):
+        session, url = self.start(10)
+        self.assertEqual(self.patch(url, 0, b'x' * 11).status_code, 413)
+        session.refresh_from_db()
+        self.assertEqual(session.offset, 0)
+
+    def test_dropped_connection_keeps_received_bytes(self):
+        session, url = self.start(10)
+        request = self.chunk_request(session, 10, ZeroStream(4, disconnect=True))
+        response = uploads.upload_session(request, session.pk)
+        self.assertEqual(response.status_code, 400)
+        session.refresh_from_db()
+        self.assertEqual(session.offset, 4)
+
+    def test_incomplete_upload_cannot_be_finalized(self):
+        session, url = self.start(100)
+        self.patch(url, 0, b'x' * 50)
+        response = self.client.post(reverse('upload_finalize', args=[session.pk]))
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(PostMedia.objects.filter(post=self.post).exists())
+
+    def test_validation(self):
+        create = reverse('upload_create')
+        data = {'post': self.post.pk, 'filename': 'notes.txt', 'length': 10}
+        self.assertEqual(self.client.post(create, data, content_type='application/json').status_code, 400)
+        data.update(filename='clip.mp4', length=11 * 1024 ** 3)
+        self.assertEqual(self.client.post(create, data, content_type='application/json').status_code, 413)
+
+        other = Post.objects.create(title='Not mine', content='body', author=self.make_user('other'))
+        data.update(post=other.pk, length=10)
+        self.assertEqual(self.client.post(create, data, content_type='application/json').status_code, 404)
+
+    def test_sessions_are_private(self):
+        session, url = self.start(10)
+        self.client.force_login(self.make_user('snoop'))
+        self.assertEqual(self.client.head(url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_delete_removes_staged_file(self):
+        session, url = self.start(10)
+        self.patch(url, 0, b'x' * 5)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual([files for _, _, files in os.walk(self.staging_root) if files], [])
+
+    def test_expired_sessions_are_cleaned_up(self):
+        self.start(10)
+        UploadSession.objects.update(updated_at=self.post.created_at.replace(year=2000))
+        call_command('expire_upload_sessions', stdout=StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual([files for _, _, files in os.walk(self.staging_root) if files], [])
+
+    def make_user(self, username):
+        return User.objects.create_user(username=username, password='testpass123')
+
+    def chunk_request(self, session, length, stream, offset=0):
+        environ = RequestFactory()._base_environ(
+            PATH_INFO=reverse('upload_session', args=[session.pk]),
+            REQUEST_METHOD='PATCH',
+            CONTENT_TYPE='application/offset+octet-stream',
+            CONTENT_LENGTH=str(length),
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+        environ['wsgi.input'] = stream
+        request = WSGIRequest(environ)
+        request.user = self.user
+        return request
+
+    def stream_upload(self, size):
+        session, _ = self.start(size)
+        request = self.chunk_request(session, size, ZeroStream(size))
+
+        tracemalloc.start()
+        try:
+            response = uploads.upload_session(request, session.pk)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(response.status_code, 204)
+        session.refresh_from_db()
+        self.assertEqual(session.offset, size)
+        self.assertEqual(os.path.getsize(os.path.join(self.staging_root, session.staged_name)), size)
+        # A few read buffers, however large the chunk
+        self.assertLess(peak, uploads.UPLOAD_READ_SIZE * 8)
+
+    def test_chunk_streams_to_disk_in_constant_memory(self):
+        self.stream_upload(64 * 1024 ** 2)
+
+    @skipUnless(os.environ.get('LARGE_UPLOAD_TEST_GB'), 'set LARGE_UPLOAD_TEST_GB to stream a multi-GB chunk')
+    def test_multi_gigabyte_chunk(self):
+        self.stream_upload(int(float(os.environ['LARGE_UPLOAD_TEST_GB']) * 1024 ** 3))
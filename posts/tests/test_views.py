@@ -1,13 +1,22 @@
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase, Client
 from django.urls import reverse
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
 from django.contrib.messages import get_messages
-from posts.models import Post
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from posts.models import Post, PostMedia, Vote
+from posts import ranking
+from posts.feeds import get_user_votes
+from posts.voting import cast_vote
 from communities.models import Community
 from posts.forms import PostForm, CommentForm
 from comments.models import Comment
 from posts.forms import PostForm
 from comments.forms import CommentForm
+from reddit_clone.pagination import encode_cursor
 
 class PostViewsTest(TestCase):
     def setUp(self):
@@ -190,4 +199,408 @@ class VotePostTest(TestCase):
         # Second downvote
         self.client.post(reverse('vote_post', args=[self.post.pk, 'downvote']))
         self.assertNotIn(self.user, self.post.upvotes.all())
-        self.assertIn(self.user, self.post.downvotes.all())
\ No newline at end of file
+        self.assertIn(self.user, self.post.downvotes.all())
+
+    def test_vote_updates_stored_counters(self):
+        """Stored counters follow upvote, switch and removal"""
+        self.client.login(username='testuser', password='testpass123')
+
+        self.client.post(reverse('vote_post', args=[self.post.pk, 'upvote']))
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (1, 0, 1))
+
+        self.client.post(reverse('vote_post', args=[self.post.pk, 'downvote']))
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (0, 1, -1))
+
+        self.client.post(reverse('vote_post', args=[self.post.pk, 'downvote']))
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (0, 0, 0))
+
+    def test_vote_ajax_response(self):
+        """AJAX vote returns the stored score and the user's vote"""
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.post(
+            reverse('vote_post', args=[self.post.pk, 'upvote']),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        data = response.json()
+        self.assertEqual(data['total_votes'], 1)
+        self.assertEqual(data['user_vote'], 1)
+
+
+class PostListSortTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.voters = [
+            User.objects.create_user(username=f'voter{i}', password='testpass123')
+            for i in range(3)
+        ]
+        self.quiet = Post.objects.create(title='Quiet Post', content='c', author=self.user)
+        self.popular = Post.objects.create(title='Popular Post', content='c', author=self.user)
+        self.split = Post.objects.create(title='Split Post', content='c', author=self.user)
+
+        for voter in self.voters:
+            self.client.force_login(voter)
+            self.client.post(reverse('vote_post', args=[self.popular.pk, 'upvote']))
+        self.client.force_login(self.voters[0])
+        self.client.post(reverse('vote_post', args=[self.split.pk, 'upvote']))
+        self.client.force_login(self.voters[1])
+        self.client.post(reverse('vote_post', args=[self.split.pk, 'downvote']))
+        self.client.logout()
+
+    def titles(self, query):
+        response = self.client.get(reverse('post_list') + query)
+        self.assertEqual(response.status_code, 200)
+        return [post.title for post in response.context['posts']]
+
+    def test_default_sort_is_new(self):
+        self.assertEqual(self.titles(''), ['Split Post', 'Popular Post', 'Quiet Post'])
+
+    def test_hot_sort_uses_votes(self):
+        self.assertEqual(self.titles('?sort=hot')[0], 'Popular Post')
+
+    def test_top_sort(self):
+        self.assertEqual(self.titles('?sort=top&t=all')[0], 'Popular Post')
+        self.assertEqual(self.titles('?sort=top&t=hour')[0], 'Popular Post')
+
+    def test_rising_sort_only_lists_upvoted_young_posts(self):
+        self.assertEqual(self.titles('?sort=rising'), ['Popular Post'])
+
+    def test_controversial_sort(self):
+        self.assertEqual(self.titles('?sort=controversial'), ['Split Post'])
+
+    def test_unknown_sort_falls_back_to_new(self):
+        response = self.client.get(reverse('post_list') + '?sort=bogus')
+        self.assertEqual(response.context['sort'], 'new')
+
+    def test_vote_refreshes_rank(self):
+        self.popular.refresh_from_db()
+        self.quiet.refresh_from_db()
+        self.assertGreater(self.popular.hot_rank, self.quiet.hot_rank)
+        self.assertGreater(self.popular.rising_rank, 0)
+
+
+class PostListQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.community = Community.objects.create(
+            name='testcommunity', description='Test Community', created_by=self.user
+        )
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(
+                title=f'Post {i}', content='c', author=self.user, community=self.community
+            )
+            PostMedia.objects.create(post=post, media_file=f'post_media/{i}.jpg')
+            PostMedia.objects.create(post=post, media_file=f'post_media/{i}.png')
+            Comment.objects.create(post=post, author=self.user, content='comment')
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('post_list'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.create_posts(2)
+        small_page = self.count_list_queries()
+        self.create_posts(8)
+        full_page = self.count_list_queries()
+        self.assertEqual(small_page, full_page)
+
+    def test_feed_annotations(self):
+        self.create_posts(1)
+        response = self.client.get(reverse('post_list'))
+        post = response.context['posts'][0]
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(post.media_count, 2)
+
+
+class PostFeedPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.community = Community.objects.create(
+            name='testcommunity', description='Test Community', created_by=self.user
+        )
+        # Equal scores everywhere, so the id tie-breaker decides the order
+        self.posts = [
+            Post.objects.create(title=f'Post {i}', content='c', author=self.user, community=self.community)
+            for i in range(25)
+        ]
+
+    def walk_html(self, query):
+        titles, cursor = [], None
+        while True:
+            url = reverse('post_list') + query + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(url)
+            titles.extend(post.title for post in response.context['posts'])
+            cursor = response.context['next_cursor']
+            if not cursor:
+                return titles
+
+    def test_pages_cover_every_post_once(self):
+        expected = [f'Post {i}' for i in reversed(range(25))]
+        self.assertEqual(self.walk_html('?sort=new'), expected)
+        self.assertEqual(self.walk_html('?sort=top&t=all'), expected)
+        self.assertEqual(self.walk_html('?sort=top&t=day'), expected)
+        self.assertEqual(self.walk_html('?sort=hot'), expected)
+
+    def test_no_count_or_offset(self):
+        first = self.client.get(reverse('post_list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('post_list') + f"?cursor={first.context['next_cursor']}")
+        sql = ' '.join(q['sql'] for q in queries)
+        self.assertNotIn('OFFSET', sql)
+        self.assertNotIn('COUNT(*) AS "__count"', sql)
+
+    def test_invalid_cursor_restarts_html_feed(self):
+        response = self.client.get(reverse('post_list') + '?cursor=garbage')
+        self.assertEqual(response.context['posts'][0].title, 'Post 24')
+
+    def test_json_feed(self):
+        Post.objects.create(title='Elsewhere', content='c', author=self.user)
+        url = reverse('post_feed')
+        data = self.client.get(url, {'community': 'testcommunity'}).json()
+        self.assertEqual(len(data['posts']), 10)
+        self.assertEqual(data['posts'][0]['title'], 'Post 24')
+        self.assertEqual(data['posts'][0]['community'], 'testcommunity')
+
+        seen = [post['title'] for post in data['posts']]
+        while data['next_cursor']:
+            data = self.client.get(url, {'community': 'testcommunity', 'cursor': data['next_cursor']}).json()
+            seen.extend(post['title'] for post in data['posts'])
+        self.assertEqual(len(seen), 25)
+        self.assertNotIn('Elsewhere', seen)
+
+    def test_json_feed_rejects_bad_cursor(self):
+        response = self.client.get(reverse('post_feed'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_forged_cursor_values_are_rejected(self):
+        now = self.posts[0].created_at
+        forged = [
+            {'sort': 'top', 't': 'all', 'cursor': encode_cursor(['abc', 1])},
+            {'sort': 'new', 'cursor': encode_cursor([5, 1])},
+            {'sort': 'new', 'cursor': encode_cursor([now, 'zz'])},
+            {'sort': 'hot', 'cursor': encode_cursor([now, 1])},
+        ]
+        for query in forged:
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(reverse('post_feed'), query).status_code, 400)
+                # A bad cursor shares the cached first page; render it afresh to see the context
+                cache.clear()
+                response = self.client.get(reverse('post_list'), query)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['posts'][0].title, 'Post 24')
+
+    def test_community_feed_pages(self):
+        url = reverse('communities:community_detail', args=['testcommunity'])
+        first = self.client.get(url)
+        self.assertEqual(len(first.context['posts']), 10)
+        second = self.client.get(url, {'cursor': first.context['next_cursor']})
+        self.assertEqual(second.context['posts'][0].title, 'Post 14')
+
+    def test_community_feed_restarts_on_forged_cursor(self):
+        url = reverse('communities:community_detail', args=['testcommunity'])
+        for cursor in ['garbage', encode_cursor(['abc', 1]), encode_cursor([self.posts[0].created_at, 'zz'])]:
+            with self.subTest(cursor=cursor):
+                cache.clear()
+                response = self.client.get(url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['posts'][0].title, 'Post 24')
+
+
+class PostCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.voter = User.objects.create_user(username='voter', password='testpass123')
+        self.post = Post.objects.create(title='Cached Post', content='original body', author=self.user)
+        PostMedia.objects.create(post=self.post, media_file='post_media/a.jpg')
+
+    def render(self):
+        with mock.patch.object(PostMedia, 'get_cloudinary_url', autospec=True, return_value='/m.jpg') as media_url:
+            response = self.client.get(reverse('post_list'))
+        return response, media_url.call_count
+
+    def test_second_render_comes_from_cache(self):
+        _, first = self.render()
+        _, second = self.render()
+        self.assertEqual(first, 1)
+        self.assertEqual(second, 0)
+
+    def test_edit_invalidates_card(self):
+        self.render()
+        self.post.content = 'edited body'
+        self.post.save()
+        response, rendered = self.render()
+        self.assertEqual(rendered, 1)
+        self.assertContains(response, 'edited body')
+
+    def test_media_change_invalidates_card(self):
+        self.render()
+        PostMedia.objects.create(post=self.post, media_file='post_media/b.jpg')
+        _, rendered = self.render()
+        self.assertEqual(rendered, 2)
+
+    def test_vote_state_is_per_viewer(self):
+        self.client.force_login(self.voter)
+        self.client.post(reverse('vote_post', args=[self.post.pk, 'upvote']))
+        self.render()
+        response, rendered = self.render()
+        self.assertEqual(rendered, 0)
+        self.assertContains(response, 'btn btn-success vote-btn')
+        self.assertContains(response, '<strong>1</strong>')
+
+        self.client.force_login(self.user)
+        response, rendered = self.render()
+        self.assertEqual(rendered, 0)
+        self.assertNotContains(response, 'btn btn-success vote-btn')
+
+
+class ViewerVoteStateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.community = Community.objects.create(
+            name='testcommunity', description='Test Community', created_by=self.user
+        )
+        self.up = Post.objects.create(title='Up', content='c', author=self.user, community=self.community)
+        self.down = Post.objects.create(title='Down', content='c', author=self.user, community=self.community)
+        self.none = Post.objects.create(title='None', content='c', author=self.user, community=self.community)
+        Vote.objects.create(post=self.up, user=self.user, value=Vote.UPVOTE)
+        Vote.objects.create(post=self.down, user=self.user, value=Vote.DOWNVOTE)
+
+    def test_get_user_votes_single_query(self):
+        with self.assertNumQueries(1):
+            votes = get_user_votes([self.up.pk, self.down.pk, self.none.pk], self.user)
+        self.assertEqual(votes, {self.up.pk: 1, self.down.pk: -1})
+
+    def test_get_user_votes_anonymous(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_votes([self.up.pk], AnonymousUser()), {})
+
+    def test_post_list_attaches_viewer_vote(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('post_list'))
+        votes = {post.title: post.viewer_vote for post in response.context['posts']}
+        self.assertEqual(votes, {'Up': 1, 'Down': -1, 'None': 0})
+        self.assertContains(response, 'btn btn-success vote-btn')
+        self.assertContains(response, 'btn btn-danger vote-btn')
+
+    def test_post_detail_attaches_viewer_vote(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('post_detail', args=[self.down.pk]))
+        self.assertEqual(response.context['post'].viewer_vote, -1)
+
+    def test_community_detail_attaches_viewer_vote(self):
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse('communities:community_detail', args=[self.community.name])
+        )
+        votes = {post.title: post.viewer_vote for post in response.context['posts']}
+        self.assertEqual(votes, {'Up': 1, 'Down': -1, 'None': 0})
+
+
+class VoteStatementsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.post = Post.objects.create(title='Test Post', content='c', author=self.user)
+        self.client.force_login(self.user)
+
+    def vote_queries(self, vote_type):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('vote_post', args=[self.post.pk, vote_type]))
+        return [q['sql'] for q in queries if '"posts_vote"' in q['sql']]
+
+    def test_each_click_touches_the_vote_table_twice(self):
+        # One read of the previous value and one upsert or delete
+        for vote_type in ['upvote', 'downvote', 'downvote']:
+            statements = self.vote_queries(vote_type)
+            self.assertEqual(len(statements), 2, statements)
+
+    def test_vote_statements(self):
+        # Lock the post, read the previous vote, write it, update counters and ranks
+        with CaptureQueriesContext(connection) as queries:
+            cast_vote(self.post, self.user, Vote.UPVOTE)
+        statements = [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 4, statements)
+        self.assertIn('"hot_rank"', statements[-1])
+
+        stored = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((stored.upvote_count, stored.score), (1, 1))
+        self.assertEqual(stored.hot_rank, ranking.compute_ranks(stored)['hot_rank'])
+        self.assertEqual(stored.hot_rank, self.post.hot_rank)
+
+    def test_switching_vote_keeps_a_single_row(self):
+        self.vote_queries('upvote')
+        self.vote_queries('downvote')
+        self.assertEqual(
+            list(Vote.objects.filter(post=self.post).values_list('value', flat=True)),
+            [Vote.DOWNVOTE]
+        )
+        self.assertEqual(self.post.user_vote(self.user), -1)
+
+
+class PostDetailConditionalGetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.voter = User.objects.create_user(username='voter', password='testpass123')
+        self.post = Post.objects.create(title='Post', content='body', author=self.user)
+        self.url = reverse('post_detail', args=[self.post.pk])
+
+    def revalidate(self, response, client=None):
+        return (client or self.client).get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_validators_sent(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response['ETag'])
+        # Votes and logins change the page without moving a timestamp
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_unchanged_page_is_not_rendered_again(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(1):
+            revalidated = self.revalidate(response)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertFalse(revalidated.templates)
+
+    def test_if_modified_since_alone_does_not_revalidate(self):
+        self.client.get(self.url)
+        self.voter_client().post(reverse('vote_post', args=[self.post.pk, 'upvote']))
+        by_date = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE='Sun, 01 Jan 2090 00:00:00 GMT')
+        self.assertEqual(by_date.status_code, 200)
+
+    def test_changes_invalidate(self):
+        changes = [
+            lambda: Comment.objects.create(post=self.post, author=self.voter, content='first'),
+            lambda: Comment.objects.filter(post=self.post).first().delete(),
+            lambda: self.voter_client().post(reverse('vote_post', args=[self.post.pk, 'upvote'])),
+            lambda: self.voter_client().post(reverse('vote_post', args=[self.post.pk, 'upvote'])),
+            lambda: Post.objects.get(pk=self.post.pk).save(),
+        ]
+        for change in changes:
+            response = self.client.get(self.url)
+            change()
+            self.assertEqual(self.revalidate(response).status_code, 200)
+
+    def voter_client(self):
+        client = Client()
+        client.force_login(self.voter)
+        return client
+
+    def test_validators_are_per_viewer(self):
+        anonymous = self.client.get(self.url)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertNotEqual(response['ETag'], anonymous['ETag'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.revalidate(anonymous).status_code, 200)
+        self.assertEqual(self.revalidate(response).status_code, 304)
+
+    def test_missing_post_is_404(self):
+        response = self.client.get(reverse('post_detail', args=[self.post.pk + 1]))
+        self.assertEqual(response.status_code, 404)
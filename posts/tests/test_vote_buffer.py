@@ -0,0 +1,223 @@
+import os
+import unittest
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts.models import Post, Vote
+from posts.checks import check_vote_buffer
+from posts.vote_buffer import LocalVoteBuffer, RedisVoteBuffer, flush_vote_buffer, get_vote_buffer
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+@override_settings(
+    VOTE_WRITE_BEHIND=True,
+    VOTE_BUFFER_URL='local://vote-buffer-tests',
+    VOTE_BUFFER_FLUSH_INTERVAL=3600,
+)
+class WriteBehindVotingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='otheruser', password='testpass123')
+        self.post = Post.objects.create(title='Viral Post', content='c', author=self.user)
+        self.buffer = get_vote_buffer()
+        self.buffer.drain()
+        self.buffer.acknowledge()
+
+    def vote(self, user, vote_type):
+        self.client.force_login(user)
+        return self.client.post(
+            reverse('vote_post', args=[self.post.pk, vote_type]),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        ).json()
+
+    def test_votes_are_buffered_not_written(self):
+        data = self.vote(self.user, 'upvote')
+        self.assertEqual(data['total_votes'], 1)
+        self.assertEqual(data['user_vote'], 1)
+        self.assertFalse(Vote.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, 0)
+
+    def test_buffer_keeps_latest_vote_per_user(self):
+        self.vote(self.user, 'upvote')
+        self.vote(self.user, 'downvote')
+        data = self.vote(self.other, 'upvote')
+        self.assertEqual(data['total_votes'], 0)
+        self.assertEqual(self.buffer.pending_vote(self.post.pk, self.user.pk), -1)
+
+    def test_feed_merges_unflushed_votes(self):
+        self.vote(self.user, 'upvote')
+        self.vote(self.other, 'upvote')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('post_list'))
+        post = response.context['posts'][0]
+        self.assertEqual(post.total_votes(), 2)
+        self.assertEqual(post.viewer_vote, 1)
+
+    def test_flush_writes_votes_and_counters(self):
+        self.vote(self.user, 'upvote')
+        self.vote(self.other, 'downvote')
+        self.vote(self.other, 'downvote')  # removed again before the flush
+        self.assertEqual(flush_vote_buffer(), 2)
+
+        self.assertEqual(
+            list(Vote.objects.values_list('user_id', 'value')), [(self.user.pk, Vote.UPVOTE)]
+        )
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (1, 0, 1))
+        self.assertEqual(self.buffer.pending_deltas([self.post.pk]), {})
+
+    def test_removing_a_flushed_vote(self):
+        self.vote(self.user, 'upvote')
+        flush_vote_buffer()
+        data = self.vote(self.user, 'upvote')
+        self.assertEqual(data['user_vote'], 0)
+        self.assertEqual(data['total_votes'], 0)
+        flush_vote_buffer()
+        self.assertFalse(Vote.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (0, 0, 0))
+
+    def test_flush_applies_deltas_without_counting_votes(self):
+        self.vote(self.user, 'upvote')
+        self.vote(self.other, 'downvote')
+        self.vote(self.other, 'upvote')
+        hot_rank = self.post.hot_rank
+        with CaptureQueriesContext(connection) as queries:
+            flush_vote_buffer()
+        self.assertFalse([query['sql'] for query in queries if 'COUNT(' in query['sql'].upper()])
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (2, 0, 2))
+        self.assertGreater(self.post.hot_rank, hot_rank)
+
+
+class VoteBufferBackendTests:
+    def make_buffer(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.buffer = self.make_buffer()
+
+    def test_roundtrip(self):
+        buffer = self.buffer
+        buffer.record(1, 10, 0, 1)
+        buffer.record(1, 11, 0, -1)
+        buffer.record(1, 10, 1, -1)
+        self.assertEqual(buffer.pending_vote(1, 10), -1)
+        self.assertIsNone(buffer.pending_vote(2, 10))
+        self.assertEqual(buffer.pending_votes([1, 2], 11), {1: -1})
+        self.assertEqual(buffer.pending_deltas([1, 2]), {1: -2})
+
+        votes, deltas = buffer.drain()
+        self.assertEqual(votes, {(1, 10): -1, (1, 11): -1})
+        self.assertEqual(deltas, {1: (0, 2)})
+
+        buffer.record(1, 10, -1, 1)
+        buffer.restore(votes, deltas)
+        self.assertEqual(buffer.pending_vote(1, 10), 1)
+        self.assertEqual(buffer.pending_vote(1, 11), -1)
+        self.assertEqual(buffer.pending_deltas([1]), {})
+
+    def test_drained_batch_stays_pending_until_acknowledged(self):
+        buffer = self.buffer
+        buffer.cast(1, 10, 1, lambda: 0)
+        votes, deltas = buffer.drain()
+        self.assertEqual((votes, deltas), ({(1, 10): 1}, {1: (1, 0)}))
+        # A second flush gets nothing while the batch is in flight
+        self.assertEqual(buffer.drain(), ({}, {}))
+
+        self.assertEqual(buffer.pending_vote(1, 10), 1)
+        self.assertEqual(buffer.pending_deltas([1]), {1: 1})
+        # The Vote row is not written yet; the click toggles against the batch
+        self.assertEqual(buffer.cast(1, 10, 1, lambda: 0), (1, 0))
+        self.assertEqual(buffer.pending_deltas([1]), {})
+
+        buffer.acknowledge()
+        self.assertEqual(buffer.pending_vote(1, 10), 0)
+        self.assertEqual(buffer.pending_deltas([1]), {1: -1})
+
+    def test_cast_rereads_after_a_concurrent_click(self):
+        buffer = self.buffer
+
+        def load_stored():
+            # The same user's other click lands while this one reads the database
+            if buffer.pending_vote(1, 10) is None:
+                buffer.cast(1, 10, 1, lambda: 0)
+            return 0
+
+        self.assertEqual(buffer.cast(1, 10, 1, load_stored), (1, 0))
+        self.assertEqual(buffer.pending_deltas([1]), {})
+
+    def test_cast_ignores_a_read_that_predates_a_flush(self):
+        buffer = self.buffer
+        reads = []
+
+        def load_stored():
+            reads.append(1)
+            if len(reads) == 1:
+                # Another click is flushed while this one reads the old row
+                buffer.cast(1, 10, 1, lambda: 0)
+                buffer.drain()
+                buffer.acknowledge()
+                return 0
+            return 1
+
+        self.assertEqual(buffer.cast(1, 10, 1, load_stored), (1, 0))
+        self.assertEqual(len(reads), 2)
+
+
+class LocalVoteBufferTest(VoteBufferBackendTests, TestCase):
+    def make_buffer(self):
+        return LocalVoteBuffer()
+
+
+@unittest.skipUnless(redis, 'redis package not installed')
+class RedisVoteBufferTest(VoteBufferBackendTests, TestCase):
+    """RedisVoteBuffer over redis-py, talking to the in-process fake server"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from tests.fake_redis import FakeRedisServer
+        cls.server = FakeRedisServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def make_buffer(self):
+        client = redis.Redis.from_url(self.server.url)
+        client.flushdb()
+        return RedisVoteBuffer(client)
+
+    def test_expired_batch_is_taken_over(self):
+        self.buffer.cast(1, 10, 1, lambda: 0)
+        self.buffer.drain()
+        # The flush died: its lease runs out and the next drain flushes the batch again
+        self.buffer.client.delete(self.buffer.batch_key)
+        self.buffer.cast(2, 10, 1, lambda: 0)
+        self.assertEqual(self.buffer.drain(), ({(1, 10): 1}, {1: (1, 0)}))
+        self.buffer.acknowledge()
+        self.assertEqual(self.buffer.drain(), ({(2, 10): 1}, {2: (1, 0)}))
+
+
+class VoteBufferCheckTest(TestCase):
+    def check_ids(self, workers='1', **overrides):
+        with override_settings(**overrides), mock.patch.dict(os.environ, {'WEB_CONCURRENCY': workers}):
+            return [message.id for message in check_vote_buffer(None)]
+
+    def test_local_buffer_needs_a_single_worker(self):
+        local = {'VOTE_WRITE_BEHIND': True, 'VOTE_BUFFER_URL': 'local://', 'DEBUG': False}
+        self.assertEqual(self.check_ids('4', **local), ['posts.E001'])
+        self.assertEqual(self.check_ids('1', **local), ['posts.W001'])
+        self.assertEqual(self.check_ids('4', **{**local, 'VOTE_BUFFER_URL': 'redis://cache:6379/1'}), [])
+        self.assertEqual(self.check_ids('4', **{**local, 'VOTE_WRITE_BEHIND': False}), [])
@@ -0,0 +1,343 @@
+"""Upload APIs for media that should not go through the post form.
+
+Resumable (tus-style) uploads of large files, assembled in staging:
+
+    POST   /posts/uploads/                  {"post": id, "filename": ..., "length": bytes} -> 201 + Location
+    HEAD   /posts/uploads/<id>/             Upload-Offset / Upload-Length, to resume
+    PATCH  /posts/uploads/<id>/             Upload-Offset: n, body = the bytes from n on -> 204
+    POST   /posts/uploads/<id>/finalize/    attaches the file to a PostMedia row
+    DELETE /posts/uploads/<id>/             abandons the upload
+
+Direct uploads, where the bytes skip the app entirely (see posts.direct_uploads):
+
+    POST   /posts/direct-uploads/           same body -> 201 + signed upload descriptor
+    POST   /posts/direct-uploads/confirm/   {"ticket": ..., <provider reply>} -> PostMedia
+
+PATCH bodies go from the request stream to the staging file in
+UPLOAD_READ_SIZE reads (``request.body`` is never touched), so memory use
+does not grow with the chunk or the file. Bytes that arrived before a
+connection dropped still count: the client asks for the offset and sends
+the rest. Finalizing hands the assembled file to the media pipeline like
+any staged upload.
+
+Each process keeps a running SHA-256 of the uploads it is receiving, so
+the file is hashed as it streams in and finalizing passes the digest on
+(posts.blobs). A chunk that lands on another process has no running hash
+to continue; that upload is then hashed once more when it is stored.
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse, UnreadablePostError
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods, require_POST
+
+from reddit_clone.middleware import query_budget
+from . import direct_uploads, media_pipeline
+from .models import MEDIA_FILE_EXTENSIONS, Post, PostMedia, UploadSession
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent PATCHes of one session are not serialized
+    fcntl = None
+
+# Bytes read from the request stream per write
+UPLOAD_READ_SIZE = 1024 * 1024
+TUS_VERSION = '1.0.0'
+
+# Session id -> (bytes hashed so far, running sha256), least recently used first
+_running_hashes = OrderedDict()
+_running_hashes_lock = threading.Lock()
+RUNNING_HASHES_KEPT = 256
+
+
+def _take_running_hash(session, offset):
+    """The hash of the first ``offset`` bytes of the upload, or None if this process lacks it"""
+    if offset == 0:
+        return hashlib.sha256()
+    with _running_hashes_lock:
+        hashed, sha256 = _running_hashes.pop(session.pk, (None, None))
+    return sha256 if hashed == offset else None
+
+
+def _keep_running_hash(session, offset, sha256):
+    with _running_hashes_lock:
+        _running_hashes[session.pk] = (offset, sha256)
+        while len(_running_hashes) > RUNNING_HASHES_KEPT:
+            _running_hashes.popitem(last=False)
+
+
+def _drop_running_hash(session):
+    with _running_hashes_lock:
+        _running_hashes.pop(session.pk, None)
+
+
+def _error(message, status, session=None):
+    response = JsonResponse({'status': 'error', 'message': message}, status=status)
+    if session is not None:
+        response['Upload-Offset'] = str(session.offset)
+    return response
+
+
+def _upload_headers(response, session):
+    response['Tus-Resumable'] = TUS_VERSION
+    response['Upload-Offset'] = str(session.offset)
+    response['Upload-Length'] = str(session.length)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def _login_required_json(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _error('Authentication required', 401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _session_or_404(request, session_id):
+    return UploadSession.objects.filter(pk=session_id, user=request.user).select_related('media').first()
+
+
+def _json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _announced_upload(request):
+    """Checks a {post, filename, length} body; returns ``(post, filename, length)`` or an error response"""
+    data = _json_body(request)
+    try:
+        length = int(data.get('length'))
+    except (AttributeError, ValueError, TypeError):
+        return _error('Expected JSON with post, filename and length', 400)
+
+    post = Post.objects.filter(pk=data.get('post'), author=request.user).first()
+    if post is None:
+        return _error('Post not found', 404)
+    filename = os.path.basename(str(data.get('filename') or ''))
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    if extension not in MEDIA_FILE_EXTENSIONS:
+        return _error(f'Unsupported file type: {filename or "no filename"}', 400)
+    if length <= 0:
+        return _error('Length must be positive', 400)
+    if length > settings.MEDIA_UPLOAD_MAX_SIZE:
+        return _error('File too large', 413)
+    return post, filename, length
+
+
+@query_budget(6)
+@require_POST
+@_login_required_json
+def create_upload(request):
+    announced = _announced_upload(request)
+    if isinstance(announced, HttpResponse):
+        return announced
+    post, filename, length = announced
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+
+    staged_name = media_pipeline.staging_storage().save(
+        f'uploads/{uuid.uuid4().hex}.{extension}', ContentFile(b'')
+    )
+    session = UploadSession.objects.create(
+        user=request.user, post=post, filename=filename, length=length, staged_name=staged_name
+    )
+    url = reverse('upload_session', args=[session.pk])
+    response = JsonResponse(
+        {'status': 'success', 'id': str(session.pk), 'url': url, 'offset': 0, 'length': length},
+        status=201,
+    )
+    response['Location'] = url
+    return _upload_headers(response, session)
+
+
+@query_budget(6)
+@require_http_methods(['GET', 'HEAD', 'PATCH', 'DELETE'])
+@_login_required_json
+def upload_session(request, session_id):
+    session = _session_or_404(request, session_id)
+    if session is None:
+        return _error('Upload not found', 404)
+
+    if request.method == 'PATCH':
+        return _write_chunk(request, session)
+    if request.method == 'DELETE':
+        if session.media_id:
+            return _error('Upload already finalized', 409, session)
+        media_pipeline.staging_storage().delete(session.staged_name)
+        _drop_running_hash(session)
+        session.delete()
+        return HttpResponse(status=204)
+
+    response = JsonResponse({
+        'status': 'success',
+        'id': str(session.pk),
+        'offset': session.offset,
+        'length': session.length,
+        'finalized': session.media_id is not None,
+    })
+    return _upload_headers(response, session)
+
+
+def _write_chunk(request, session):
+    if session.media_id:
+        return _error('Upload already finalized', 409, session)
+    try:
+        offset = int(request.headers['Upload-Offset'])
+        declared = int(request.META.get('CONTENT_LENGTH') or 0)
+    except (KeyError, ValueError):
+        return _error('Upload-Offset and Content-Length headers are required', 400)
+    if offset + declared > session.length:
+        return _error('Chunk runs past the upload length', 413, session)
+
+    path = media_pipeline.staging_storage().path(session.staged_name)
+    written = 0
+    with open(path, 'r+b') as staged:
+        if fcntl is not None:
+            try:
+                fcntl.flock(staged, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return _error('Another chunk of this upload is being written', 409, session)
+        # Another request may have moved the offset before the lock was ours
+        session.refresh_from_db(fields=['offset'])
+        if offset != session.offset:
+            return _error('Upload-Offset does not match', 409, session)
+
+        # Anything past the offset is a leftover of a write that was never counted
+        staged.seek(offset)
+        staged.truncate()
+        sha256 = _take_running_hash(session, offset)
+        try:
+            while written < declared:
+                try:
+                    chunk = request.read(min(UPLOAD_READ_SIZE, declared - written))
+                except UnreadablePostError:
+                    break
+                if not chunk:
+                    break
+                staged.write(chunk)
+                if sha256 is not None:
+                    sha256.update(chunk)
+                written += len(chunk)
+        finally:
+            # What reached the disk counts even when the client went away mid-chunk
+            staged.flush()
+            session.offset = offset + written
+            changes = {'offset': session.offset, 'updated_at': timezone.now()}
+            if sha256 is not None and session.is_complete:
+                session.sha256 = changes['sha256'] = sha256.hexdigest()
+                _drop_running_hash(session)
+            elif sha256 is not None:
+                _keep_running_hash(session, session.offset, sha256)
+            UploadSession.objects.filter(pk=session.pk).update(**changes)
+
+    if written < declared:
+        return _upload_headers(_error('Chunk cut short; resume from Upload-Offset', 400), session)
+    return _upload_headers(HttpResponse(status=204), session)
+
+
+@query_budget(12)
+@require_POST
+@_login_required_json
+def finalize_upload(request, session_id):
+    session = _session_or_404(request, session_id)
+    if session is None:
+        return _error('Upload not found', 404)
+
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        media = session.media
+        if media is None:
+            if not session.is_complete:
+                return _error('Upload is incomplete', 409, session)
+            media = PostMedia.objects.create(
+                post_id=session.post_id,
+                status=PostMedia.STATUS_PENDING,
+                staged_name=session.staged_name,
+                staged_sha256=session.sha256,
+                original_name=session.filename,
+            )
+            session.media = media
+            session.save(update_fields=['media', 'updated_at'])
+            media_pipeline.submit([media])
+
+    if settings.MEDIA_PIPELINE_SYNC:
+        media.refresh_from_db()
+    return JsonResponse({
+        'status': 'success',
+        'media': {'id': media.pk, 'status': media.status},
+        'status_url': reverse('post_media_status', args=[session.post_id]),
+    })
+
+
+@query_budget(4)
+@require_POST
+@_login_required_json
+def create_direct_upload(request):
+    announced = _announced_upload(request)
+    if isinstance(announced, HttpResponse):
+        return announced
+    post, filename, length = announced
+    descriptor = direct_uploads.issue(request.user, post, filename, length)
+    response = JsonResponse({'status': 'success', 'upload': descriptor}, status=201)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@csrf_exempt
+@query_budget(0)
+@require_http_methods(['PUT'])
+def local_direct_upload(request, ticket):
+    """The provider's side of a direct upload when no provider is configured.
+
+    Like a presigned URL, the ticket in the path is the only credential.
+    """
+    if not isinstance(direct_uploads.get_backend(), direct_uploads.LocalBackend):
+        return _error('Upload straight to the storage provider', 404)
+    try:
+        claims = direct_uploads.read_ticket(ticket)
+        if request.META.get('CONTENT_LENGTH') != str(claims['length']):
+            return _error('Content-Length does not match the ticket', 400)
+        receipt = direct_uploads.LocalBackend().store(claims, File(request, name=claims['name']))
+    except direct_uploads.UploadRejected as e:
+        return _error(str(e), 403)
+    return JsonResponse(receipt, status=201)
+
+
+@query_budget(10)
+@require_POST
+@_login_required_json
+def confirm_direct_upload(request):
+    data = _json_body(request) or {}
+    try:
+        claims, name = direct_uploads.confirm(request.user, str(data.get('ticket', '')), data)
+    except direct_uploads.UploadRejected as e:
+        return _error(str(e), 403)
+
+    post = Post.objects.filter(pk=claims['post'], author=request.user).first()
+    if post is None:
+        return _error('Post not found', 404)
+    # Confirming the same upload twice returns the first row
+    media, created = PostMedia.objects.get_or_create(
+        post=post, media_file=name, defaults={'original_name': claims['filename']}
+    )
+    if created:
+        media_pipeline.queue_derivatives([media])
+    return JsonResponse({
+        'status': 'success',
+        'media': {'id': media.pk, 'status': media.status, 'url': media.get_cloudinary_url()},
+    }, status=201 if created else 200)
@@ -3,17 +3,25 @@ from .views import (
     PostListView, PostDetailView, PostCreateView, 
     PostUpdateView, PostDeleteView, vote_post
 )
-from . import views
+from . import uploads, views
 from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
     path('', PostListView.as_view(), name='post_list'),
+    path('feed/', views.post_feed, name='post_feed'),
     path('create/', PostCreateView.as_view(), name='create_post'),
     path('<int:pk>/', PostDetailView.as_view(), name='post_detail'),
     path('<int:pk>/edit/', PostUpdateView.as_view(), name='post_edit'),
     path('<int:pk>/delete/', PostDeleteView.as_view(), name='post_delete'),
     path('<int:pk>/vote/<str:vote_type>/', vote_post, name='vote_post'),
+    path('<int:pk>/media/status/', views.post_media_status, name='post_media_status'),
+    path('uploads/', uploads.create_upload, name='upload_create'),
+    path('uploads/<uuid:session_id>/', uploads.upload_session, name='upload_session'),
+    path('uploads/<uuid:session_id>/finalize/', uploads.finalize_upload, name='upload_finalize'),
+    path('direct-uploads/', uploads.create_direct_upload, name='direct_upload_create'),
+    path('direct-uploads/confirm/', uploads.confirm_direct_upload, name='direct_upload_confirm'),
+    path('direct-uploads/local/<str:ticket>/', uploads.local_direct_upload, name='direct_upload_local'),
     
 ]
 
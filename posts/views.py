@@ -1,3 +1,5 @@
+import logging
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -5,38 +7,165 @@ from django.contrib.auth.decorators import login_required
 from django.urls import reverse_lazy
 from django.http import JsonResponse
 from django.contrib import messages
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
+from django.utils.decorators import method_decorator
 from django.db import transaction
 from .models import Post, PostMedia, Share
 from .forms import PostForm, CommentForm
+from . import media_pipeline, ranking
+from .feeds import attach_user_votes, feed_page, feed_query, feed_queryset
+from .freshness import post_detail_state
+from .voting import VOTE_VALUES, cast_vote
 from django.conf import settings
 from comments.models import Comment
+from comments.permissions import get_comment_permissions
+from comments.threads import COMMENT_SORTS, iter_tree, normalize_comment_sort, thread_page
+from reddit_clone.conditional import conditional_page
+from reddit_clone.middleware import query_budget
+from reddit_clone.page_cache import POSTS_SCOPE, cache_anonymous_page
+from reddit_clone.pagination import InvalidCursor
 
+logger = logging.getLogger(__name__)
 
 
-
-
+@query_budget(8)
+@method_decorator(cache_anonymous_page(POSTS_SCOPE, query=feed_query), name='dispatch')
 class PostListView(ListView):
     model = Post
     template_name = 'posts/post_list.html'
     context_object_name = 'posts'
-    ordering = ['-created_at']
-    paginate_by = 10
 
+    def get_sort(self):
+        return ranking.normalize_sort(
+            self.request.GET.get('sort'), self.request.GET.get('t')
+        )
+
+    def get_queryset(self):
+        # Cursor pages instead of Paginator: no COUNT(*) and no OFFSET scan
+        sort, period = self.get_sort()
+        try:
+            posts, self.next_cursor = feed_page(
+                sort=sort, period=period, cursor=self.request.GET.get('cursor')
+            )
+        except InvalidCursor:
+            # A mangled link starts the feed over
+            posts, self.next_cursor = feed_page(sort=sort, period=period)
+        # Resolving the viewer's votes for the whole page in one query
+        return attach_user_votes(posts, self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['sort'], context['period'] = self.get_sort()
+        context['sort_choices'] = ranking.SORT_CHOICES
+        context['top_periods'] = list(ranking.TOP_PERIODS)
+        context['next_cursor'] = self.next_cursor
+        context['post_card_timeout'] = settings.POST_CARD_CACHE_TIMEOUT
+        return context
+
+
+@query_budget(8)
+@require_GET
+def post_feed(request):
+    """JSON feed of posts, paginated by the ``next_cursor`` of the previous page"""
+    posts = Post.objects.all()
+    community_name = request.GET.get('community')
+    if community_name:
+        posts = posts.filter(community__name=community_name)
+
+    try:
+        page, next_cursor = feed_page(
+            posts, request.GET.get('sort'), request.GET.get('t'), request.GET.get('cursor')
+        )
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'posts': [
+            {
+                'id': post.id,
+                'title': post.title,
+                'url': post.get_absolute_url(),
+                'author': post.author.username,
+                'community': post.community.name if post.community else None,
+                'created_at': post.created_at.isoformat(),
+                'total_votes': post.total_votes(),
+                'user_vote': post.viewer_vote,
+                'comment_count': post.comment_count,
+                'media_count': post.media_count,
+            }
+            for post in attach_user_votes(page, request.user)
+        ],
+        'next_cursor': next_cursor,
+    })
+
+def stage_media_files(request, post):
+    """Hands the request's uploads to the media pipeline; the post is usable at once"""
+    media_files = request.FILES.getlist('media_files')
+    if settings.MEDIA_PIPELINE_SYNC:
+        media, errors = media_pipeline.upload_now(post, media_files)
+        for name, error in errors:
+            messages.warning(request, f'Could not upload {name}: {error}')
+        return media
+
+    staged = []
+    for media_file in media_files:
+        if not media_file:
+            continue
+        try:
+            staged.append(media_pipeline.stage_upload(post, media_file))
+        except Exception:
+            logger.exception(f"Staging media {media_file.name} for post {post.pk} failed")
+    media_pipeline.submit(staged)
+    if staged:
+        messages.info(request, 'Your media is processing and will appear shortly.')
+    return staged
+
+
+@query_budget(3)
+@require_GET
+def post_media_status(request, pk):
+    """Upload state of a post's media, polled by pages showing "processing" placeholders"""
+    media = list(PostMedia.objects.filter(post_id=pk).order_by('created_at', 'pk'))
+    return JsonResponse({
+        'status': 'success',
+        'media': [
+            {
+                'id': item.pk,
+                'status': item.status,
+                'media_type': item.media_type,
+                'url': item.get_cloudinary_url() if item.status == PostMedia.STATUS_READY else None,
+            }
+            for item in media
+        ],
+        'processing': any(item.is_processing for item in media),
+    })
+
+
+@query_budget(11)
+@method_decorator(conditional_page(post_detail_state), name='dispatch')
 class PostDetailView(DetailView):
     model = Post
     template_name = 'posts/post_detail.html'
+
+    def get_queryset(self):
+        # Counts annotated and media prefetched, as on a feed card
+        return feed_queryset()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         post = self.object
+        attach_user_votes([post], self.request.user)
         
-        # Get comments and pass the current user
-        comments = post.comments.all()
-        for comment in comments:
-            comment._current_user = self.request.user
-            
+        # First page of threads; the rest comes from the load_more_comments endpoint
+        sort = normalize_comment_sort(self.request.GET.get('comment_sort'))
+        comments, next_cursor = thread_page(post, sort)
+        get_comment_permissions(self.request, post).apply(iter_tree(comments))
+
         context['comments'] = comments
+        context['comment_sort'] = sort
+        context['comment_sorts'] = list(COMMENT_SORTS)
+        context['comments_next_cursor'] = next_cursor
         
         # Comment form (if needed)
         from comments.forms import CommentForm  
@@ -77,25 +206,7 @@ class PostCreateView(LoginRequiredMixin, CreateView):
         form.instance.author = self.request.user
         post = form.save()
         
-        media_files = self.request.FILES.getlist('media_files')
-        print(f"🔄 Processing {len(media_files)} media files")
-
-        for media_file in media_files:
-            if media_file:
-                print(f"🔄 Creating PostMedia for: {media_file.name}")
-                
-                try:
-                    # Просто создаем PostMedia с media_file
-                    post_media = PostMedia.objects.create(
-                        post=post, 
-                        media_file=media_file
-                    )
-                    print(f"✅ Media created: {post_media.media_type} - {post_media.get_cloudinary_url()}")
-                        
-                except Exception as e:
-                    print(f"❌ ERROR creating media: {str(e)}")
-                    continue
-        
+        stage_media_files(self.request, post)
         messages.success(self.request, 'Post created successfully!')
         return redirect(self.success_url)  
      
@@ -132,11 +243,7 @@ class PostUpdateView(LoginRequiredMixin, UpdateView):
             PostMedia.objects.filter(id__in=delete_media_ids, post=post).delete()
         
         # Adding new media files
-        media_files = self.request.FILES.getlist('media_files')
-        for media_file in media_files:
-            if media_file:
-                PostMedia.objects.create(post=post, media_file=media_file)
-        
+        stage_media_files(self.request, post)
         messages.success(self.request, 'Post updated successfully!')
         return redirect(self.get_success_url())
     
@@ -207,6 +314,7 @@ class PostDeleteView(LoginRequiredMixin, DeleteView):
         return context
     
    
+@query_budget(12)
 @require_POST
 # @login_required
 @require_POST
@@ -231,30 +339,18 @@ def vote_post(request, pk, vote_type):
     
     try:
         action = None
-        if vote_type == 'upvote':
-            if post.upvotes.filter(id=request.user.id).exists():
-                post.upvotes.remove(request.user)
-                action = 'removed upvote'
+        user_vote = 0
+        if vote_type in VOTE_VALUES:
+            _, user_vote = cast_vote(post, request.user, VOTE_VALUES[vote_type])
+            if user_vote:
+                action = f'{vote_type}d'
             else:
-                post.upvotes.add(request.user)
-                post.downvotes.remove(request.user)
-                action = 'upvoted'
-        elif vote_type == 'downvote':
-            if post.downvotes.filter(id=request.user.id).exists():
-                post.downvotes.remove(request.user)
-                action = 'removed downvote'
-            else:
-                post.downvotes.add(request.user)
-                post.upvotes.remove(request.user)
-                action = 'downvoted'
-        
-        # Updating the object from the database
-        post.refresh_from_db()
+                action = f'removed {vote_type}'
         
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({
                 'total_votes': post.total_votes(),
-                'user_vote': post.user_vote(request.user),
+                'user_vote': user_vote,
                 'status': 'success',
                 'message': f'Successfully {action}'
             })
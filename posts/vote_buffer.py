@@ -0,0 +1,443 @@
+"""Write-behind buffering of votes for hot posts.
+
+With ``VOTE_WRITE_BEHIND`` enabled, ``posts.voting.cast_vote`` records each
+click in a buffer instead of writing the ``Vote`` row and the post counters.
+The buffer keeps only the latest value per (post, user) plus running upvote
+and downvote deltas per post, and ``flush_vote_buffer`` applies everything
+in bulk on ``VOTE_BUFFER_FLUSH_INTERVAL``: the Vote rows, then one
+``F() + delta`` UPDATE per post, so a flush never recounts a hot post's
+votes (``rebuild_vote_counts`` is the repair path for that). Displayed
+scores add the unflushed delta.
+
+``cast`` reads the pending vote and records the new one as one atomic step
+(a lock locally, WATCH/MULTI in Redis). A drained batch stays visible to
+readers until its flush commits, so a click in between still toggles
+against it rather than against the not yet updated ``Vote`` row.
+
+``VOTE_BUFFER_URL`` selects the backend: ``local://`` keeps the buffer in
+process (one per worker, flushed by a background thread), ``redis://...``
+shares it between workers. A local buffer only knows the clicks its own
+worker took, so it is for single-process deployments (see posts.checks).
+"""
+import atexit
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+
+logger = logging.getLogger(__name__)
+
+# Rows written per statement when flushing; removals are OR-ed (post, user) pairs
+FLUSH_BATCH_SIZE = 500
+
+# How long a Redis batch stays claimed by its flush; after that the flush
+# is presumed dead and the next drain takes the batch over
+FLUSH_LEASE_SECONDS = 300
+
+
+def toggled(previous, value):
+    """The vote a click on ``value`` leaves: voting the same way twice removes it"""
+    return 0 if previous == value else value
+
+
+def vote_deltas(previous, current):
+    """``(upvote, downvote)`` counter changes for moving from one vote value to another"""
+    return (current == 1) - (previous == 1), (current == -1) - (previous == -1)
+
+
+def _add_deltas(first, second):
+    return first[0] + second[0], first[1] + second[1]
+
+
+class LocalVoteBuffer:
+    """In-process buffer; also the stand-in for a shared buffer in tests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._votes = {}
+        self._deltas = {}
+        # The batch a flush is writing; still pending until it commits
+        self._flushing_votes = {}
+        self._flushing_deltas = {}
+        # Bumped by every committed flush, so a database read that may
+        # predate one is not trusted
+        self._generation = 0
+
+    def _pending(self, key):
+        value = self._votes.get(key)
+        return self._flushing_votes.get(key) if value is None else value
+
+    def pending_vote(self, post_id, user_id):
+        with self._lock:
+            return self._pending((post_id, user_id))
+
+    def pending_votes(self, post_ids, user_id):
+        with self._lock:
+            votes = {post_id: self._pending((post_id, user_id)) for post_id in post_ids}
+        return {post_id: value for post_id, value in votes.items() if value is not None}
+
+    def pending_deltas(self, post_ids):
+        """``{post_id: unflushed score change}`` for the posts that have one"""
+        with self._lock:
+            deltas = {
+                post_id: _add_deltas(self._deltas.get(post_id, (0, 0)), self._flushing_deltas.get(post_id, (0, 0)))
+                for post_id in post_ids
+            }
+        return {post_id: up - down for post_id, (up, down) in deltas.items() if up != down}
+
+    def _record(self, post_id, user_id, previous, current):
+        self._votes[(post_id, user_id)] = current
+        self._deltas[post_id] = _add_deltas(self._deltas.get(post_id, (0, 0)), vote_deltas(previous, current))
+
+    def record(self, post_id, user_id, previous, current):
+        with self._lock:
+            self._record(post_id, user_id, previous, current)
+
+    def cast(self, post_id, user_id, value, load_stored):
+        """Toggles a vote and records it; returns ``(previous, current)``.
+
+        ``previous`` is the pending vote, or ``load_stored()`` (the ``Vote``
+        row) when nothing is pending. The stored value is read outside the
+        lock and used only if no flush committed while it was read.
+        """
+        key = (post_id, user_id)
+        stored = generation = None
+        while True:
+            with self._lock:
+                previous = self._pending(key)
+                if previous is None and generation == self._generation:
+                    previous = stored
+                if previous is not None:
+                    current = toggled(previous, value)
+                    self._record(post_id, user_id, previous, current)
+                    return previous, current
+                generation = self._generation
+            stored = load_stored()
+
+    def drain(self):
+        """Hands the pending votes and deltas to a flush; empty while another flush runs"""
+        with self._lock:
+            if self._flushing_votes:
+                return {}, {}
+            self._flushing_votes, self._flushing_deltas = self._votes, self._deltas
+            self._votes, self._deltas = {}, {}
+            return dict(self._flushing_votes), dict(self._flushing_deltas)
+
+    def acknowledge(self):
+        """The drained batch is in the database; stop counting it as pending"""
+        with self._lock:
+            self._flushing_votes, self._flushing_deltas = {}, {}
+            self._generation += 1
+
+    def restore(self, votes, deltas):
+        """Puts back a drained batch that failed to flush; newer clicks win"""
+        with self._lock:
+            for key, value in votes.items():
+                self._votes.setdefault(key, value)
+            for post_id, delta in deltas.items():
+                self._deltas[post_id] = _add_deltas(self._deltas.get(post_id, (0, 0)), delta)
+            self._flushing_votes, self._flushing_deltas = {}, {}
+
+
+class RedisVoteBuffer:
+    """Buffer shared by all workers, kept in Redis hashes"""
+
+    def __init__(self, client, prefix='votebuf'):
+        self.client = client
+        self.votes_key = f'{prefix}:votes'
+        # Fields '<post>:up' and '<post>:down'
+        self.deltas_key = f'{prefix}:deltas'
+        # The batch being flushed, the flush's claim on it, and the count of
+        # committed flushes (see LocalVoteBuffer)
+        self.flushing_votes_key = f'{prefix}:flushing:votes'
+        self.flushing_deltas_key = f'{prefix}:flushing:deltas'
+        self.batch_key = f'{prefix}:flushing:batch'
+        self.generation_key = f'{prefix}:generation'
+        # A flush's claim token, per thread: the flusher and a management command may overlap
+        self._batch = threading.local()
+
+    @staticmethod
+    def _field(post_id, user_id):
+        return f'{post_id}:{user_id}'
+
+    def _delta_commands(self, post_id, deltas):
+        up, down = deltas
+        return [
+            ('hincrby', self.deltas_key, f'{post_id}:up', up),
+            ('hincrby', self.deltas_key, f'{post_id}:down', down),
+        ]
+
+    def pending_vote(self, post_id, user_id):
+        return self.pending_votes([post_id], user_id).get(post_id)
+
+    def pending_votes(self, post_ids, user_id):
+        post_ids = list(post_ids)
+        if not post_ids:
+            return {}
+        fields = [self._field(p, user_id) for p in post_ids]
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hmget(self.votes_key, fields)
+        pipe.hmget(self.flushing_votes_key, fields)
+        values, flushing = pipe.execute()
+        votes = {}
+        for post_id, value, drained in zip(post_ids, values, flushing):
+            value = drained if value is None else value
+            if value is not None:
+                votes[post_id] = int(value)
+        return votes
+
+    def pending_deltas(self, post_ids):
+        post_ids = list(post_ids)
+        if not post_ids:
+            return {}
+        fields = [f'{post_id}:{counter}' for post_id in post_ids for counter in ('up', 'down')]
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hmget(self.deltas_key, fields)
+        pipe.hmget(self.flushing_deltas_key, fields)
+        values, flushing = pipe.execute()
+        counts = [int(value or 0) + int(drained or 0) for value, drained in zip(values, flushing)]
+        deltas = {}
+        for post_id, up, down in zip(post_ids, counts[::2], counts[1::2]):
+            if up != down:
+                deltas[post_id] = up - down
+        return deltas
+
+    def record(self, post_id, user_id, previous, current):
+        pipe = self.client.pipeline()
+        pipe.hset(self.votes_key, self._field(post_id, user_id), current)
+        for name, *args in self._delta_commands(post_id, vote_deltas(previous, current)):
+            getattr(pipe, name)(*args)
+        pipe.execute()
+
+    def cast(self, post_id, user_id, value, load_stored):
+        """Same as ``LocalVoteBuffer.cast``; the read and the write are one WATCH/MULTI transaction"""
+        from redis.exceptions import WatchError
+
+        field = self._field(post_id, user_id)
+        stored = generation = None
+        while True:
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(self.votes_key, self.flushing_votes_key, self.generation_key)
+                    previous = pipe.hget(self.votes_key, field)
+                    if previous is None:
+                        previous = pipe.hget(self.flushing_votes_key, field)
+                    current_generation = pipe.get(self.generation_key)
+                    if previous is None and generation == current_generation:
+                        previous = stored
+                    if previous is not None:
+                        previous = int(previous)
+                        current = toggled(previous, value)
+                        pipe.multi()
+                        pipe.hset(self.votes_key, field, current)
+                        for name, *args in self._delta_commands(post_id, vote_deltas(previous, current)):
+                            getattr(pipe, name)(*args)
+                        pipe.execute()
+                        return previous, current
+                    generation = current_generation
+                except WatchError:
+                    # Another click or a flush changed the buffer under us; read again
+                    continue
+            stored = load_stored()
+
+    def drain(self):
+        """Claims a batch for one flush (MULTI/EXEC, so two workers never take the same one)"""
+        from redis.exceptions import WatchError
+
+        token = uuid.uuid4().hex
+        while True:
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(self.votes_key, self.deltas_key, self.flushing_votes_key, self.batch_key)
+                    if pipe.exists(self.batch_key):
+                        return {}, {}
+                    # A batch left over by a flush that died is flushed again
+                    orphaned = pipe.exists(self.flushing_votes_key)
+                    if not orphaned and not pipe.exists(self.votes_key):
+                        return {}, {}
+                    has_deltas = pipe.exists(self.deltas_key)
+                    pipe.multi()
+                    pipe.set(self.batch_key, token, ex=FLUSH_LEASE_SECONDS)
+                    if not orphaned:
+                        # RENAME moves the whole hash at once, without copying it
+                        pipe.rename(self.votes_key, self.flushing_votes_key)
+                        if has_deltas:
+                            pipe.rename(self.deltas_key, self.flushing_deltas_key)
+                    pipe.execute()
+                    break
+                except WatchError:
+                    continue
+        self._batch.token = token
+
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(self.flushing_votes_key)
+        pipe.hgetall(self.flushing_deltas_key)
+        raw_votes, raw_deltas = pipe.execute()
+
+        votes = {}
+        for field, value in raw_votes.items():
+            post_id, user_id = (int(part) for part in _text(field).split(':'))
+            votes[(post_id, user_id)] = int(value)
+        deltas = {}
+        for field, delta in raw_deltas.items():
+            post_id, counter = _text(field).split(':')
+            up, down = deltas.get(int(post_id), (0, 0))
+            deltas[int(post_id)] = (up + int(delta), down) if counter == 'up' else (up, down + int(delta))
+        return votes, deltas
+
+    def _release(self, *commands):
+        """Runs ``commands`` on a pipeline and drops the batch, if this thread still holds it"""
+        from redis.exceptions import WatchError
+
+        token = getattr(self._batch, 'token', None)
+        self._batch.token = None
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.batch_key)
+                if _text(pipe.get(self.batch_key) or '') != token:
+                    # The lease ran out and another flush took the batch over
+                    return
+                pipe.multi()
+                for name, *args in commands:
+                    getattr(pipe, name)(*args)
+                pipe.delete(self.flushing_votes_key, self.flushing_deltas_key, self.batch_key)
+                pipe.execute()
+            except WatchError:
+                pass
+
+    def acknowledge(self):
+        self._release(('incr', self.generation_key))
+
+    def restore(self, votes, deltas):
+        commands = [
+            ('hsetnx', self.votes_key, self._field(post_id, user_id), value)
+            for (post_id, user_id), value in votes.items()
+        ]
+        for post_id, delta in deltas.items():
+            commands += self._delta_commands(post_id, delta)
+        self._release(*commands)
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """Returns the process-wide buffer for ``VOTE_BUFFER_URL``"""
+    url = getattr(settings, 'VOTE_BUFFER_URL', 'local://')
+    with _buffers_lock:
+        if url not in _buffers:
+            _buffers[url] = _create_buffer(url)
+        return _buffers[url]
+
+
+def _create_buffer(url):
+    if url.startswith('local://'):
+        return LocalVoteBuffer()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('VOTE_BUFFER_URL uses Redis but the redis package is not installed')
+        return RedisVoteBuffer(redis.Redis.from_url(url))
+    raise ImproperlyConfigured(f'Unsupported VOTE_BUFFER_URL: {url}')
+
+
+def is_enabled():
+    return getattr(settings, 'VOTE_WRITE_BEHIND', False)
+
+
+def flush_vote_buffer(buffer=None):
+    """Writes every buffered vote to the database; returns the number flushed"""
+    from . import ranking
+    from .models import Post, Vote
+
+    buffer = buffer or get_vote_buffer()
+    votes, deltas = buffer.drain()
+    if not votes:
+        return 0
+
+    try:
+        with transaction.atomic():
+            upserts = [
+                Vote(post_id=post_id, user_id=user_id, value=value)
+                for (post_id, user_id), value in votes.items() if value
+            ]
+            if upserts:
+                Vote.objects.bulk_create(
+                    upserts,
+                    update_conflicts=True,
+                    unique_fields=['post', 'user'],
+                    update_fields=['value'],
+                    batch_size=FLUSH_BATCH_SIZE,
+                )
+
+            removals = [key for key, value in votes.items() if not value]
+            for start in range(0, len(removals), FLUSH_BATCH_SIZE):
+                condition = Q()
+                for post_id, user_id in removals[start:start + FLUSH_BATCH_SIZE]:
+                    condition |= Q(post_id=post_id, user_id=user_id)
+                Vote.objects.filter(condition).delete()
+
+            # The deltas were taken against the rows each click replaced, so
+            # they move the counters exactly as the rows above did
+            changed = [post_id for post_id, delta in deltas.items() if any(delta)]
+            for post_id in changed:
+                up_delta, down_delta = deltas[post_id]
+                Post.objects.filter(pk=post_id).update(
+                    upvote_count=F('upvote_count') + up_delta,
+                    downvote_count=F('downvote_count') + down_delta,
+                    score=F('score') + up_delta - down_delta,
+                )
+            ranking.refresh_ranks(Post.objects.filter(pk__in=changed))
+    except Exception:
+        buffer.restore(votes, deltas)
+        raise
+
+    buffer.acknowledge()
+    return len(votes)
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(getattr(settings, 'VOTE_BUFFER_FLUSH_INTERVAL', 5))
+        try:
+            flushed = flush_vote_buffer()
+            if flushed:
+                logger.info(f"Flushed {flushed} buffered votes")
+        except Exception as e:
+            logger.error(f"Error flushing vote buffer: {e}")
+        finally:
+            close_old_connections()
+
+
+def ensure_flusher():
+    """Starts the background flush thread of this process if it is not running"""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name='vote-buffer-flusher', daemon=True)
+            _flusher.start()
+
+
+@atexit.register
+def _flush_on_exit():
+    # Local buffers die with the worker, so write out what is left
+    if _flusher is not None and is_enabled():
+        try:
+            flush_vote_buffer()
+        except Exception as e:
+            logger.error(f"Error flushing vote buffer on exit: {e}")
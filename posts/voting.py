@@ -0,0 +1,112 @@
+"""Recording votes on posts.
+
+Each (post, user) pair has at most one ``Vote`` row carrying +1 or -1, so a
+click is a single upsert or delete plus one UPDATE of the stored counters
+and rank keys.
+"""
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from reddit_clone.page_cache import invalidate_post_pages
+from . import ranking, vote_buffer
+from .models import Post, Vote
+
+VOTE_VALUES = {
+    'upvote': Vote.UPVOTE,
+    'downvote': Vote.DOWNVOTE,
+}
+
+
+def vote_count_subquery(value):
+    """Correlated count of a post's Vote rows with the given value"""
+    counts = (
+        Vote.objects.filter(post_id=OuterRef('pk'), value=value)
+        .order_by()
+        .values('post_id')
+        .annotate(c=Count('pk'))
+        .values('c')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def recount_votes(posts):
+    """Rebuilds the stored counters of every post in ``posts`` from Vote rows, and their ranks"""
+    with transaction.atomic():
+        posts.update(
+            upvote_count=vote_count_subquery(Vote.UPVOTE),
+            downvote_count=vote_count_subquery(Vote.DOWNVOTE),
+        )
+        posts.update(score=F('upvote_count') - F('downvote_count'))
+        # Ranks computed from the drifted counters would keep the post misordered
+        ranking.refresh_ranks(posts)
+
+
+def cast_vote(post, user, value):
+    """Toggles ``user``'s vote on ``post``: voting the same way twice removes it.
+
+    Returns ``(previous, current)`` vote values, each 1, -1 or 0.
+    """
+    if vote_buffer.is_enabled():
+        return buffer_vote(post, user, value)
+
+    with transaction.atomic():
+        # The post row is locked first, so a double click waits here and then
+        # reads the vote the first click wrote. The counter UPDATE below holds
+        # this lock until commit anyway, so votes on a post serialize no more
+        # than before.
+        post.upvote_count, post.downvote_count, post.score = (
+            Post.objects.select_for_update()
+            .filter(pk=post.pk)
+            .values_list('upvote_count', 'downvote_count', 'score')
+            .get()
+        )
+        votes = Vote.objects.filter(post=post, user=user)
+        previous = votes.values_list('value', flat=True).first() or 0
+
+        if previous == value:
+            votes.delete()
+            current = 0
+        else:
+            Vote.objects.bulk_create(
+                [Vote(post=post, user=user, value=value)],
+                update_conflicts=True,
+                unique_fields=['post', 'user'],
+                update_fields=['value'],
+            )
+            current = value
+
+        # Counters and rank keys in one UPDATE; the ranks are computed from
+        # the locked counters, which is what the F() expressions resolve to
+        up_delta, down_delta = vote_buffer.vote_deltas(previous, current)
+        post.upvote_count += up_delta
+        post.downvote_count += down_delta
+        post.score += up_delta - down_delta
+        ranks = ranking.compute_ranks(post)
+        for field, rank in ranks.items():
+            setattr(post, field, rank)
+        Post.objects.filter(pk=post.pk).update(
+            upvote_count=F('upvote_count') + up_delta,
+            downvote_count=F('downvote_count') + down_delta,
+            score=F('score') + up_delta - down_delta,
+            **ranks,
+        )
+
+    # Anonymous feed pages show the score, and the hot/top order depends on it
+    invalidate_post_pages(post.community_id)
+    return previous, current
+
+
+def buffer_vote(post, user, value):
+    """Write-behind variant of ``cast_vote``: the click only lands in the buffer"""
+    buffer = vote_buffer.get_vote_buffer()
+    previous, current = buffer.cast(
+        post.pk, user.pk, value,
+        lambda: Vote.objects.filter(post=post, user=user).values_list('value', flat=True).first() or 0,
+    )
+    vote_buffer.ensure_flusher()
+
+    post.pending_score_delta = buffer.pending_deltas([post.pk]).get(post.pk, 0)
+    # Rendered scores include the buffered delta, so cached pages are stale already
+    invalidate_post_pages(post.community_id)
+    return previous, current
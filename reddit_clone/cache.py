@@ -0,0 +1,164 @@
+"""Shared cache layer: backend selection, namespaced keys and stampede-safe reads.
+
+``CACHE_URL`` picks the backend for ``CACHES['default']``:
+
+* ``locmem://[name]`` - per-process memory (the default; not shared between workers)
+* ``file:///path/to/dir`` - files on a disk the workers share
+* ``redis://host:6379/0`` (also ``rediss://``, ``unix://``) - Redis, needs the redis package
+* ``dummy://`` - no caching
+
+Keys built with ``make_key`` live in a namespace whose version is stored in
+the cache itself, so ``bump_namespace`` invalidates every key of a namespace
+at once without scanning. ``get_or_compute`` protects expensive values from
+stampedes: one caller recomputes behind a short lock while the others wait
+or keep serving the old value, and hot values are refreshed a little before
+they expire (probabilistic early recomputation).
+"""
+import hashlib
+import math
+import random
+import time
+from urllib.parse import urlparse
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+DEFAULT_TIMEOUT = 300
+
+# Higher values refresh earlier; 1.0 is the usual choice for XFetch
+EARLY_RECOMPUTE_BETA = 1.0
+# How long a recompute may hold the lock, and how long others wait for it
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.05
+
+# Keys longer than this (e.g. with URLs in them) are hashed
+MAX_KEY_LENGTH = 200
+
+REDIS_SCHEMES = ('redis', 'rediss', 'unix')
+
+
+def parse_cache_url(url, key_prefix='', timeout=DEFAULT_TIMEOUT):
+    """Turns ``CACHE_URL`` into a ``CACHES`` entry"""
+    parsed = urlparse(url)
+    config = {'KEY_PREFIX': key_prefix, 'TIMEOUT': timeout}
+
+    if parsed.scheme == 'locmem':
+        config.update(
+            BACKEND='django.core.cache.backends.locmem.LocMemCache',
+            LOCATION=parsed.netloc or 'default',
+        )
+    elif parsed.scheme == 'file':
+        if not parsed.path:
+            raise ImproperlyConfigured('CACHE_URL file:// needs a directory, e.g. file:///var/tmp/django_cache')
+        config.update(
+            BACKEND='django.core.cache.backends.filebased.FileBasedCache',
+            LOCATION=parsed.path,
+        )
+    elif parsed.scheme in REDIS_SCHEMES:
+        # Django's backend imports redis-py on first use; fail at startup instead
+        try:
+            import redis  # noqa: F401
+        except ImportError:
+            raise ImproperlyConfigured('CACHE_URL uses Redis but the redis package is not installed')
+        config.update(
+            BACKEND='django.core.cache.backends.redis.RedisCache',
+            LOCATION=url,
+        )
+    elif parsed.scheme == 'dummy':
+        config.update(BACKEND='django.core.cache.backends.dummy.DummyCache')
+    else:
+        raise ImproperlyConfigured(f'Unsupported CACHE_URL: {url}')
+    return config
+
+
+def is_shared(url):
+    """Whether every worker sees the same cache for ``CACHE_URL``"""
+    return urlparse(url).scheme in REDIS_SCHEMES + ('file',)
+
+
+def get_cache(alias='default'):
+    return caches[alias]
+
+
+def _namespace_key(namespace):
+    return f'ns:{namespace}'
+
+
+def namespace_version(namespace, cache=None):
+    """Current version of a namespace, starting at 1"""
+    cache = cache or get_cache()
+    key = _namespace_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # add() so concurrent first readers agree on the starting version
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_namespace(namespace, cache=None):
+    """Invalidates every key made in ``namespace``; returns the new version"""
+    cache = cache or get_cache()
+    key = _namespace_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Never read or evicted: any version other than the old one will do
+        version = int(time.time() * 1000)
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def make_key(namespace, *parts, cache=None):
+    """``namespace:v<version>:part:part``, hashed when too long for a cache key"""
+    version = namespace_version(namespace, cache)
+    key = ':'.join([namespace, f'v{version}', *(str(part) for part in parts)])
+    if len(key) > MAX_KEY_LENGTH or any(char.isspace() for char in key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        key = f'{namespace}:v{version}:h:{digest}'
+    return key
+
+
+def get_or_compute(key, compute, timeout=DEFAULT_TIMEOUT, cache=None, beta=EARLY_RECOMPUTE_BETA):
+    """Returns the cached value for ``key``, computing it once on a miss.
+
+    Entries carry how long ``compute`` took and when they expire, so a hit
+    may decide to refresh early (XFetch); the closer the expiry and the
+    slower the computation, the likelier. Only the caller holding the
+    ``<key>:lock`` recomputes; the others serve the stale value, or on a
+    cold miss wait up to LOCK_WAIT seconds for it before computing anyway.
+    """
+    cache = cache or get_cache()
+    lock_key = f'{key}:lock'
+    entry = cache.get(key)
+
+    if entry is not None:
+        value, delta, expires_at = entry
+        if time.time() - delta * beta * math.log(1 - random.random()) < expires_at:
+            return value
+        if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            # Someone else is already refreshing it
+            return value
+    elif not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        # The lock holder is slow or gone; compute without the lock
+        return _compute_and_store(cache, key, compute, timeout)
+
+    try:
+        return _compute_and_store(cache, key, compute, timeout)
+    finally:
+        cache.delete(lock_key)
+
+
+def _compute_and_store(cache, key, compute, timeout):
+    started = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - started
+    cache.set(key, (value, delta, time.time() + timeout), timeout)
+    return value
@@ -0,0 +1,55 @@
+"""Conditional GET for pages whose freshness is cheaper to check than to render.
+
+``conditional_page(state)`` asks ``state(request, *view_args)`` for a small
+summary of what the page shows: anything hashable that changes with the
+content (counters, timestamps). A client whose ``If-None-Match`` still
+matches gets a 304 before the view runs; everyone else gets the full page
+with an ``ETag`` to revalidate against next time.
+
+The viewer's id is part of the ETag, since pages show per-viewer state, and
+responses are ``no-cache`` so every reuse is revalidated. No
+``Last-Modified`` is sent: votes and logins change these pages without
+moving any timestamp, so ``If-Modified-Since`` would answer 304 for stale
+content.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+
+
+def _etag(request, parts):
+    raw = repr((request.user.pk, parts)).encode()
+    return quote_etag(hashlib.sha1(raw, usedforsecurity=False).hexdigest())
+
+
+def conditional_page(state):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Pending flash messages must be rendered, not revalidated away
+            if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+                return view(request, *args, **kwargs)
+
+            parts = state(request, *args, **kwargs)
+            if parts is None:
+                # Nothing to compare against (e.g. a 404); the view decides
+                return view(request, *args, **kwargs)
+            etag = _etag(request, parts)
+
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                response.headers.setdefault('ETag', etag)
+                patch_vary_headers(response, ['Cookie'])
+                if request.user.is_authenticated:
+                    patch_cache_control(response, private=True)
+                patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
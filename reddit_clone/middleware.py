@@ -0,0 +1,141 @@
+"""Per-request SQL instrumentation: query count, DB time and the slowest statements.
+
+``QueryInstrumentationMiddleware`` times every statement through
+``connection.execute_wrapper`` (so it works with ``DEBUG`` off), logs one
+structured line per request on the ``reddit_clone.queries`` logger and, with
+``SERVER_TIMING_HEADER`` on, adds a ``Server-Timing`` header for the browser
+dev tools. Views declare how many queries a request may cost with
+``@query_budget(n)``; going over is logged as a warning, or raises
+``QueryBudgetExceeded`` with ``QUERY_BUDGET_STRICT`` on (meant for tests).
+The count covers the whole request, session and user lookups included.
+"""
+import heapq
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('reddit_clone.queries')
+
+# Statements kept per request for the log line, and how much of each
+SLOWEST_STATEMENTS = 3
+SQL_PREVIEW_LENGTH = 300
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries):
+    """Declares the most queries one request to the view may issue.
+
+    Works on function views and on class-based views (decorate the class).
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+class QueryRecorder:
+    """execute_wrapper that counts and times statements, keeping the slowest few"""
+
+    def __init__(self, keep=SLOWEST_STATEMENTS):
+        self.count = 0
+        self.duration = 0.0
+        self.keep = keep
+        self._slowest = []
+        self._seq = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            # Min-heap of (duration, seq, sql); seq keeps equal durations comparable
+            self._seq += 1
+            entry = (elapsed, self._seq, sql)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif elapsed > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        """[(milliseconds, sql)] of the slowest statements, slowest first"""
+        return [
+            (round(elapsed * 1000, 2), sql[:SQL_PREVIEW_LENGTH])
+            for elapsed, _, sql in sorted(self._slowest, reverse=True)
+        ]
+
+
+def _view_budget(view_func):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    return budget
+
+
+def _view_name(view_func):
+    view = getattr(view_func, 'view_class', view_func)
+    return f'{view.__module__}.{view.__qualname__}'
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        view = getattr(request, '_query_view', None)
+        budget = getattr(request, '_query_budget', None)
+        over_budget = budget is not None and recorder.count > budget
+        self.log(request, response, recorder, total, view, budget, over_budget)
+
+        if getattr(settings, 'SERVER_TIMING_HEADER', False):
+            response['Server-Timing'] = (
+                f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", '
+                f'app;dur={total * 1000:.1f}'
+            )
+
+        if over_budget and getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(
+                f'{view} issued {recorder.count} queries, budget is {budget}: '
+                + '; '.join(sql for _, sql in recorder.slowest())
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_view = _view_name(view_func)
+        request._query_budget = _view_budget(view_func)
+
+    def log(self, request, response, recorder, total, view, budget, over_budget):
+        fields = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'query_budget': budget,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'slowest_queries': recorder.slowest(),
+        }
+        message = ' '.join(
+            f'{key}={value}' for key, value in fields.items() if key != 'slowest_queries'
+        )
+        if over_budget:
+            logger.warning(f'Query budget exceeded: {message}', extra=fields)
+        else:
+            logger.info(message, extra=fields)
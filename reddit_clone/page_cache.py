@@ -0,0 +1,150 @@
+"""Whole-response cache for logged-out visitors.
+
+Views decorated with ``cache_anonymous_page(scope)`` serve anonymous GET
+requests from the shared cache and render normally for everyone else.
+Cached pages are keyed by path and the normalized query parameters the view
+reads, inside the ``page:<scope>`` namespace (see ``reddit_clone.cache``), so
+``invalidate_pages(scope)`` drops every page of a scope at once; posts and
+votes invalidate the feeds they appear in. Any other parameter (``?utm_...``)
+is dropped before the view renders, so junk query strings share the entry of
+the canonical URL instead of each filling the cache.
+
+Responses carry ``Vary: Cookie``, so logging in never shows a browser or
+proxy copy of the anonymous page, plus an ``ETag`` and ``Last-Modified``
+for 304 revalidation. Anonymous pages render without CSRF tokens, and
+any response that sets a cookie (a CSRF cookie, consumed messages) is
+never stored.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.http import HttpResponse, QueryDict
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, urlencode
+
+from .cache import bump_namespace, get_or_compute, make_key
+
+POSTS_SCOPE = 'posts'
+
+
+def community_scope(community_name):
+    return f'community:{community_name}'
+
+
+def _namespace(scope):
+    return f'page:{scope}'
+
+
+def invalidate_pages(*scopes):
+    for scope in scopes:
+        bump_namespace(_namespace(scope))
+
+
+def invalidate_post_pages(*community_ids):
+    """Drops the cached feeds a post of these communities shows up in"""
+    from communities.models import Community
+
+    community_ids = {community_id for community_id in community_ids if community_id is not None}
+    names = Community.objects.filter(pk__in=community_ids).values_list('name', flat=True) if community_ids else []
+    invalidate_pages(POSTS_SCOPE, *(community_scope(name) for name in names))
+
+
+class _Uncacheable(Exception):
+    """Carries a rendered response that must not be stored"""
+
+    def __init__(self, response):
+        self.response = response
+
+
+def _is_cacheable(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and 'private' not in response.get('Cache-Control', '')
+        and 'no-store' not in response.get('Cache-Control', '')
+    )
+
+
+def _bypass(request):
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return True
+    # Pending flash messages belong to this visitor's next render only
+    return len(get_messages(request)) > 0
+
+
+def _render_entry(view, request, args, kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    if not _is_cacheable(response):
+        raise _Uncacheable(response)
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'etag': '"%s"' % hashlib.md5(response.content, usedforsecurity=False).hexdigest(),
+        'last_modified': int(time.time()),
+    }
+
+
+def _canonical_query(request, query):
+    """Leaves ``request`` with only the parameters ``query`` returns; returns the query string"""
+    params = query(request) if query else {}
+    query_string = urlencode(sorted((name, value) for name, value in params.items() if value not in (None, '')))
+    request.GET = QueryDict(query_string)
+    request.META['QUERY_STRING'] = query_string
+    return query_string
+
+
+def cache_anonymous_page(scope, query=None, timeout=None):
+    """Caches the view's full response for anonymous visitors.
+
+    ``scope`` is the invalidation scope: a string, or a callable receiving
+    the view's arguments, e.g. ``lambda request, community_name: ...``.
+    ``query`` receives the request and returns ``{name: value}`` of the
+    query parameters the view reads, normalized (None when absent); without
+    it the page ignores its query string.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            page_timeout = settings.ANONYMOUS_PAGE_CACHE_TIMEOUT if timeout is None else timeout
+            if not page_timeout or _bypass(request):
+                response = view(request, *args, **kwargs)
+                patch_vary_headers(response, ['Cookie'])
+                if request.user.is_authenticated:
+                    patch_cache_control(response, private=True)
+                return response
+
+            page_scope = scope(request, *args, **kwargs) if callable(scope) else scope
+            key = make_key(_namespace(page_scope), f'{request.path}?{_canonical_query(request, query)}')
+            rendered = []
+
+            def render():
+                rendered.append(True)
+                return _render_entry(view, request, args, kwargs)
+
+            try:
+                entry = get_or_compute(key, render, page_timeout)
+            except _Uncacheable as uncacheable:
+                response = uncacheable.response
+                patch_vary_headers(response, ['Cookie'])
+                return response
+
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+            response['ETag'] = entry['etag']
+            response['Last-Modified'] = http_date(entry['last_modified'])
+            response['X-Page-Cache'] = 'miss' if rendered else 'hit'
+            patch_vary_headers(response, ['Cookie'])
+            patch_cache_control(response, public=True, max_age=page_timeout)
+            return get_conditional_response(
+                request,
+                etag=entry['etag'],
+                last_modified=entry['last_modified'],
+                response=response,
+            )
+        return wrapper
+    return decorator
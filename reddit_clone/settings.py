@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 from django.core.management.utils import get_random_secret_key
 import dj_database_url
+from reddit_clone.cache import is_shared, parse_cache_url
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -61,6 +62,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'reddit_clone.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -123,6 +125,34 @@ STATICFILES_FINDERS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Write-behind voting: buffer clicks and flush them in bulk (see posts.vote_buffer)
+VOTE_WRITE_BEHIND = os.environ.get('VOTE_WRITE_BEHIND', 'False').lower() == 'true'
+VOTE_BUFFER_URL = os.environ.get('VOTE_BUFFER_URL', 'local://')
+VOTE_BUFFER_FLUSH_INTERVAL = float(os.environ.get('VOTE_BUFFER_FLUSH_INTERVAL', '5'))
+
+# Cache shared by the workers (see reddit_clone.cache): locmem://, file:///dir or redis://host:6379/0
+CACHE_URL = os.environ.get('CACHE_URL', 'locmem://')
+CACHES = {
+    'default': parse_cache_url(
+        CACHE_URL,
+        key_prefix=os.environ.get('CACHE_KEY_PREFIX', 'reddit_clone'),
+        timeout=int(os.environ.get('CACHE_TIMEOUT', '300')),
+    ),
+}
+if is_shared(CACHE_URL):
+    # Sessions read from the shared cache and fall back to the database
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Seconds a logged-out visitor's feed page stays cached; new posts and votes invalidate it sooner
+ANONYMOUS_PAGE_CACHE_TIMEOUT = int(os.environ.get('ANONYMOUS_PAGE_CACHE_TIMEOUT', '30'))
+
+# Seconds a rendered post card body stays cached; edits and media changes invalidate it sooner
+POST_CARD_CACHE_TIMEOUT = int(os.environ.get('POST_CARD_CACHE_TIMEOUT', '3600'))
+
+# Per-request SQL instrumentation (see reddit_clone.middleware)
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', str(DEBUG)).lower() == 'true'
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'False').lower() == 'true'
+
 # Authentication
 LOGIN_URL = '/users/login/'
 LOGIN_REDIRECT_URL = '/'
@@ -132,6 +162,27 @@ LOGOUT_REDIRECT_URL = '/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Media uploads (see posts.media_pipeline): staged on local disk and pushed by a thread pool;
+# MEDIA_UPLOAD_WORKERS also bounds the parallel uploads of one request in sync mode
+MEDIA_STAGING_ROOT = os.environ.get('MEDIA_STAGING_ROOT', os.path.join(BASE_DIR, 'media_staging'))
+MEDIA_UPLOAD_WORKERS = int(os.environ.get('MEDIA_UPLOAD_WORKERS', '4'))
+# Django's upload handlers, hashing each file as it arrives (posts.blobs)
+FILE_UPLOAD_HANDLERS = [
+    'posts.blobs.HashingMemoryFileUploadHandler',
+    'posts.blobs.HashingTemporaryFileUploadHandler',
+]
+# Largest file a resumable upload (posts.uploads) may announce, in bytes
+MEDIA_UPLOAD_MAX_SIZE = int(os.environ.get('MEDIA_UPLOAD_MAX_SIZE', str(5 * 1024 ** 3)))
+# Responsive copies of uploaded images (posts.derivatives): widths in px, formats best first
+MEDIA_DERIVATIVE_WIDTHS = [
+    int(width) for width in os.environ.get('MEDIA_DERIVATIVE_WIDTHS', '320,640,1080').split(',')
+]
+MEDIA_DERIVATIVE_FORMATS = os.environ.get('MEDIA_DERIVATIVE_FORMATS', 'avif,webp,jpeg').split(',')
+# Seconds a direct-to-storage upload ticket (posts.direct_uploads) stays valid
+MEDIA_DIRECT_UPLOAD_TTL = int(os.environ.get('MEDIA_DIRECT_UPLOAD_TTL', '900'))
+# Upload inside the request instead, a post's files in parallel (tests, single-process setups)
+MEDIA_PIPELINE_SYNC = os.environ.get('MEDIA_PIPELINE_SYNC', 'False').lower() == 'true'
+
 # Cloudinary configuration
 CLOUDINARY_STORAGE = {
     'CLOUD_NAME': os.environ.get('CLOUDINARY_CLOUD_NAME'),
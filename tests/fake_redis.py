@@ -0,0 +1,366 @@
+"""In-process stand-in for a Redis server, for tests of the Redis code paths.
+
+Speaks RESP2 over TCP on 127.0.0.1 and implements the string, key, hash and
+WATCH/MULTI/EXEC commands the cache backend and the vote buffer use, so redis-py
+talks to it exactly as it would to a real server::
+
+    with FakeRedisServer() as server:
+        client = redis.Redis.from_url(server.url)
+"""
+import socketserver
+import threading
+import time
+
+OK = b'+OK\r\n'
+NULL = b'$-1\r\n'
+
+
+def _int(value):
+    return b':%d\r\n' % value
+
+
+def _bulk(value):
+    if value is None:
+        return NULL
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def _array(items):
+    return b'*%d\r\n' % len(items) + b''.join(items)
+
+
+def _error(message):
+    return b'-' + message.encode() + b'\r\n'
+
+
+class CommandError(Exception):
+    pass
+
+
+class FakeRedisStore:
+    """Keyspace of every database, shared by all connections"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.databases = {}
+        self.commands = []
+        # Write count per (db, key), for WATCH
+        self.versions = {}
+
+    def db(self, index):
+        return self.databases.setdefault(index, {})
+
+    def _live(self, db, key):
+        entry = db.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del db[key]
+            return None
+        return entry
+
+    def _string(self, db, key):
+        entry = self._live(db, key)
+        if entry is None:
+            return None
+        if not isinstance(entry[0], bytes):
+            raise CommandError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return entry[0]
+
+    def _hash(self, db, key, create=False):
+        entry = self._live(db, key)
+        if entry is None:
+            if not create:
+                return {}
+            entry = db[key] = [{}, None]
+        if not isinstance(entry[0], dict):
+            raise CommandError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return entry[0]
+
+    def execute(self, db_index, name, args):
+        handler = getattr(self, f'cmd_{name}', None)
+        if handler is None:
+            raise CommandError(f"ERR unknown command '{name}'")
+        with self.lock:
+            self.commands.append(name)
+            reply = handler(self.db(db_index), *args)
+            for key in self._written_keys(db_index, name, args):
+                self.versions[(db_index, key)] = self.versions.get((db_index, key), 0) + 1
+            return reply
+
+    WRITE_COMMANDS = {
+        'set', 'incrby', 'incr', 'decrby', 'expire', 'persist',
+        'hset', 'hsetnx', 'hincrby',
+    }
+
+    def _written_keys(self, db_index, name, args):
+        if name in self.WRITE_COMMANDS:
+            return args[:1]
+        if name in ('del', 'rename'):
+            return args
+        if name == 'mset':
+            return args[::2]
+        if name == 'flushdb':
+            return [key for db, key in self.versions if db == db_index]
+        return []
+
+    def version(self, db_index, key):
+        with self.lock:
+            return self.versions.get((db_index, key), 0)
+
+    # Connection
+
+    def cmd_ping(self, db, *args):
+        return b'+PONG\r\n'
+
+    def cmd_client(self, db, *args):
+        return OK
+
+    # Strings
+
+    def cmd_get(self, db, key):
+        return _bulk(self._string(db, key))
+
+    def cmd_mget(self, db, *keys):
+        return _array([_bulk(self._live_string(db, key)) for key in keys])
+
+    def _live_string(self, db, key):
+        entry = self._live(db, key)
+        return entry[0] if entry is not None and isinstance(entry[0], bytes) else None
+
+    def cmd_set(self, db, key, value, *options):
+        expires_at = None
+        nx = xx = False
+        i = 0
+        while i < len(options):
+            option = options[i].upper()
+            if option == b'EX':
+                expires_at = time.time() + int(options[i + 1])
+                i += 1
+            elif option == b'PX':
+                expires_at = time.time() + int(options[i + 1]) / 1000
+                i += 1
+            elif option == b'NX':
+                nx = True
+            elif option == b'XX':
+                xx = True
+            else:
+                raise CommandError('ERR syntax error')
+            i += 1
+
+        exists = self._live(db, key) is not None
+        if (nx and exists) or (xx and not exists):
+            return NULL
+        db[key] = [value, expires_at]
+        return OK
+
+    def cmd_mset(self, db, *pairs):
+        for key, value in zip(pairs[::2], pairs[1::2]):
+            db[key] = [value, None]
+        return OK
+
+    def cmd_incrby(self, db, key, amount):
+        current = self._string(db, key)
+        try:
+            value = int(current or 0) + int(amount)
+        except ValueError:
+            raise CommandError('ERR value is not an integer or out of range')
+        expires_at = db[key][1] if key in db else None
+        db[key] = [str(value).encode(), expires_at]
+        return _int(value)
+
+    def cmd_incr(self, db, key):
+        return self.cmd_incrby(db, key, b'1')
+
+    def cmd_decrby(self, db, key, amount):
+        return self.cmd_incrby(db, key, str(-int(amount)).encode())
+
+    # Keys
+
+    def cmd_del(self, db, *keys):
+        removed = 0
+        for key in keys:
+            if self._live(db, key) is not None:
+                del db[key]
+                removed += 1
+        return _int(removed)
+
+    def cmd_exists(self, db, *keys):
+        return _int(sum(1 for key in keys if self._live(db, key) is not None))
+
+    def cmd_expire(self, db, key, seconds):
+        entry = self._live(db, key)
+        if entry is None:
+            return _int(0)
+        entry[1] = time.time() + int(seconds)
+        return _int(1)
+
+    def cmd_persist(self, db, key):
+        entry = self._live(db, key)
+        if entry is None or entry[1] is None:
+            return _int(0)
+        entry[1] = None
+        return _int(1)
+
+    def cmd_ttl(self, db, key):
+        entry = self._live(db, key)
+        if entry is None:
+            return _int(-2)
+        if entry[1] is None:
+            return _int(-1)
+        return _int(max(int(entry[1] - time.time()), 0))
+
+    def cmd_rename(self, db, key, new_key):
+        entry = self._live(db, key)
+        if entry is None:
+            raise CommandError('ERR no such key')
+        del db[key]
+        db[new_key] = entry
+        return OK
+
+    def cmd_flushdb(self, db, *args):
+        db.clear()
+        return OK
+
+    # Hashes
+
+    def cmd_hset(self, db, key, *pairs):
+        values = self._hash(db, key, create=True)
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in values
+            values[field] = value
+        return _int(added)
+
+    def cmd_hsetnx(self, db, key, field, value):
+        values = self._hash(db, key, create=True)
+        if field in values:
+            return _int(0)
+        values[field] = value
+        return _int(1)
+
+    def cmd_hget(self, db, key, field):
+        return _bulk(self._hash(db, key).get(field))
+
+    def cmd_hmget(self, db, key, *fields):
+        values = self._hash(db, key)
+        return _array([_bulk(values.get(field)) for field in fields])
+
+    def cmd_hgetall(self, db, key):
+        items = []
+        for field, value in self._hash(db, key).items():
+            items += [_bulk(field), _bulk(value)]
+        return _array(items)
+
+    def cmd_hincrby(self, db, key, field, amount):
+        values = self._hash(db, key, create=True)
+        value = int(values.get(field, b'0')) + int(amount)
+        values[field] = str(value).encode()
+        return _int(value)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store = self.server.store
+        db_index = 0
+        queued = None
+        watched = {}
+
+        while True:
+            try:
+                args = self.read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+
+            name = args[0].decode().lower()
+            if name == 'select':
+                db_index = int(args[1])
+                reply = OK
+            elif name == 'multi':
+                queued = []
+                reply = OK
+            elif name == 'watch':
+                watched.update({(db_index, key): store.version(db_index, key) for key in args[1:]})
+                reply = OK
+            elif name == 'unwatch':
+                watched = {}
+                reply = OK
+            elif name == 'exec':
+                # Commands of a transaction run back to back under the store lock,
+                # unless a watched key was written since WATCH
+                with store.lock:
+                    if any(store.version(*key) != version for key, version in watched.items()):
+                        reply = b'*-1\r\n'
+                    else:
+                        reply = _array([self.run(store, db_index, *command) for command in queued or []])
+                queued = None
+                watched = {}
+            elif name == 'discard':
+                queued = None
+                watched = {}
+                reply = OK
+            elif queued is not None:
+                queued.append((name, args[1:]))
+                reply = b'+QUEUED\r\n'
+            else:
+                reply = self.run(store, db_index, name, args[1:])
+            self.wfile.write(reply)
+
+    @staticmethod
+    def run(store, db_index, name, args):
+        try:
+            return store.execute(db_index, name, args)
+        except CommandError as e:
+            return _error(str(e))
+        except (TypeError, IndexError):
+            return _error(f"ERR wrong number of arguments for '{name}' command")
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeRedisServer:
+    """Serves a FakeRedisStore on a free local port until stopped"""
+
+    def __init__(self):
+        self.store = FakeRedisStore()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        # RESP2 only: protocol=2 stops redis-py from opening with HELLO 3
+        host, port = self._server.server_address
+        return f'redis://{host}:{port}/0?protocol=2'
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.store = self.store
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-redis', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,112 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from communities.models import Community
+from posts.models import Post
+
+
+class AnonymousPageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author', password='testpass123')
+        self.community = Community.objects.create(name='cached', description='d', created_by=self.user)
+        self.post = Post.objects.create(
+            title='First post', content='body', author=self.user, community=self.community
+        )
+        self.urls = [
+            reverse('post_list'),
+            reverse('communities:community_detail', args=[self.community.name]),
+        ]
+
+    def test_second_request_is_served_from_cache(self):
+        for url in self.urls:
+            first = self.client.get(url)
+            self.assertEqual(first['X-Page-Cache'], 'miss')
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second['X-Page-Cache'], 'hit')
+            self.assertEqual(second.content, first.content)
+
+    def test_headers(self):
+        response = self.client.get(self.urls[0])
+        self.assertIn('Cookie', response['Vary'])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+
+    def test_etag_revalidation(self):
+        etag = self.client.get(self.urls[0])['ETag']
+        response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_pages_carry_no_csrf_token(self):
+        response = self.client.get(self.urls[0])
+        self.assertNotContains(response, 'name="csrfmiddlewaretoken"')
+        self.assertNotIn('csrftoken', response.cookies)
+
+    def test_authenticated_users_bypass_cache(self):
+        for url in self.urls:
+            self.client.get(url)
+        self.client.force_login(self.user)
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertNotIn('X-Page-Cache', response)
+            self.assertIn('private', response['Cache-Control'])
+            self.assertIn('Cookie', response['Vary'])
+            self.assertContains(response, 'author')
+
+    def test_new_post_invalidates_its_scopes(self):
+        for url in self.urls:
+            self.client.get(url)
+        Post.objects.create(title='Fresh post', content='body', author=self.user, community=self.community)
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'miss')
+            self.assertContains(response, 'Fresh post')
+
+    def test_post_elsewhere_leaves_other_communities_cached(self):
+        other = Community.objects.create(name='other', description='d', created_by=self.user)
+        self.client.get(self.urls[1])
+        Post.objects.create(title='Elsewhere', content='body', author=self.user, community=other)
+        self.assertEqual(self.client.get(self.urls[1])['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get(self.urls[0])['X-Page-Cache'], 'miss')
+
+    def test_vote_invalidates(self):
+        self.client.get(self.urls[0])
+        voter = User.objects.create_user(username='voter', password='testpass123')
+        self.client.force_login(voter)
+        self.client.post(reverse('vote_post', args=[self.post.pk, 'upvote']))
+        self.client.logout()
+
+        response = self.client.get(self.urls[0])
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, '<strong>1</strong>')
+
+    def test_pending_messages_skip_cache(self):
+        self.client.get(self.urls[0])
+        # Anonymous votes redirect to the login page with an error message
+        self.client.post(reverse('vote_post', args=[self.post.pk, 'upvote']))
+        response = self.client.get(self.urls[0])
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertContains(response, 'Please log in to vote.')
+
+    def test_unread_query_parameters_share_one_entry(self):
+        post_list, community = self.urls
+        self.assertEqual(self.client.get(post_list + '?sort=new')['X-Page-Cache'], 'miss')
+        for url in [post_list, post_list + '?utm_source=x', post_list + '?x=2&sort=new', post_list + '?sort=bogus']:
+            response = self.client.get(url)
+            self.assertEqual(response['X-Page-Cache'], 'hit', url)
+            self.assertNotContains(response, 'utm_source')
+        # A parameter the view reads still gets its own page
+        self.assertEqual(self.client.get(post_list + '?sort=hot')['X-Page-Cache'], 'miss')
+
+        self.assertEqual(self.client.get(community)['X-Page-Cache'], 'miss')
+        for url in [community + '?sort=hot', community + '?cursor=not-a-cursor', community + '?page=2']:
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit', url)
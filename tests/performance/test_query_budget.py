@@ -0,0 +1,82 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from comments.models import Comment
+from communities.models import Community
+from posts.models import Post, PostMedia
+from posts.views import PostListView
+from reddit_clone.middleware import QueryBudgetExceeded, QueryRecorder
+
+
+class QueryInstrumentationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.community = Community.objects.create(name='test', description='d', created_by=self.user)
+        self.community.members.add(self.user)
+        self.posts = [
+            Post.objects.create(title=f'Post {i}', content='c', author=self.user, community=self.community)
+            for i in range(25)
+        ]
+        for post in self.posts:
+            PostMedia.objects.create(post=post, media_file='post_media/a.jpg')
+        for _ in range(25):
+            root = Comment.objects.create(post=self.posts[-1], author=self.user, content='c')
+            Comment.objects.create(post=self.posts[-1], author=self.user, parent=root, content='r')
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('post_list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+$')
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_no_header_when_disabled(self):
+        response = self.client.get(reverse('post_list'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_structured_log_line(self):
+        with self.assertLogs('reddit_clone.queries', 'INFO') as logs:
+            self.client.get(reverse('post_list'))
+        record = logs.records[-1]
+        self.assertEqual(record.view, 'posts.views.PostListView')
+        self.assertEqual(record.query_budget, PostListView.query_budget)
+        self.assertGreater(record.queries, 0)
+        self.assertLessEqual(len(record.slowest_queries), 3)
+        self.assertIn('queries=', record.getMessage())
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_over_budget_is_logged(self):
+        with mock.patch.object(PostListView, 'query_budget', 1):
+            with self.assertLogs('reddit_clone.queries', 'WARNING') as logs:
+                self.client.get(reverse('post_list'))
+        self.assertIn('Query budget exceeded', logs.output[-1])
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_strict_mode_fails_loudly(self):
+        with mock.patch.object(PostListView, 'query_budget', 1), self.assertLogs('reddit_clone.queries'):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('post_list'))
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_views_stay_within_budget(self):
+        post = self.posts[-1]
+        for logged_in in (False, True):
+            if logged_in:
+                self.client.force_login(self.user)
+            self.client.get(reverse('post_list'))
+            self.client.get(reverse('post_feed'))
+            self.client.get(reverse('post_detail', args=[post.pk]))
+            self.client.get(reverse('comments:load_more_comments', args=[post.pk]))
+            self.client.get(reverse('communities:community_list'))
+            self.client.get(reverse('communities:community_detail', args=['test']))
+        self.client.post(reverse('vote_post', args=[post.pk, 'upvote']))
+        self.client.post(reverse('vote_post', args=[post.pk, 'downvote']))
+
+    def test_recorder_keeps_slowest(self):
+        recorder = QueryRecorder(keep=2)
+        for delay, sql in [(0.003, 'a'), (0.001, 'b'), (0.005, 'c')]:
+            with mock.patch('reddit_clone.middleware.time.perf_counter', side_effect=[0, delay]):
+                recorder(lambda *args: None, sql, None, False, {})
+        self.assertEqual(recorder.count, 3)
+        self.assertEqual([sql for _, sql in recorder.slowest()], ['c', 'a'])
@@ -0,0 +1,223 @@
+"""EXPLAIN every query the main views issue and fail on full scans of large tables.
+
+Runs against whichever database is configured: SQLite by default, or a local
+PostgreSQL when ``DATABASE_URL`` points at one, e.g.
+``DATABASE_URL=postgres://localhost/reddit_clone python manage.py test tests.performance``.
+CI runs it on both (the ``query-plans`` job in .github/workflows/test.yml).
+SQLite's planner is not PostgreSQL's, so ``IndexDefinitionTest`` also checks
+that the migrations create the indexes those plans rely on, column by column.
+"""
+import re
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from communities.models import Community
+from comments.models import Comment, encode_path_segment
+from posts import ranking
+from posts.models import Post, PostMedia, Vote
+
+# Tables that grow without bound; a sequential scan of any of them is a regression
+LARGE_TABLES = {
+    'auth_user',
+    'posts_post',
+    'posts_postmedia',
+    'posts_vote',
+    'comments_comment',
+    'communities_community_members',
+    'communities_community_moderators',
+}
+
+# Composite indexes behind the plans below: table -> {name: [(column, order)]}
+HOT_PATH_INDEXES = {
+    'posts_post': {
+        'post_new_idx': [('created_at', 'DESC'), ('id', 'DESC')],
+        'post_hot_idx': [('hot_rank', 'DESC'), ('id', 'DESC')],
+        'post_top_idx': [('score', 'DESC'), ('id', 'DESC')],
+        'post_rising_idx': [('rising_rank', 'DESC'), ('id', 'DESC')],
+        'post_controversial_idx': [('controversy_rank', 'DESC'), ('id', 'DESC')],
+        'post_community_new_idx': [('community_id', 'ASC'), ('created_at', 'DESC'), ('id', 'DESC')],
+    },
+    'posts_postmedia': {
+        'postmedia_post_idx': [('post_id', 'ASC'), ('created_at', 'ASC'), ('id', 'ASC')],
+    },
+    'posts_vote': {
+        'vote_user_post_idx': [('user_id', 'ASC'), ('post_id', 'ASC')],
+    },
+    'comments_comment': {
+        'comment_thread_idx': [('post_id', 'ASC'), ('path', 'ASC')],
+        'comment_post_date_idx': [('post_id', 'ASC'), ('created_at', 'ASC'), ('id', 'ASC')],
+        'comment_root_date_idx': [('post_id', 'ASC'), ('depth', 'ASC'), ('created_at', 'ASC'), ('id', 'ASC')],
+        'comment_root_top_idx': [('post_id', 'ASC'), ('depth', 'ASC'), ('reply_count', 'DESC'), ('id', 'DESC')],
+        'comment_post_updated_idx': [('post_id', 'ASC'), ('updated_at', 'ASC')],
+    },
+    'communities_community': {
+        'community_top_idx': [('member_count', 'DESC'), ('id', 'DESC')],
+    },
+}
+
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+POSTGRES_SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def full_scans(sql):
+    """Tables read by a full sequential scan in the plan of ``sql``"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            matches = (SQLITE_FULL_SCAN.match(row[-1]) for row in cursor.fetchall())
+        else:
+            cursor.execute('EXPLAIN ' + sql)
+            matches = (POSTGRES_SEQ_SCAN.search(row[0]) for row in cursor.fetchall())
+        return {match.group(1) for match in matches if match}
+
+
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create(
+            [User(username=f'user{i}', password='!') for i in range(5000)]
+        )
+        cls.user = cls.users[0]
+        cls.communities = Community.objects.bulk_create([
+            Community(name=f'community{i}', description='d', created_by=cls.user) for i in range(20)
+        ])
+        cls.community = cls.communities[0]
+        Community.members.through.objects.bulk_create([
+            Community.members.through(community=community, user=user)
+            for community in cls.communities for user in cls.users[:100]
+        ])
+        # As many rows as the members table: with a couple of hundred,
+        # PostgreSQL rightly reads the whole table instead of the index
+        Community.moderators.through.objects.bulk_create([
+            Community.moderators.through(community=community, user=user)
+            for community in cls.communities for user in cls.users[:100]
+        ])
+
+        # A year of posts, newest last, so the time windows select realistic slices
+        now = timezone.now()
+        posts = []
+        for i in range(5000):
+            post = Post(
+                title=f'Post {i}', content='c', author=cls.users[i % 5000],
+                community=cls.communities[i % 20], upvote_count=i % 50, score=i % 50,
+                created_at=now - timedelta(hours=(4999 - i) * 1.75),
+            )
+            for field, value in ranking.compute_ranks(post, now).items():
+                setattr(post, field, value)
+            posts.append(post)
+        created_at_field = Post._meta.get_field('created_at')
+        created_at_field.auto_now_add = False
+        try:
+            posts = Post.objects.bulk_create(posts)
+        finally:
+            created_at_field.auto_now_add = True
+        cls.post = posts[-1]
+        PostMedia.objects.bulk_create([
+            PostMedia(post=post, media_file=f'post_media/{post.pk}.jpg', media_type='image')
+            for post in posts
+        ])
+        Vote.objects.bulk_create([
+            Vote(post=post, user=user, value=Vote.UPVOTE)
+            for post in posts[-100:] for user in cls.users[:50]
+        ])
+
+        roots = Comment.objects.bulk_create([
+            Comment(post=post, author=cls.user, content='c') for post in posts[-50:] for _ in range(40)
+        ])
+        for root in roots:
+            root.path = encode_path_segment(root.pk)
+        Comment.objects.bulk_update(roots, ['path'], batch_size=1000)
+        replies = Comment.objects.bulk_create([
+            Comment(post=root.post, author=cls.user, parent=root, depth=1, content='c')
+            for root in roots for _ in range(3)
+        ])
+        for reply in replies:
+            reply.path = reply.parent.path + encode_path_segment(reply.pk)
+        Comment.objects.bulk_update(replies, ['path'], batch_size=1000)
+
+        # Planner statistics, as a production database would have
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertNoFullScans(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertLess(response.status_code, 400, url)
+
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            scanned = full_scans(sql) & LARGE_TABLES
+            self.assertFalse(scanned, f'{url} scans {sorted(scanned)}:\n{sql}')
+        return response
+
+    def test_post_list(self):
+        self.client.force_login(self.user)
+        for sort in ['new', 'hot', 'rising', 'controversial']:
+            response = self.assertNoFullScans('get', reverse('post_list'), {'sort': sort})
+        for period in ['hour', 'day', 'week', 'all']:
+            response = self.assertNoFullScans('get', reverse('post_list'), {'sort': 'top', 't': period})
+        self.assertNoFullScans(
+            'get', reverse('post_list'), {'sort': 'top', 't': 'all', 'cursor': response.context['next_cursor']}
+        )
+
+    def test_post_feed(self):
+        self.client.force_login(self.user)
+        self.assertNoFullScans('get', reverse('post_feed'))
+        self.assertNoFullScans('get', reverse('post_feed'), {'community': self.community.name})
+
+    def test_post_detail_and_comments(self):
+        self.client.force_login(self.user)
+        url = reverse('post_detail', args=[self.post.pk])
+        for sort in ['old', 'new', 'top']:
+            response = self.assertNoFullScans('get', url, {'comment_sort': sort})
+        self.assertNoFullScans(
+            'get', reverse('comments:load_more_comments', args=[self.post.pk]),
+            {'sort': 'top', 'cursor': response.context['comments_next_cursor']}
+        )
+
+    def test_voting(self):
+        self.client.force_login(self.users[-1])
+        self.assertNoFullScans('post', reverse('vote_post', args=[self.post.pk, 'upvote']))
+
+    def test_communities(self):
+        self.client.force_login(self.user)
+        self.assertNoFullScans('get', reverse('communities:community_list'))
+        response = self.assertNoFullScans(
+            'get', reverse('communities:community_detail', args=[self.community.name])
+        )
+        self.assertNoFullScans(
+            'get', reverse('communities:community_detail', args=[self.community.name]),
+            {'cursor': response.context['next_cursor']}
+        )
+        self.assertNoFullScans('get', reverse('communities:my_communities'))
+
+    def test_detects_full_scans(self):
+        # Guard against the plan parser silently matching nothing
+        self.assertIn('posts_post', full_scans("SELECT id FROM posts_post WHERE content = 'c'"))
+
+
+class IndexDefinitionTest(TestCase):
+    def test_migrations_create_hot_path_indexes(self):
+        # The test database is built by running the migrations
+        with connection.cursor() as cursor:
+            for table, indexes in HOT_PATH_INDEXES.items():
+                constraints = connection.introspection.get_constraints(cursor, table)
+                for name, columns in indexes.items():
+                    with self.subTest(index=name):
+                        self.assertIn(name, constraints)
+                        index = constraints[name]
+                        self.assertTrue(index['index'])
+                        self.assertEqual(list(zip(index['columns'], index['orders'])), columns)
+
+    def test_models_and_migrations_agree(self):
+        # An index changed on a model without its migration would pass the test above
+        call_command('makemigrations', '--check', '--dry-run', stdout=StringIO())
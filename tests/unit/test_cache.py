@@ -0,0 +1,150 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from reddit_clone import cache as cache_layer
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class ParseCacheUrlTest(SimpleTestCase):
+    def test_backends(self):
+        cases = {
+            'locmem://': ('django.core.cache.backends.locmem.LocMemCache', 'default'),
+            'locmem://feeds': ('django.core.cache.backends.locmem.LocMemCache', 'feeds'),
+            'file:///var/tmp/cache': ('django.core.cache.backends.filebased.FileBasedCache', '/var/tmp/cache'),
+        }
+        for url, (backend, location) in cases.items():
+            config = cache_layer.parse_cache_url(url, key_prefix='app', timeout=60)
+            self.assertEqual(config['BACKEND'], backend)
+            self.assertEqual(config['LOCATION'], location)
+            self.assertEqual((config['KEY_PREFIX'], config['TIMEOUT']), ('app', 60))
+
+    @unittest.skipUnless(redis, 'redis package not installed')
+    def test_redis(self):
+        config = cache_layer.parse_cache_url('redis://cache:6379/1')
+        self.assertEqual(config['BACKEND'], 'django.core.cache.backends.redis.RedisCache')
+        self.assertEqual(config['LOCATION'], 'redis://cache:6379/1')
+
+    def test_shared(self):
+        self.assertFalse(cache_layer.is_shared('locmem://'))
+        self.assertTrue(cache_layer.is_shared('file:///tmp/x'))
+        self.assertTrue(cache_layer.is_shared('redis://cache:6379/0'))
+
+    def test_unsupported(self):
+        for url in ['memcached://cache:11211', 'file://']:
+            with self.assertRaises(ImproperlyConfigured):
+                cache_layer.parse_cache_url(url)
+
+
+class CacheLayerTests:
+    """Behaviour every backend must show; mixed into a TestCase with ``make_cache``"""
+
+    def setUp(self):
+        self.cache = self.make_cache()
+        self.cache.clear()
+
+    def test_basic_operations(self):
+        self.cache.set('a', {'x': 1})
+        self.assertEqual(self.cache.get('a'), {'x': 1})
+        self.assertFalse(self.cache.add('a', 2))
+        self.cache.set_many({'b': 1, 'c': 2})
+        self.assertEqual(self.cache.get_many(['b', 'c', 'missing']), {'b': 1, 'c': 2})
+        self.assertEqual(self.cache.incr('b', 5), 6)
+        self.cache.delete('a')
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_namespaces(self):
+        key = cache_layer.make_key('feed', 'new', 1, cache=self.cache)
+        self.assertEqual(key, 'feed:v1:new:1')
+        self.cache.set(key, 'page')
+
+        cache_layer.bump_namespace('feed', cache=self.cache)
+        new_key = cache_layer.make_key('feed', 'new', 1, cache=self.cache)
+        self.assertNotEqual(new_key, key)
+        self.assertIsNone(self.cache.get(new_key))
+        # Other namespaces are untouched
+        self.assertEqual(cache_layer.make_key('counts', 'x', cache=self.cache), 'counts:v1:x')
+
+    def test_long_keys_are_hashed(self):
+        key = cache_layer.make_key('page', '/posts/?' + 'x' * 300, cache=self.cache)
+        self.assertLessEqual(len(key), cache_layer.MAX_KEY_LENGTH)
+        self.assertTrue(key.startswith('page:v1:h:'))
+
+    def test_get_or_compute(self):
+        compute = mock.Mock(return_value=42)
+        for _ in range(3):
+            self.assertEqual(cache_layer.get_or_compute('answer', compute, cache=self.cache), 42)
+        self.assertEqual(compute.call_count, 1)
+
+    def test_cold_miss_computes_once_under_concurrency(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                cache_layer.get_or_compute('slow', compute, cache=self.cache)
+            ))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+
+    def test_early_recompute_near_expiry(self):
+        # Computed in 1s, expiring in 0.5s: recomputing early is all but certain
+        self.cache.set('hot', ('old', 1.0, time.time() + 0.5), 60)
+        value = cache_layer.get_or_compute('hot', lambda: 'new', cache=self.cache, beta=50)
+        self.assertEqual(value, 'new')
+
+    def test_stale_value_served_while_another_caller_refreshes(self):
+        self.cache.set('hot', ('old', 1.0, time.time() + 0.5), 60)
+        self.cache.add('hot:lock', 1, 10)
+        compute = mock.Mock(return_value='new')
+        value = cache_layer.get_or_compute('hot', compute, cache=self.cache, beta=50)
+        self.assertEqual(value, 'old')
+        compute.assert_not_called()
+
+
+class LocMemCacheLayerTest(CacheLayerTests, SimpleTestCase):
+    def make_cache(self):
+        return LocMemCache('cache-layer-tests', {})
+
+
+@unittest.skipUnless(redis, 'redis package not installed')
+class RedisCacheLayerTest(CacheLayerTests, SimpleTestCase):
+    """Django's Redis backend talking RESP to the in-process fake server"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from tests.fake_redis import FakeRedisServer
+        cls.server = FakeRedisServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def make_cache(self):
+        from django.core.cache.backends.redis import RedisCache
+        return RedisCache(self.server.url, {'KEY_PREFIX': 'test'})
+
+    def test_keys_reach_the_server(self):
+        self.cache.set('a', 1)
+        self.assertIn(b'test:1:a', self.server.store.db(0))